@@ -2,3 +2,4 @@ from .__version__ import __version__
 
 from . import pandas_extension
 from . import geopop
+from . import lookup
@@ -0,0 +1,397 @@
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from statistics import NormalDist
+from typing import Any, List
+
+from ._manifest import clear_listing_cache, list_data_files
+from ._utils import import_optional
+
+# Projected crs (UTM zone 32N) used to measure shared borders in meters.
+_metric_crs = "EPSG:32632"
+
+
+def adjacency_file_name(year: int, level: str) -> str:
+    """Return the name of the file that contains the contiguity graph of ``level`` for ``year``."""
+    return f"{year}_italy_adjacency_{level}.npz"
+
+
+class Adjacency:
+    """Contiguity graph of italian areas stored in CSR format: neighbors of the area at position
+    ``i`` of ``codes`` are ``codes[indices[indptr[i]:indptr[i + 1]]]``.
+
+    Every pair of areas whose borders touch is stored (queen contiguity) together with the length in
+    meters of the border they share, which is 0 when areas touch in a single point; rook contiguity
+    keeps only pairs with a positive border length.
+
+    :param codes: istat codes of areas.
+    :type codes: pd.Index
+    :param indptr: an int array of length ``len(codes) + 1``.
+    :type indptr: np.ndarray
+    :param indices: an int array with positions of neighbors.
+    :type indices: np.ndarray
+    :param border_length: a float array with the length of shared borders, aligned with ``indices``.
+    :type border_length: np.ndarray
+    """
+
+    def __init__(
+        self,
+        codes: pd.Index,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        border_length: np.ndarray,
+    ):
+        self.codes = codes
+        self.indptr = indptr
+        self.indices = indices
+        self.border_length = border_length
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __repr__(self) -> str:
+        return f"Adjacency(areas={len(self.codes)}, links={len(self.indices)})"
+
+    def rook(self) -> "Adjacency":
+        """Return the rook contiguity graph, i.e. without areas that touch in a single point.
+
+        :return: a new graph with the same ``codes``.
+        :rtype: Adjacency
+        """
+        keep = self.border_length > 0
+        rows = np.repeat(np.arange(len(self.codes)), np.diff(self.indptr))
+        counts = np.bincount(rows[keep], minlength=len(self.codes))
+        return Adjacency(
+            self.codes,
+            np.concatenate([[0], np.cumsum(counts)]).astype(self.indptr.dtype),
+            self.indices[keep],
+            self.border_length[keep],
+        )
+
+    def subset(self, codes: Any) -> "Adjacency":
+        """Return the graph of ``codes`` only, links to other areas are dropped.
+
+        :param codes: istat codes of the areas to be kept.
+        :type codes: Any
+
+        :raises KeyError: if a code is not found.
+
+        :return: a new graph with ``codes`` in the order they are given.
+        :rtype: Adjacency
+        """
+        codes = pd.Index(np.atleast_1d(codes), name=self.codes.name)
+        positions = self.codes.get_indexer(codes)
+        if (positions < 0).any():
+            raise KeyError(
+                "codes not found: {}".format(", ".join(map(str, codes[positions < 0])))
+            )
+        new_positions = np.full(len(self.codes), -1)
+        new_positions[positions] = np.arange(len(codes))
+        starts = self.indptr[positions]
+        counts = self.indptr[positions + 1] - starts
+        links = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        neighbors = new_positions[self.indices[links]]
+        keep = neighbors >= 0
+        rows = np.repeat(np.arange(len(codes)), counts)[keep]
+        return Adjacency(
+            codes,
+            np.concatenate(
+                [[0], np.cumsum(np.bincount(rows, minlength=len(codes)))]
+            ).astype(self.indptr.dtype),
+            neighbors[keep].astype(self.indices.dtype),
+            self.border_length[links][keep],
+        )
+
+    def cardinalities(self) -> pd.Series:
+        """Return the number of neighbors of every area.
+
+        :return: a series with istat codes as index.
+        :rtype: pd.Series
+        """
+        return pd.Series(np.diff(self.indptr), index=self.codes, name="neighbors")
+
+    def to_frame(self, codes: Any = None) -> pd.DataFrame:
+        """Return the graph (or the part of the graph of ``codes``) as an edge list.
+
+        :param codes: istat codes whose neighbors are returned, if None all areas are included, defaults to None.
+        :type codes: Any, optional
+
+        :raises KeyError: if a code is not found.
+
+        :return: a 2-dimensional dataframe with ``code``, ``neighbor_code`` and ``border_length`` columns.
+        :rtype: pd.DataFrame
+        """
+        if codes is None:
+            positions = np.arange(len(self.codes))
+        else:
+            positions = self.codes.get_indexer(pd.Index(np.atleast_1d(codes)))
+            if (positions < 0).any():
+                raise KeyError(
+                    "codes not found: {}".format(
+                        ", ".join(map(str, np.atleast_1d(codes)[positions < 0]))
+                    )
+                )
+        starts = self.indptr[positions]
+        counts = self.indptr[positions + 1] - starts
+        links = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        return pd.DataFrame(
+            {
+                "code": self.codes.values[np.repeat(positions, counts)],
+                "neighbor_code": self.codes.values[self.indices[links]],
+                "border_length": self.border_length[links],
+            }
+        )
+
+    def __getitem__(self, code: Any) -> pd.Index:
+        return pd.Index(self.to_frame(code).neighbor_code, name=self.codes.name)
+
+    def to_sparse(self, weights: str = "binary") -> Any:
+        """Return the graph as a sparse matrix.
+
+        :param weights: ``'binary'`` for ones, ``'border'`` for border lengths or ``'row'`` for ones
+            divided by the number of neighbors (row-standardized), defaults to 'binary'.
+        :type weights: str, optional
+
+        :raises ValueError: if ``weights`` is not valid.
+        :raises ImportError: if ``scipy`` is not installed.
+
+        :return: a square matrix with areas in the order of ``codes``.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        sparse = import_optional("scipy.sparse", "spatial")
+        if weights == "binary":
+            data = np.ones(len(self.indices))
+        elif weights == "border":
+            data = self.border_length.astype(float)
+        elif weights == "row":
+            counts = np.diff(self.indptr)
+            data = np.repeat(1 / np.maximum(counts, 1), counts)
+        else:
+            raise ValueError(
+                f'weights must be "binary", "border" or "row" not "{weights}"'
+            )
+        return sparse.csr_matrix(
+            (data, self.indices, self.indptr), shape=(len(self.codes),) * 2
+        )
+
+    def save(self, path: os.PathLike | str):
+        """Save the graph to an uncompressed ``.npz`` file."""
+        np.savez(
+            path,
+            codes=self.codes.values,
+            indptr=self.indptr,
+            indices=self.indices,
+            border_length=self.border_length,
+        )
+
+    @classmethod
+    def load(cls, path: os.PathLike | str, name: str | None = None) -> "Adjacency":
+        """Load a graph saved with :py:meth:`save`."""
+        with np.load(path) as npz:
+            return cls(
+                pd.Index(npz["codes"], name=name),
+                npz["indptr"],
+                npz["indices"],
+                npz["border_length"],
+            )
+
+    @classmethod
+    def from_geometry(cls, geometry: pd.Series) -> "Adjacency":
+        """Compute the contiguity graph of the geometries of a GeoSeries indexed by istat codes.
+
+        :param geometry: a GeoSeries with istat codes as index.
+        :type geometry: gpd.GeoSeries
+
+        :return: the contiguity graph.
+        :rtype: Adjacency
+        """
+        if geometry.crs is not None:
+            geometry = geometry.to_crs(_metric_crs)
+        geometry = geometry.sort_index()
+        left, right = geometry.sindex.query(geometry.values, predicate="intersects")
+        keep = left != right
+        left, right = left[keep], right[keep]
+        boundaries = geometry.boundary.values
+        border_length = shapely.length(
+            shapely.intersection(boundaries[left], boundaries[right])
+        )
+        order = np.lexsort([right, left])
+        left, right, border_length = left[order], right[order], border_length[order]
+        indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(left, minlength=len(geometry)))]
+        )
+        return cls(
+            pd.Index(geometry.index.values, name=geometry.index.name),
+            indptr.astype(np.int32),
+            right.astype(np.int32),
+            border_length.astype(np.float32),
+        )
+
+
+def read_adjacency(
+    data_directory: os.PathLike | str, year: int, level: str
+) -> Adjacency | None:
+    """Read the contiguity graph of ``level`` for ``year``, return None if it has not been built."""
+    file_name = adjacency_file_name(year, level)
+    if file_name not in list_data_files(data_directory):
+        return None
+    return Adjacency.load(os.path.join(data_directory, file_name), name=f"{level}_code")
+
+
+def build_adjacency_files(
+    data_directory: os.PathLike | str,
+    year: int,
+    geometries: dict,
+) -> List[str]:
+    """Compute and save contiguity graphs of ``year`` into ``data_directory``. This is a build step,
+    to be run after geometry files for a new year have been added.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param geometries: a dict with levels as keys and GeoSeries indexed by istat codes as values.
+    :type geometries: dict[str, gpd.GeoSeries]
+
+    :return: names of written files.
+    :rtype: List[str]
+    """
+    written = []
+    for level, geometry in geometries.items():
+        file_name = adjacency_file_name(year, level)
+        Adjacency.from_geometry(geometry).save(os.path.join(data_directory, file_name))
+        written.append(file_name)
+    clear_listing_cache()
+    return written
+
+
+def smooth_rates(
+    events: np.ndarray,
+    population: np.ndarray,
+    weights: Any = None,
+    method: str = "empirical_bayes",
+) -> np.ndarray:
+    """Smooth rates of many indicators at once.
+
+    ``'empirical_bayes'`` shrinks every rate towards the global rate, the more the smaller the
+    population is; ``'local_empirical_bayes'`` does the same towards the rate of the neighborhood
+    (the area and its neighbors); ``'neighborhood'`` returns the rate of the neighborhood.
+
+    :param events: an array of events with shape (areas, indicators).
+    :type events: np.ndarray
+    :param population: an array of population with shape (areas,).
+    :type population: np.ndarray
+    :param weights: a binary sparse contiguity matrix, required by local methods, defaults to None.
+    :type weights: scipy.sparse.csr_matrix, optional
+    :param method: one of ``'empirical_bayes'``, ``'local_empirical_bayes'`` or ``'neighborhood'``,
+        defaults to 'empirical_bayes'.
+    :type method: str, optional
+
+    :raises ValueError: if ``method`` is not valid.
+
+    :return: an array of smoothed rates with shape (areas, indicators).
+    :rtype: np.ndarray
+    """
+    events = np.asarray(events, dtype=float)
+    population = np.asarray(population, dtype=float)[:, np.newaxis]
+    if method not in ("empirical_bayes", "local_empirical_bayes", "neighborhood"):
+        raise ValueError(
+            'method must be "empirical_bayes", "local_empirical_bayes" or "neighborhood" not "{}"'.format(
+                method
+            )
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.where(population > 0, events / population, 0)
+        if method == "empirical_bayes":
+            total_population = population.sum()
+            mean = events.sum(axis=0) / total_population
+            variance = (population * (rates - mean) ** 2).sum(axis=0) / total_population
+            prior_variance = np.maximum(variance - mean / population.mean(), 0)
+        else:
+            sparse = import_optional("scipy.sparse", "spatial")
+            neighborhood = weights + sparse.identity(weights.shape[0], format="csr")
+            local_population = neighborhood @ population
+            mean = (neighborhood @ events) / local_population
+            if method == "neighborhood":
+                return mean
+            variance = (
+                neighborhood @ (population * rates**2)
+                - 2 * mean * (neighborhood @ events)
+                + mean**2 * local_population
+            ) / local_population
+            mean_population = local_population / (
+                neighborhood @ np.ones((len(population), 1))
+            )
+            prior_variance = np.maximum(variance - mean / mean_population, 0)
+        shrinkage = prior_variance / (prior_variance + mean / population)
+    return np.where(np.isfinite(shrinkage), mean + shrinkage * (rates - mean), mean)
+
+
+def morans_i(values: np.ndarray, weights: Any) -> dict[str, np.ndarray]:
+    """Compute global Moran's I of many variables at once, with expectation and variance under the normality assumption.
+
+    :param values: an array with shape (areas, variables), NaNs are replaced with the mean of their variable.
+    :type values: np.ndarray
+    :param weights: a sparse spatial weights matrix with shape (areas, areas).
+    :type weights: scipy.sparse.csr_matrix
+
+    :return: a dict of arrays with shape (variables,), whose keys are ``I``, ``expected``,
+        ``variance``, ``z_score`` and ``p_value`` (two-sided).
+    :rtype: dict[str, np.ndarray]
+    """
+    deviations = _deviations(values)
+    n = deviations.shape[0]
+    s0 = weights.sum()
+    s1 = 0.5 * (weights + weights.T).power(2).sum()
+    s2 = (
+        (
+            np.asarray(weights.sum(axis=1)).ravel()
+            + np.asarray(weights.sum(axis=0)).ravel()
+        )
+        ** 2
+    ).sum()
+    i = (
+        n
+        / s0
+        * (deviations * (weights @ deviations)).sum(axis=0)
+        / (deviations**2).sum(axis=0)
+    )
+    expected = -1 / (n - 1)
+    variance = (n**2 * s1 - n * s2 + 3 * s0**2) / ((n**2 - 1) * s0**2) - expected**2
+    z_score = (i - expected) / np.sqrt(variance)
+    p_value = 2 * np.array([1 - NormalDist().cdf(abs(z)) for z in z_score])
+    return {
+        "I": i,
+        "expected": np.full_like(i, expected),
+        "variance": np.full_like(i, variance),
+        "z_score": z_score,
+        "p_value": p_value,
+    }
+
+
+def local_morans_i(values: np.ndarray, weights: Any) -> np.ndarray:
+    """Compute local Moran's I of many variables at once.
+
+    :param values: an array with shape (areas, variables), NaNs are replaced with the mean of their variable.
+    :type values: np.ndarray
+    :param weights: a sparse spatial weights matrix with shape (areas, areas).
+    :type weights: scipy.sparse.csr_matrix
+
+    :return: an array of local Moran's I with shape (areas, variables): positive values mark areas
+        similar to their neighbors (high-high or low-low), negative values mark spatial outliers.
+    :rtype: np.ndarray
+    """
+    deviations = _deviations(values)
+    m2 = (deviations**2).sum(axis=0) / deviations.shape[0]
+    return deviations * (weights @ deviations) / m2
+
+
+def _deviations(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    mean = np.nanmean(values, axis=0)
+    return np.where(np.isnan(values), 0, values - mean)
@@ -0,0 +1,179 @@
+from functools import lru_cache
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from typing import List
+
+manifest_file_name = "manifest.json"
+
+_manifest_version = 1
+
+# year, name of the table, optional variant (delta or reprojected) and format
+_file_pattern = re.compile(
+    r"(\d{4})_italy_(.+?)(?:\.(delta|epsg\d+))?\.(feather|parquet|npz)"
+)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_file(path: os.PathLike | str) -> dict:
+    """Return the manifest entry of a data file: year, table, variant, format, size, checksum, number of rows and schema.
+
+    :param path: the path of the data file.
+    :type path: os.PathLike | str
+
+    :raises ValueError: if the name of the file is not the name of a data file.
+
+    :return: the entry.
+    :rtype: dict
+    """
+    match = _file_pattern.fullmatch(os.path.basename(path))
+    if match is None:
+        raise ValueError(f'"{os.path.basename(path)}" is not a data file.')
+    year, table, variant, storage_format = match.groups()
+    if storage_format == "npz":
+        with np.load(path) as npz:
+            rows = None
+            schema = {key: str(npz[key].dtype) for key in npz.files}
+    else:
+        if storage_format == "parquet":
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(path)
+            rows = parquet_file.metadata.num_rows
+            arrow_schema = parquet_file.schema_arrow
+        else:
+            import pyarrow as pa
+
+            with pa.ipc.open_file(path) as reader:
+                rows = sum(
+                    reader.get_batch(i).num_rows
+                    for i in range(reader.num_record_batches)
+                )
+                arrow_schema = reader.schema
+        schema = {field.name: str(field.type) for field in arrow_schema}
+    return {
+        "year": int(year),
+        "table": table,
+        "variant": variant,
+        "format": storage_format,
+        "size": os.path.getsize(path),
+        "sha256": _sha256(path),
+        "rows": rows,
+        "schema": schema,
+    }
+
+
+def build_manifest(data_directory: os.PathLike | str) -> dict:
+    """Describe every data file of ``data_directory`` into its ``manifest.json``. This is the last
+    build step, to be run after data files have been added, packed or rebuilt.
+
+    Once the manifest is written, data files are listed from it instead of scanning the directory,
+    until files are added to or removed from the directory.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+
+    :return: the manifest, with ``version`` and ``files`` (file names as keys and entries as values,
+        see :py:func:`describe_file`).
+    :rtype: dict
+    """
+    files = {
+        file: describe_file(os.path.join(data_directory, file))
+        for file in sorted(os.listdir(data_directory))
+        if _file_pattern.fullmatch(file)
+    }
+    manifest = {"version": _manifest_version, "files": files}
+    with open(os.path.join(data_directory, manifest_file_name), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def read_manifest(data_directory: os.PathLike | str) -> dict | None:
+    """Read the manifest of ``data_directory``, return None if it has not been built."""
+    path = os.path.join(data_directory, manifest_file_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=32)
+def _list_data_files(data_directory: str, directory_mtime_ns: int) -> frozenset:
+    path = os.path.join(data_directory, manifest_file_name)
+    if os.path.exists(path) and os.stat(path).st_mtime_ns >= directory_mtime_ns:
+        return frozenset(read_manifest(data_directory)["files"])
+    # no manifest or files have been added or removed after it has been built
+    return frozenset(
+        file for file in os.listdir(data_directory) if _file_pattern.fullmatch(file)
+    )
+
+
+def list_data_files(data_directory: os.PathLike | str) -> frozenset:
+    """Return names of data files of ``data_directory``, from its manifest if it is up to date, otherwise from the directory.
+
+    Listings are cached and invalidated when files are added to or removed from the directory, so
+    that listing costs a single ``stat`` call.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+
+    :return: names of data files.
+    :rtype: frozenset
+    """
+    data_directory = os.fspath(data_directory)
+    return _list_data_files(data_directory, os.stat(data_directory).st_mtime_ns)
+
+
+def clear_listing_cache():
+    """Forget cached listings, build steps call it after writing files so that they are listed even
+    on filesystems with coarse modification times."""
+    _list_data_files.cache_clear()
+
+
+def parse_file_name(file: str) -> tuple | None:
+    """Return year, table, variant and format of a data file name, None if it is not a data file."""
+    match = _file_pattern.fullmatch(file)
+    if match is None:
+        return None
+    year, table, variant, storage_format = match.groups()
+    return int(year), table, variant, storage_format
+
+
+def validate_data_directory(
+    data_directory: os.PathLike | str, checksums: bool = False
+) -> List[str]:
+    """Check data files of ``data_directory`` against its manifest.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param checksums: if True checksums of files are verified too, which requires reading every file, defaults to False.
+    :type checksums: bool, optional
+
+    :return: problems found, e.g. missing files or files whose size or checksum don't match, empty
+        if the directory is valid or has no manifest.
+    :rtype: List[str]
+    """
+    manifest = read_manifest(data_directory)
+    if manifest is None:
+        return []
+    problems = []
+    for file, entry in manifest["files"].items():
+        path = os.path.join(data_directory, file)
+        if not os.path.exists(path):
+            problems.append(f"{file} is missing")
+        elif os.path.getsize(path) != entry["size"]:
+            problems.append(
+                f"{file} has size {os.path.getsize(path)} not {entry['size']}"
+            )
+        elif checksums and _sha256(path) != entry["sha256"]:
+            problems.append(f"{file} has a wrong checksum")
+    return problems
@@ -0,0 +1,108 @@
+import getpass
+import hashlib
+import os
+import tempfile
+import pandas as pd
+from typing import Dict
+
+_name_key = b"italy_geopop_name"
+
+
+def default_shared_directory() -> str:
+    """Return the directory of shared tables: a directory of the current user in ``/dev/shm``
+    (memory-backed) if it exists, otherwise in the temporary directory."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = "shared"
+    return os.path.join(base, f"italy_geopop-{user}")
+
+
+def data_fingerprint(data_directory: os.PathLike | str, version: str) -> str:
+    """Return a short hash of ``data_directory`` (its absolute path and the name, size and
+    modification time of every file in it) and of the package ``version``, so that shared tables
+    built from other data are never attached.
+
+    :param data_directory: the directory that data are read from.
+    :type data_directory: os.PathLike | str
+    :param version: the version of the package.
+    :type version: str
+
+    :return: the hexadecimal hash.
+    :rtype: str
+    """
+    data_directory = os.path.abspath(data_directory)
+    digest = hashlib.sha1(f"{data_directory}\n{version}".encode())
+    for entry in sorted(os.scandir(data_directory), key=lambda entry: entry.name):
+        if entry.is_file():
+            stat = entry.stat()
+            digest.update(f"\n{entry.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def write_shared_table(
+    directory: os.PathLike | str, name: str, df: pd.DataFrame
+) -> str:
+    """Write ``df`` into an uncompressed Arrow IPC file of ``directory`` that can be memory-mapped
+    by :py:func:`read_shared_tables`. The file is written aside and then renamed, so that processes
+    attaching at the same time never see a partial file.
+
+    :param directory: the directory of shared tables.
+    :type directory: os.PathLike | str
+    :param name: the name of the table, stored in the file.
+    :type name: str
+    :param df: the table.
+    :type df: pd.DataFrame
+
+    :return: the path of the file.
+    :rtype: str
+    """
+    import pyarrow as pa
+
+    os.makedirs(directory, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), _name_key: name.encode()}
+    )
+    path = os.path.join(
+        directory, hashlib.sha1(name.encode()).hexdigest()[:20] + ".arrow"
+    )
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(temporary_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary_path, path)
+    return path
+
+
+def read_shared_tables(directory: os.PathLike | str) -> Dict[str, pd.DataFrame]:
+    """Memory-map every table of ``directory``.
+
+    Tables keep the dtypes they were written with. Numeric columns are read-only numpy arrays backed
+    by the mapped files, as string columns are with pandas>=3 (Arrow arrays): their pages are shared
+    by every process that maps them and are never copied, since no Python object (nor its reference
+    count) lives in them. Columns of Python objects, i.e. nested columns (e.g. ``municipalities`` of
+    provinces) and string columns with pandas<3, are rebuilt as Python objects in every process.
+
+    :param directory: the directory of shared tables.
+    :type directory: os.PathLike | str
+
+    :return: tables by name, empty if the directory does not exist.
+    :rtype: Dict[str, pd.DataFrame]
+    """
+    import pyarrow as pa
+
+    if not os.path.isdir(directory):
+        return {}
+    tables = {}
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith(".arrow"):
+            continue
+        # buffers keep the mapping alive as long as the dataframe uses them
+        table = pa.ipc.open_file(
+            pa.memory_map(os.path.join(directory, file))
+        ).read_all()
+        name = table.schema.metadata[_name_key].decode()
+        tables[name] = table.to_pandas(split_blocks=True)
+    return tables
@@ -0,0 +1,374 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from typing import Any, Callable, List
+
+from ._adjacency import _metric_crs
+from ._storage import write_table
+from ._utils import import_optional
+
+# Mean earth radius in km.
+_earth_radius_km = 6371.0088
+
+
+def lonlat_to_xyz(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Convert longitudes and latitudes (degrees) into points of the unit sphere, where euclidean
+    (chord) distance grows with great-circle distance.
+
+    :return: an array with shape (points, 3).
+    :rtype: np.ndarray
+    """
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+def xyz_to_lonlat(xyz: np.ndarray) -> np.ndarray:
+    """Inverse of :py:func:`lonlat_to_xyz`, points don't need to be on the unit sphere.
+
+    :return: an array with shape (points, 2) of longitudes and latitudes (degrees).
+    :rtype: np.ndarray
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    lon = np.degrees(np.arctan2(xyz[:, 1], xyz[:, 0]))
+    lat = np.degrees(np.arctan2(xyz[:, 2], np.hypot(xyz[:, 0], xyz[:, 1])))
+    return np.column_stack([lon, lat])
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Convert chord distances of the unit sphere into great-circle distances in km."""
+    return 2 * _earth_radius_km * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km: np.ndarray) -> np.ndarray:
+    """Convert great-circle distances in km into chord distances of the unit sphere."""
+    return 2 * np.sin(np.minimum(np.asarray(km) / (2 * _earth_radius_km), np.pi / 2))
+
+
+def compute_centroids(geometry: pd.Series) -> pd.DataFrame:
+    """Compute centroids of the geometries of a GeoSeries in a projected crs.
+
+    :param geometry: a GeoSeries with istat codes as index.
+    :type geometry: gpd.GeoSeries
+
+    :return: a 2-dimensional dataframe with the index of ``geometry`` and ``lon`` and ``lat`` columns.
+    :rtype: pd.DataFrame
+    """
+    centroids = geometry.to_crs(_metric_crs).centroid.to_crs(geometry.crs)
+    return pd.DataFrame(
+        {"lon": centroids.x.values, "lat": centroids.y.values}, index=geometry.index
+    )
+
+
+def weighted_centroids(
+    lonlat_df: pd.DataFrame, weights: pd.Series, groups: pd.Series
+) -> pd.DataFrame:
+    """Compute the weighted centroid of the points of every group.
+
+    :param lonlat_df: a 2-dimensional dataframe with ``lon`` and ``lat`` columns.
+    :type lonlat_df: pd.DataFrame
+    :param weights: weights of points, aligned with ``lonlat_df``.
+    :type weights: pd.Series
+    :param groups: groups of points, aligned with ``lonlat_df``.
+    :type groups: pd.Series
+
+    :return: a 2-dimensional dataframe with groups as index and ``lon`` and ``lat`` columns.
+    :rtype: pd.DataFrame
+    """
+    xyz = lonlat_to_xyz(lonlat_df.lon.values, lonlat_df.lat.values)
+    xyz_df = pd.DataFrame(xyz * weights.values[:, np.newaxis], index=groups.values)
+    xyz_df = xyz_df.groupby(level=0).sum()
+    return pd.DataFrame(
+        xyz_to_lonlat(xyz_df.values), index=xyz_df.index, columns=["lon", "lat"]
+    )
+
+
+def build_tree(lonlat: np.ndarray) -> Any:
+    """Build a KD-tree over points given as an array of longitudes and latitudes with shape (points, 2).
+
+    :raises ImportError: if ``scipy`` is not installed.
+
+    :return: a KD-tree over points of the unit sphere, see :py:func:`lonlat_to_xyz`.
+    :rtype: scipy.spatial.cKDTree
+    """
+    spatial = import_optional("scipy.spatial", "spatial")
+    lonlat = np.asarray(lonlat, dtype=float)
+    return spatial.cKDTree(lonlat_to_xyz(lonlat[:, 0], lonlat[:, 1]))
+
+
+def query_nearest(tree: Any, lonlat: np.ndarray, k: int = 1) -> tuple:
+    """Find the ``k`` points of ``tree`` nearest to every point of ``lonlat``.
+
+    :return: arrays of positions of nearest points and of great-circle distances in km, both with
+        shape (points, k), nearest first.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    lonlat = np.asarray(lonlat, dtype=float)
+    chord, positions = tree.query(
+        lonlat_to_xyz(lonlat[:, 0], lonlat[:, 1]), k=min(k, tree.n)
+    )
+    return positions.reshape(len(lonlat), -1), chord_to_km(chord).reshape(
+        len(lonlat), -1
+    )
+
+
+def pairs_within(tree: Any, other: Any, radius_km: float) -> tuple:
+    """Find every pair of points of two KD-trees (see :py:func:`build_tree`) not farther than ``radius_km``.
+
+    :return: arrays of positions in ``tree``, positions in ``other`` and great-circle distances in km.
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    pairs = tree.sparse_distance_matrix(
+        other, km_to_chord(radius_km), output_type="ndarray"
+    )
+    return pairs["i"], pairs["j"], chord_to_km(pairs["v"])
+
+
+def _uniform_decay(distance_km: np.ndarray, radius_km: float) -> np.ndarray:
+    return np.ones_like(distance_km)
+
+
+def _linear_decay(distance_km: np.ndarray, radius_km: float) -> np.ndarray:
+    return 1 - distance_km / radius_km
+
+
+def _gaussian_decay(distance_km: np.ndarray, radius_km: float) -> np.ndarray:
+    return (np.exp(-0.5 * (distance_km / radius_km) ** 2) - np.exp(-0.5)) / (
+        1 - np.exp(-0.5)
+    )
+
+
+_decays = {
+    "uniform": _uniform_decay,
+    "linear": _linear_decay,
+    "gaussian": _gaussian_decay,
+}
+
+
+def two_step_floating_catchment(
+    areas: np.ndarray,
+    facilities: np.ndarray,
+    distance_km: np.ndarray,
+    demand: np.ndarray,
+    supply: np.ndarray,
+    radius_km: float,
+    decay: str | Callable = "uniform",
+) -> np.ndarray:
+    """Compute the two-step floating catchment area accessibility of many facility types at once.
+
+    In the first step the supply of every facility is divided by the (decayed) demand within
+    ``radius_km``, in the second step the ratios of facilities within ``radius_km`` are (decayed
+    and) summed for every area.
+
+    :param areas: positions of areas of every pair within ``radius_km``.
+    :type areas: np.ndarray
+    :param facilities: positions of facilities of every pair within ``radius_km``.
+    :type facilities: np.ndarray
+    :param distance_km: distances of every pair within ``radius_km``.
+    :type distance_km: np.ndarray
+    :param demand: an array of demand (e.g. population) with shape (areas,).
+    :type demand: np.ndarray
+    :param supply: an array of supply with shape (facilities, types).
+    :type supply: np.ndarray
+    :param radius_km: the catchment radius.
+    :type radius_km: float
+    :param decay: ``'uniform'``, ``'linear'``, ``'gaussian'`` or a function of distances and radius
+        that returns weights, defaults to 'uniform'.
+    :type decay: str | Callable, optional
+
+    :raises ValueError: if ``decay`` is not valid.
+    :raises ImportError: if ``scipy`` is not installed.
+
+    :return: an array of accessibility with shape (areas, types).
+    :rtype: np.ndarray
+    """
+    sparse = import_optional("scipy.sparse", "spatial")
+    if isinstance(decay, str):
+        if decay not in _decays:
+            raise ValueError(
+                'decay must be "uniform", "linear", "gaussian" or a function not "{}"'.format(
+                    decay
+                )
+            )
+        decay = _decays[decay]
+    supply = np.asarray(supply, dtype=float)
+    weights = sparse.csr_matrix(
+        (decay(distance_km, radius_km), (areas, facilities)),
+        shape=(len(demand), len(supply)),
+    )
+    catchment_demand = weights.T @ np.asarray(demand, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(
+            catchment_demand[:, np.newaxis] > 0,
+            supply / catchment_demand[:, np.newaxis],
+            0,
+        )
+    return weights @ ratios
+
+
+def _batch_area_weights(
+    source: np.ndarray, source_area: np.ndarray, tree: Any, targets: np.ndarray
+) -> tuple:
+    target_positions, source_positions = tree.query(targets, predicate="intersects")
+    intersection_area = source_area[source_positions].copy()
+    # prepared predicates avoid computing intersections of sources inside targets
+    partial = ~shapely.contains_properly(
+        targets[target_positions], source[source_positions]
+    )
+    intersection_area[partial] = shapely.area(
+        shapely.intersection(
+            source[source_positions[partial]], targets[target_positions[partial]]
+        )
+    )
+    keep = intersection_area > 0
+    return (
+        target_positions[keep],
+        source_positions[keep],
+        intersection_area[keep] / source_area[source_positions[keep]],
+    )
+
+
+def area_weights(
+    source: pd.Series,
+    targets: pd.Series,
+    batch_size: int = 1000,
+    n_jobs: int = 1,
+) -> Any:
+    """Compute the share of the area of every source geometry that falls into every target geometry.
+
+    Source geometries are indexed with an STRtree and prepared, targets are intersected with the
+    sources they overlap in batches of ``batch_size``, optionally in ``n_jobs`` threads.
+
+    :param source: a GeoSeries of source geometries.
+    :type source: gpd.GeoSeries
+    :param targets: a GeoSeries of target geometries, reprojected into the crs of ``source`` if needed.
+    :type targets: gpd.GeoSeries
+    :param batch_size: the number of targets of every batch, defaults to 1000.
+    :type batch_size: int, optional
+    :param n_jobs: the number of threads, defaults to 1.
+    :type n_jobs: int, optional
+
+    :raises ImportError: if ``scipy`` is not installed.
+
+    :return: a matrix with shape (targets, sources).
+    :rtype: scipy.sparse.csr_matrix
+    """
+    sparse = import_optional("scipy.sparse", "spatial")
+    source = source.to_crs(_metric_crs)
+    targets = np.asarray(targets.to_crs(_metric_crs).values)
+    source_geometries = np.asarray(source.values)
+    shapely.prepare(source_geometries)
+    shapely.prepare(targets)
+    tree = shapely.STRtree(source_geometries)
+    source_area = shapely.area(source_geometries)
+    starts = range(0, len(targets), batch_size)
+
+    def run(start):
+        stop = start + batch_size
+        target_positions, source_positions, weights = _batch_area_weights(
+            source_geometries, source_area, tree, targets[start:stop]
+        )
+        return target_positions + start, source_positions, weights
+
+    if n_jobs > 1:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            results = list(executor.map(run, starts))
+    else:
+        results = [run(start) for start in starts]
+    rows, cols, weights = (
+        np.concatenate([result[i] for result in results]) if results else np.array([])
+        for i in range(3)
+    )
+    return sparse.csr_matrix(
+        (weights, (rows.astype(int), cols.astype(int))),
+        shape=(len(targets), len(source_geometries)),
+    )
+
+
+def compute_geo_stats(geometry: pd.Series) -> pd.DataFrame:
+    """Compute area (km², in a projected crs), bounding box and centroid of every geometry.
+
+    :param geometry: a GeoSeries with istat codes as index.
+    :type geometry: gpd.GeoSeries
+
+    :return: a 2-dimensional dataframe with the index of ``geometry`` and ``area_km2``, ``min_lon``,
+        ``min_lat``, ``max_lon``, ``max_lat``, ``centroid_lon`` and ``centroid_lat`` columns.
+    :rtype: pd.DataFrame
+    """
+    bounds = geometry.to_crs("EPSG:4326").bounds
+    centroids_df = compute_centroids(geometry.to_crs("EPSG:4326"))
+    return pd.DataFrame(
+        {
+            "area_km2": geometry.to_crs(_metric_crs).area.values / 1e6,
+            "min_lon": bounds.minx.values,
+            "min_lat": bounds.miny.values,
+            "max_lon": bounds.maxx.values,
+            "max_lat": bounds.maxy.values,
+            "centroid_lon": centroids_df.lon.values,
+            "centroid_lat": centroids_df.lat.values,
+        },
+        index=geometry.index,
+    )
+
+
+def build_stats_files(
+    data_directory: os.PathLike | str,
+    year: int,
+    geometries: dict,
+    municipality_population: pd.DataFrame | None = None,
+) -> List[str]:
+    """Compute and save area, bounding box and centroid columns of ``year`` into ``data_directory``,
+    as ``stats_municipalities``, ``stats_provinces`` and ``stats_regions`` tables. This is a build
+    step, to be run after geometry files for a new year have been added.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param geometries: a dict with levels as keys and GeoSeries indexed by istat codes as values.
+    :type geometries: dict[str, gpd.GeoSeries]
+    :param municipality_population: a dataframe with ``municipality_code`` as index and
+        ``population``, ``province_code`` and ``region_code`` columns, if provided together with
+        municipality geometries ``weighted_centroid_lon`` and ``weighted_centroid_lat``
+        (population-weighted centroids of municipalities) columns are added to provinces and
+        regions, defaults to None.
+    :type municipality_population: pd.DataFrame | None, optional
+
+    :return: names of written files.
+    :rtype: List[str]
+    """
+    stats = {
+        level: compute_geo_stats(geometry) for level, geometry in geometries.items()
+    }
+    if municipality_population is not None and "municipality" in stats:
+        lonlat_df = stats["municipality"][["centroid_lon", "centroid_lat"]]
+        lonlat_df.columns = ["lon", "lat"]
+        population = municipality_population.reindex(lonlat_df.index)
+        for level in ["province", "region"]:
+            if level in stats:
+                centroids_df = weighted_centroids(
+                    lonlat_df,
+                    population.population.fillna(0),
+                    population[f"{level}_code"],
+                )
+                stats[level]["weighted_centroid_lon"] = centroids_df.lon
+                stats[level]["weighted_centroid_lat"] = centroids_df.lat
+    written = []
+    for level, stats_df in stats.items():
+        table = {
+            "municipality": "stats_municipalities",
+            "province": "stats_provinces",
+            "region": "stats_regions",
+        }[level]
+        written.append(
+            write_table(
+                data_directory,
+                year,
+                table,
+                stats_df.rename_axis(f"{level}_code").reset_index(),
+            )
+        )
+    return written
@@ -0,0 +1,579 @@
+from functools import lru_cache
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from typing import Any, List
+
+from ._manifest import clear_listing_cache, list_data_files, parse_file_name
+from ._utils import once
+
+_table_keys = {
+    "municipalities": ["municipality_code"],
+    "provinces": ["province_code"],
+    "regions": ["region_code"],
+    "geo_municipalities": ["municipality_code"],
+    "geo_provinces": ["province_code"],
+    "geo_regions": ["region_code"],
+    "pop": ["municipality_code", "age"],
+    "stats_municipalities": ["municipality_code"],
+    "stats_provinces": ["province_code"],
+    "stats_regions": ["region_code"],
+}
+
+_changed_col = "_changed"
+
+# formats tables can be stored in, every format is written with the options
+# listed here and is read back according to its file extension
+_storage_formats = {
+    # uncompressed Arrow IPC, the fastest to read and memory-mappable
+    "ipc": {"extension": "feather", "compression": "uncompressed"},
+    # feather with LZ4 frames, the default of ``to_feather``
+    "lz4": {"extension": "feather", "compression": "lz4"},
+    "zstd": {"extension": "feather", "compression": "zstd"},
+    "parquet": {"extension": "parquet", "row_group_size": 65536},
+}
+_default_storage_format = "lz4"
+_extensions = ["feather", "parquet"]
+
+# environment variable that overrides the format chosen by select_storage_formats
+_storage_format_env = "ITALY_GEOPOP_STORAGE_FORMAT"
+
+
+def full_file_name(
+    year: int, table: str, storage_format: str = _default_storage_format
+) -> str:
+    """Return the name of the file that contains the whole ``table`` for ``year`` stored in ``storage_format``."""
+    return f"{year}_italy_{table}.{_storage_formats[storage_format]['extension']}"
+
+
+def _find_file(
+    data_directory: os.PathLike | str, year: int, table: str, delta: bool = False
+) -> str | None:
+    """Return the path of the file that contains ``table`` for ``year`` (or its delta) in any
+    storage format, None if there is none."""
+    suffix = ".delta" if delta else ""
+    files = list_data_files(data_directory)
+    for extension in _extensions:
+        file = f"{year}_italy_{table}{suffix}.{extension}"
+        if file in files:
+            return os.path.join(data_directory, file)
+    return None
+
+
+def _table_files(
+    data_directory: os.PathLike | str, table: str, delta: bool = False
+) -> dict:
+    """Return years of ``table`` stored in ``data_directory`` (as a whole or as a delta) and names of their files."""
+    ret = {}
+    for file in list_data_files(data_directory):
+        year, file_table, variant, storage_format = parse_file_name(file)
+        if (
+            file_table == table
+            and variant == ("delta" if delta else None)
+            and storage_format in _extensions
+        ):
+            ret[year] = file
+    return ret
+
+
+def delta_file_name(year: int, table: str) -> str:
+    """Return the name of the file that contains the delta of ``table`` for ``year`` from its base year."""
+    return f"{year}_italy_{table}.delta.feather"
+
+
+def _is_geo_table(table: str) -> bool:
+    return table.startswith("geo_")
+
+
+def _is_geo(obj: Any) -> bool:
+    """Return True if ``obj`` is a GeoSeries or a GeoDataFrame, without importing geopandas (such
+    objects exist only if it has been imported)."""
+    gpd = sys.modules.get("geopandas")
+    return gpd is not None and isinstance(obj, (gpd.GeoSeries, gpd.GeoDataFrame))
+
+
+def _read_feather(path: str, table: str) -> pd.DataFrame:
+    if _is_geo_table(table):
+        # geopandas is imported only when geometry is requested
+        import geopandas as gpd
+
+        return gpd.read_feather(path)
+    return pd.read_feather(path)
+
+
+def _read_file(path: str, table: str) -> pd.DataFrame:
+    """Read a table file of any storage format, compression of feather files is detected by pyarrow."""
+    if not path.endswith(".parquet"):
+        return _read_feather(path, table)
+    if _is_geo_table(table):
+        import geopandas as gpd
+
+        return gpd.read_parquet(path)
+    return pd.read_parquet(path)
+
+
+def _read_filtered_file(path: str, table: str, filters: dict) -> pd.DataFrame:
+    """Read only rows matching ``filters`` of a table file: the filter is applied by the Arrow scan,
+    so only selected rows are converted (and geometries decoded) and row groups of parquet files
+    whose statistics exclude the filter are skipped."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet" if path.endswith(".parquet") else "ipc")
+    expression = None
+    for col, values in filters.items():
+        condition = ds.field(col).isin(pa.array(np.asarray(values)))
+        expression = condition if expression is None else expression & condition
+    arrow_table = dataset.to_table(filter=expression)
+    df = arrow_table.to_pandas()
+    if _is_geo_table(table):
+        import geopandas as gpd
+
+        geo_metadata = json.loads(arrow_table.schema.metadata[b"geo"])
+        for col, col_metadata in geo_metadata["columns"].items():
+            df[col] = gpd.GeoSeries.from_wkb(
+                df[col].values, crs=col_metadata.get("crs", "OGC:CRS84")
+            )
+        df = gpd.GeoDataFrame(df, geometry=geo_metadata["primary_column"])
+    return df
+
+
+def _filter_frame(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    mask = np.ones(len(df), dtype=bool)
+    for col, values in filters.items():
+        mask &= df[col].isin(values).values
+    return df[mask].reset_index(drop=True)
+
+
+def _write_file(df: pd.DataFrame, path: str, storage_format: str):
+    options = dict(_storage_formats[storage_format])
+    if options.pop("extension") == "parquet":
+        df.to_parquet(path, index=False, **options)
+    else:
+        df.to_feather(path, **options)
+
+
+@once
+@lru_cache(maxsize=16)
+def _read_base_file(path: str, table: str) -> pd.DataFrame:
+    """Same as ``_read_file`` but cached, so that every year decoded from the same base shares its
+    objects (e.g. geometries)."""
+    return _read_file(path, table)
+
+
+def get_base_year(data_directory: os.PathLike | str, year: int, table: str) -> int:
+    """Return the latest year before ``year`` whose ``table`` is stored as a whole.
+
+    :raises FileNotFoundError: if no base year is available.
+    """
+    base_years = [x for x in _table_files(data_directory, table) if x < year]
+    if not base_years:
+        raise FileNotFoundError(
+            f'No base year found for "{table}" delta of year {year} in {data_directory}.'
+        )
+    return max(base_years)
+
+
+def _is_base_year(data_directory: os.PathLike | str, year: int, table: str) -> bool:
+    """Return True if a later year of ``table`` is stored as a delta."""
+    return any(x > year for x in _table_files(data_directory, table, delta=True))
+
+
+def _to_builtin(value: Any) -> Any:
+    """Convert numpy arrays nested in value into lists, so that ``repr`` is never summarized."""
+    if isinstance(value, np.ndarray):
+        return [_to_builtin(x) for x in value]
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    return value
+
+
+def _changed_values(base: pd.Series, other: pd.Series) -> pd.Series:
+    """Return True where values of two aligned series differ. Geometries are compared exactly (same
+    vertices in the same order), so that decoding a delta gives back the same coordinates."""
+    if _is_geo(other):
+        base = other.__class__(base, crs=other.crs)
+        equal = base.geom_equals_exact(other, tolerance=0)
+    elif other.dtype == object:
+        equal = base.map(lambda x: repr(_to_builtin(x))) == other.map(
+            lambda x: repr(_to_builtin(x))
+        )
+    else:
+        equal = base == other
+    return ~(equal | (base.isna() & other.isna()))
+
+
+def encode_delta(
+    base_df: pd.DataFrame, df: pd.DataFrame, keys: List[str]
+) -> pd.DataFrame:
+    """Encode ``df`` as a delta from ``base_df``.
+    The delta has a row for every row of ``df`` in the same order, but only added and changed rows
+    carry values; removed rows are the ones of ``base_df`` not listed in the delta.
+
+    :param base_df: the table of the base year.
+    :type base_df: pd.DataFrame
+    :param df: the table to be encoded.
+    :type df: pd.DataFrame
+    :param keys: columns that identify rows in both tables.
+    :type keys: List[str]
+
+    :return: the delta table, with a boolean ``_changed`` column.
+    :rtype: pd.DataFrame
+    """
+    aligned = base_df.set_index(keys).reindex(df.set_index(keys).index)
+    aligned = aligned.reset_index(drop=True)
+    changed = pd.Series(False, index=df.index)
+    for col in df.columns.drop(keys):
+        changed |= _changed_values(aligned[col], df[col]).values
+    delta = df.copy()
+    for col in df.columns.drop(keys):
+        delta[col] = delta[col].astype(object).where(changed, None)
+        if _is_geo(df[col]):
+            delta[col] = df[col].__class__(delta[col], crs=df[col].crs)
+    delta[_changed_col] = changed
+    return delta
+
+
+def decode_delta(
+    base_df: pd.DataFrame, delta_df: pd.DataFrame, keys: List[str]
+) -> pd.DataFrame:
+    """Rebuild a table from ``base_df`` and its delta, as returned by :py:func:`encode_delta`.
+    Unchanged values are taken from ``base_df`` as they are, so objects like geometries are shared and not copied.
+
+    :param base_df: the table of the base year.
+    :type base_df: pd.DataFrame
+    :param delta_df: the delta table.
+    :type delta_df: pd.DataFrame
+    :param keys: columns that identify rows in both tables.
+    :type keys: List[str]
+
+    :return: the rebuilt table.
+    :rtype: pd.DataFrame
+    """
+    changed = delta_df[_changed_col].values
+    ret = base_df.set_index(keys).reindex(delta_df.set_index(keys).index)
+    ret = ret.reset_index()
+    for col in base_df.columns.drop(keys):
+        ret[col] = ret[col].where(~changed, delta_df[col])
+    dtypes = base_df.dtypes[base_df.dtypes != object]
+    if _is_geo(base_df):
+        ret = base_df.__class__(ret, geometry=base_df.geometry.name, crs=base_df.crs)
+        dtypes = dtypes.drop(base_df.geometry.name)
+    return ret[base_df.columns].astype(dtypes.to_dict())
+
+
+def has_table(data_directory: os.PathLike | str, year: int, table: str) -> bool:
+    """Return True if ``table`` of ``year`` is stored in ``data_directory``, as a whole or as a delta."""
+    return (
+        _find_file(data_directory, year, table) is not None
+        or _find_file(data_directory, year, table, delta=True) is not None
+    )
+
+
+def read_table(
+    data_directory: os.PathLike | str,
+    year: int,
+    table: str,
+    filters: dict | None = None,
+) -> pd.DataFrame:
+    """Read ``table`` of ``year`` from ``data_directory``, rebuilding it from its base year if it is stored as a delta.
+    If ``filters`` are given, they are pushed down into the read of whole files, so that memory use
+    scales with the selected rows.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param table: the name of the table, e.g. ``municipalities`` or ``geo_provinces``.
+    :type table: str
+    :param filters: a dict with columns as keys and iterables of values as values, only rows whose
+        values are in every iterable are read, if None every row is read, defaults to None.
+    :type filters: dict | None, optional
+
+    :raises FileNotFoundError: if ``table`` is not available for ``year``.
+
+    :return: the table, with a range index.
+    :rtype: pd.DataFrame
+    """
+    delta_path = _find_file(data_directory, year, table, delta=True)
+    if delta_path is None:
+        path = _find_file(data_directory, year, table)
+        if path is None:
+            raise FileNotFoundError(
+                f'"{table}" of year {year} is not available in {data_directory}.'
+            )
+        if _is_base_year(data_directory, year, table):
+            ret = _read_base_file(path, table)
+            return ret.copy() if filters is None else _filter_frame(ret, filters)
+        if filters is None:
+            return _read_file(path, table)
+        return _read_filtered_file(path, table, filters)
+    base_year = get_base_year(data_directory, year, table)
+    base_df = _read_base_file(_find_file(data_directory, base_year, table), table)
+    delta_df = _read_file(delta_path, table)
+    ret = decode_delta(base_df, delta_df, _table_keys[table])
+    return ret if filters is None else _filter_frame(ret, filters)
+
+
+def write_table(
+    data_directory: os.PathLike | str,
+    year: int,
+    table: str,
+    df: pd.DataFrame,
+    storage_format: str = _default_storage_format,
+) -> str:
+    """Write the whole ``table`` of ``year`` into ``data_directory`` in ``storage_format``,
+    replacing the file of any other format.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param table: the name of the table, e.g. ``municipalities`` or ``geo_provinces``.
+    :type table: str
+    :param df: the table, with a range index.
+    :type df: pd.DataFrame
+    :param storage_format: one of ``'ipc'`` (uncompressed Arrow IPC), ``'lz4'`` or ``'zstd'``
+        (compressed feather) and ``'parquet'``, defaults to 'lz4'.
+    :type storage_format: str, optional
+
+    :raises ValueError: if ``storage_format`` is not valid.
+
+    :return: the name of the written file.
+    :rtype: str
+    """
+    if storage_format not in _storage_formats:
+        raise ValueError(
+            f'storage_format must be one of {", ".join(map(repr, _storage_formats))} not "{storage_format}"'
+        )
+    file_name = full_file_name(year, table, storage_format)
+    previous_path = _find_file(data_directory, year, table)
+    _write_file(df, os.path.join(data_directory, file_name), storage_format)
+    if previous_path is not None and os.path.basename(previous_path) != file_name:
+        os.remove(previous_path)
+    clear_listing_cache()
+    _read_base_file.cache_clear()
+    return file_name
+
+
+def reprojected_file_name(year: int, table: str, crs: str) -> str:
+    """Return the name of the file that contains ``table`` for ``year`` reprojected into ``crs`` (e.g. ``EPSG:3857``)."""
+    return f"{year}_italy_{table}.{crs.lower().replace(':', '')}.feather"
+
+
+def _normalize_crs(crs: Any) -> str:
+    from pyproj import CRS
+
+    crs = CRS.from_user_input(crs)
+    authority = crs.to_authority()
+    return ":".join(authority) if authority else crs.to_wkt()
+
+
+@once
+@lru_cache(maxsize=8)
+def _read_reprojected(
+    data_directory: os.PathLike | str, year: int, table: str, crs: str
+) -> pd.DataFrame:
+    file_name = reprojected_file_name(year, table, crs)
+    if file_name in list_data_files(data_directory):
+        return _read_file(os.path.join(data_directory, file_name), table)
+    return read_table(data_directory, year, table).to_crs(crs)
+
+
+def read_geometry(
+    data_directory: os.PathLike | str, year: int, table: str, crs: Any
+) -> pd.DataFrame:
+    """Read geometry ``table`` of ``year`` reprojected into ``crs``.
+    Reprojected tables are kept in a bounded cache of the last 8 requested ones and are read from a
+    prebuilt file, if available (see :py:func:`build_reprojected_files`).
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param table: the name of the table, e.g. ``geo_provinces``.
+    :type table: str
+    :param crs: anything accepted by ``pyproj.CRS.from_user_input``, e.g. ``'EPSG:3857'`` or ``3857``.
+    :type crs: Any
+
+    :return: a copy of the reprojected table, with a range index.
+    :rtype: gpd.GeoDataFrame
+    """
+    return _read_reprojected(data_directory, year, table, _normalize_crs(crs)).copy()
+
+
+def build_reprojected_files(
+    data_directory: os.PathLike | str,
+    year: int,
+    crss: List[Any] = ("EPSG:3857", "EPSG:32632"),
+    tables: List[str] = ("geo_provinces", "geo_regions"),
+) -> List[str]:
+    """Save geometry ``tables`` of ``year`` reprojected into every crs of ``crss``, so that they
+    don't need to be reprojected at runtime. This is an optional build step.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param crss: the crs to be prebuilt, defaults to Web Mercator and UTM zone 32N.
+    :type crss: List[Any], optional
+    :param tables: names of geometry tables, defaults to provinces and regions.
+    :type tables: List[str], optional
+
+    :return: names of written files.
+    :rtype: List[str]
+    """
+    written = []
+    for table in tables:
+        df = read_table(data_directory, year, table)
+        for crs in map(_normalize_crs, crss):
+            file_name = reprojected_file_name(year, table, crs)
+            df.to_crs(crs).to_feather(os.path.join(data_directory, file_name))
+            written.append(file_name)
+    clear_listing_cache()
+    _read_reprojected.cache_clear()
+    return written
+
+
+def pack_data_directory(
+    data_directory: os.PathLike | str, tables: List[str] | None = None
+) -> List[str]:
+    """Store tables of every year after the first one as deltas from their base year, when the delta
+    file is smaller than the whole file.
+    This is a build step, to be run after data files for a new year have been added to ``data_directory``.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param tables: names of the tables to be packed, if None every known table is packed, defaults to None.
+    :type tables: List[str] | None, optional
+
+    :return: names of the files that have been replaced by a delta.
+    :rtype: List[str]
+    """
+    replaced = []
+    for table in tables or _table_keys:
+        years = sorted(_table_files(data_directory, table))
+        for year in years[1:]:
+            path = _find_file(data_directory, year, table)
+            base_year = get_base_year(data_directory, year, table)
+            base_df = _read_file(_find_file(data_directory, base_year, table), table)
+            df = _read_file(path, table)
+            delta_df = encode_delta(base_df, df, _table_keys[table])
+            delta_path = os.path.join(data_directory, delta_file_name(year, table))
+            delta_df.to_feather(delta_path)
+            if os.path.getsize(delta_path) < os.path.getsize(path):
+                os.remove(path)
+                replaced.append(os.path.basename(path))
+            else:
+                os.remove(delta_path)
+            clear_listing_cache()
+    _read_base_file.cache_clear()
+    return replaced
+
+
+def benchmark_storage_formats(
+    df: pd.DataFrame,
+    table: str,
+    storage_formats: List[str] | None = None,
+    repeat: int = 3,
+) -> pd.DataFrame:
+    """Write ``df`` in every storage format and measure the size of the file and the time it takes to be read.
+
+    :param df: the table, with a range index.
+    :type df: pd.DataFrame
+    :param table: the name of the table, e.g. ``municipalities`` or ``geo_provinces``.
+    :type table: str
+    :param storage_formats: the formats to be compared, if None every format is compared, defaults to None.
+    :type storage_formats: List[str] | None, optional
+    :param repeat: the number of reads, the fastest one is kept, defaults to 3.
+    :type repeat: int, optional
+
+    :return: a dataframe with storage formats as index and ``size`` (bytes) and ``load_time`` (seconds) as columns.
+    :rtype: pd.DataFrame
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for storage_format in storage_formats or _storage_formats:
+            path = os.path.join(directory, full_file_name(0, table, storage_format))
+            _write_file(df, path, storage_format)
+            load_times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _read_file(path, table)
+                load_times.append(time.perf_counter() - start)
+            results[storage_format] = {
+                "size": os.path.getsize(path),
+                "load_time": min(load_times),
+            }
+    return pd.DataFrame.from_dict(results, orient="index").rename_axis("storage_format")
+
+
+def select_storage_formats(
+    data_directory: os.PathLike | str,
+    tables: List[str] | None = None,
+    objective: str | None = None,
+    repeat: int = 3,
+    tolerance: float = 0.1,
+) -> pd.DataFrame:
+    """Store every table in the format that loads it the fastest, according to
+    :py:func:`benchmark_storage_formats` run on the whole files of every year. This is a build step,
+    to be run after :py:func:`pack_data_directory`; deltas are not affected.
+
+    The choice can be overridden with ``objective`` or, when it is None, with the
+    ``ITALY_GEOPOP_STORAGE_FORMAT`` environment variable, e.g.
+    ``ITALY_GEOPOP_STORAGE_FORMAT=smallest`` for deployments that care more about disk size than
+    load time.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param tables: names of the tables, if None every known table is considered, defaults to None.
+    :type tables: List[str] | None, optional
+    :param objective: ``'fastest'``, ``'smallest'`` or the name of a storage format to be used for
+        every table, defaults to None ('fastest' unless the environment variable is set).
+    :type objective: str | None, optional
+    :param repeat: the number of reads of every benchmark, defaults to 3.
+    :type repeat: int, optional
+    :param tolerance: formats whose load time is within this relative tolerance of the fastest one
+        are considered as fast and the smallest of them is selected, defaults to 0.1.
+    :type tolerance: float, optional
+
+    :raises ValueError: if ``objective`` is not valid.
+
+    :return: a dataframe with ``table`` and ``storage_format`` as index, ``size``, ``load_time`` and ``selected`` as columns.
+    :rtype: pd.DataFrame
+    """
+    objective = objective or os.environ.get(_storage_format_env, "fastest")
+    if objective not in ["fastest", "smallest", *_storage_formats]:
+        raise ValueError(
+            f'objective must be "fastest", "smallest" or a storage format not "{objective}"'
+        )
+    results = []
+    for table in tables or _table_keys:
+        paths = {
+            year: os.path.join(data_directory, file)
+            for year, file in _table_files(data_directory, table).items()
+        }
+        if not paths:
+            continue
+        dfs = {year: _read_file(path, table) for year, path in paths.items()}
+        benchmark_df = sum(
+            benchmark_storage_formats(df, table, repeat=repeat) for df in dfs.values()
+        )
+        if objective in _storage_formats:
+            selected = objective
+        elif objective == "smallest":
+            selected = benchmark_df["size"].idxmin()
+        else:
+            # formats loading within tolerance of the fastest one are as fast
+            load_times = benchmark_df["load_time"]
+            fast_df = benchmark_df[load_times <= load_times.min() * (1 + tolerance)]
+            selected = fast_df["size"].idxmin()
+        for year, df in dfs.items():
+            write_table(data_directory, year, table, df, selected)
+        benchmark_df["selected"] = benchmark_df.index == selected
+        results.append(benchmark_df.assign(table=table))
+    return pd.concat(results).reset_index().set_index(["table", "storage_format"])
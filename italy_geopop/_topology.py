@@ -0,0 +1,482 @@
+from functools import reduce
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry.polygon import orient
+from typing import Any, List
+
+from ._manifest import clear_listing_cache, list_data_files, parse_file_name
+from ._storage import _is_base_year
+
+# from the lowest level, geometry of a level can be derived from the topology of
+# any lower level
+_levels = ["municipality", "province", "region"]
+_geometry_tables = {
+    "municipality": "geo_municipalities",
+    "province": "geo_provinces",
+    "region": "geo_regions",
+}
+
+
+def topology_file_name(year: int, level: str = "municipality") -> str:
+    """Return the name of the file that contains the topology of areas of ``level``
+    (``municipality``, ``province`` or ``region``) for ``year``."""
+    return f"{year}_italy_topology_{level}.npz"
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenate ``arange(start, start + length)`` for every start and length without python loops."""
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class Topology:
+    """Shared-arc topology (like TopoJSON) of areas: every border between two areas is stored once
+    as an arc and rings of areas are sequences of arcs.
+
+    Rings of polygon ``p`` are ``ring_offsets``-delimited slices of ``ring_arcs`` from ring
+    ``polygon_offsets[p]`` (the exterior) to ``polygon_offsets[p + 1]``, polygons of area ``i`` go
+    from ``area_offsets[i]`` to ``area_offsets[i + 1]``. Arc ``a`` is
+    ``arc_coords[arc_offsets[a]:arc_offsets[a + 1]]`` and is used reversed where ``ring_arcs`` holds
+    ``~a``. Coordinates are integers, multiply them by ``precision`` to get longitudes and
+    latitudes.
+
+    Exteriors are counterclockwise and holes are clockwise, so that an arc shared by two areas is
+    used forward by one and reversed by the other.
+    """
+
+    def __init__(
+        self,
+        codes: pd.Index,
+        area_offsets: np.ndarray,
+        polygon_offsets: np.ndarray,
+        ring_offsets: np.ndarray,
+        ring_arcs: np.ndarray,
+        arc_offsets: np.ndarray,
+        arc_coords: np.ndarray,
+        precision: float,
+    ):
+        self.codes = codes
+        self.area_offsets = area_offsets
+        self.polygon_offsets = polygon_offsets
+        self.ring_offsets = ring_offsets
+        self.ring_arcs = ring_arcs
+        self.arc_offsets = arc_offsets
+        self.arc_coords = arc_coords
+        self.precision = precision
+
+    def __repr__(self) -> str:
+        return f"Topology(areas={len(self.codes)}, arcs={len(self.arc_offsets) - 1})"
+
+    @classmethod
+    def from_geometry(cls, geometry: pd.Series, precision: float = 1e-6) -> "Topology":
+        """Build the topology of the (multi)polygons of a GeoSeries indexed by istat codes. This is a build step.
+
+        :param geometry: a GeoSeries with istat codes as index, in ``EPSG:4326``.
+        :type geometry: gpd.GeoSeries
+        :param precision: coordinates are rounded to multiples of ``precision``, so that vertices of
+            neighboring areas match exactly, defaults to 1e-6 (about 0.1 m).
+        :type precision: float, optional
+
+        :return: the topology.
+        :rtype: Topology
+        """
+        rings, ring_polygon, polygon_area = [], [], []
+        for area, geom in enumerate(geometry.values):
+            for polygon in shapely.get_parts(geom):
+                polygon = orient(polygon, sign=1.0)
+                for ring in [polygon.exterior, *polygon.interiors]:
+                    coords = np.round(
+                        np.asarray(ring.coords)[:, :2] / precision
+                    ).astype(np.int64)
+                    keep = np.any(coords != np.roll(coords, 1, axis=0), axis=1)
+                    coords = coords[keep]
+                    if len(coords) >= 3:
+                        rings.append(coords)
+                        ring_polygon.append(len(polygon_area))
+                polygon_area.append(area)
+
+        lengths = np.array([len(x) for x in rings])
+        coords = np.concatenate(rings)
+        keys = coords[:, 0] * 2**32 + (coords[:, 1] + 2**31)
+        vertex_ids, vertex_keys = pd.factorize(keys)
+        vertex_coords = np.empty((len(vertex_keys), 2), dtype=np.int64)
+        vertex_coords[vertex_ids] = coords
+
+        # every edge of every ring, from each vertex to the next one of the ring
+        ring_ids = np.repeat(np.arange(len(rings)), lengths)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        positions = np.arange(len(coords)) - np.repeat(starts, lengths)
+        next_ids = vertex_ids[
+            np.repeat(starts, lengths) + (positions + 1) % np.repeat(lengths, lengths)
+        ]
+        edge_ids, _ = pd.factorize(
+            np.minimum(vertex_ids, next_ids) * len(vertex_keys)
+            + np.maximum(vertex_ids, next_ids)
+        )
+        # arcs are maximal runs of edges shared by the same rings
+        owners = pd.DataFrame({"edge": edge_ids, "ring": ring_ids}).groupby("edge").ring
+        signatures, _ = pd.factorize(
+            pd.MultiIndex.from_arrays(
+                [
+                    owners.min().values[edge_ids],
+                    owners.max().values[edge_ids],
+                    owners.count().values[edge_ids],
+                ]
+            )
+        )
+
+        arcs, arc_index, ring_arcs, ring_lengths = [], {}, [], []
+        for ring, start, length in zip(range(len(rings)), starts, lengths):
+            stop = start + length
+            ids = vertex_ids[start:stop]
+            ring_signatures = signatures[start:stop]
+            cuts = np.flatnonzero(ring_signatures != np.roll(ring_signatures, 1))
+            if not len(cuts):
+                cuts = np.array([ids.argmin()])
+            ids = np.concatenate([ids, ids])
+            ring_arc_refs = []
+            # arcs end at the first vertex of the next arc
+            ends = np.append(cuts[1:], cuts[0] + length) + 1
+            for cut, end in zip(cuts, ends):
+                arc = tuple(ids[cut:end])
+                reversed_arc = arc[::-1]
+                key = min(arc, reversed_arc)
+                if key not in arc_index:
+                    arc_index[key] = len(arcs)
+                    arcs.append(key)
+                ref = arc_index[key]
+                ring_arc_refs.append(ref if key == arc else ~ref)
+            ring_arcs.extend(ring_arc_refs)
+            ring_lengths.append(len(ring_arc_refs))
+
+        arc_lengths = np.array([len(x) for x in arcs])
+        ring_polygon = np.array(ring_polygon)
+        polygon_area = np.array(polygon_area)
+        return cls(
+            pd.Index(geometry.index.values, name=geometry.index.name),
+            _offsets(np.bincount(polygon_area, minlength=len(geometry))),
+            _offsets(np.bincount(ring_polygon, minlength=len(polygon_area))),
+            _offsets(np.array(ring_lengths)),
+            np.array(ring_arcs, dtype=np.int32),
+            _offsets(arc_lengths),
+            vertex_coords[np.concatenate(arcs)].astype(np.int32),
+            precision,
+        )
+
+    def _ring_coords(self, ring_arcs: np.ndarray, ring_offsets: np.ndarray) -> tuple:
+        """Return coordinates of rings made of ``ring_arcs`` and the ring of every coordinate."""
+        arcs = np.where(ring_arcs < 0, ~ring_arcs, ring_arcs)
+        arc_starts = self.arc_offsets[arcs]
+        lengths = self.arc_offsets[arcs + 1] - arc_starts - 1
+        steps = _ranges(np.zeros(len(arcs), dtype=np.int64), lengths)
+        forward = np.repeat(ring_arcs >= 0, lengths)
+        first = np.repeat(arc_starts, lengths)
+        last = np.repeat(self.arc_offsets[arcs + 1] - 1, lengths)
+        positions = np.where(forward, first + 1 + steps, last - 1 - steps)
+        rings = np.repeat(
+            np.repeat(np.arange(len(ring_offsets) - 1), np.diff(ring_offsets)), lengths
+        )
+        return self.arc_coords[positions] * self.precision, rings
+
+    def to_geometry(self) -> Any:
+        """Rebuild geometries of areas.
+
+        :return: a GeoSeries with ``codes`` as index, in ``EPSG:4326``.
+        :rtype: gpd.GeoSeries
+        """
+        import geopandas as gpd
+
+        coords, rings = self._ring_coords(self.ring_arcs, self.ring_offsets)
+        linearrings = shapely.linearrings(coords, indices=rings)
+        polygon_ids = np.repeat(
+            np.arange(len(self.polygon_offsets) - 1), np.diff(self.polygon_offsets)
+        )
+        polygons = shapely.polygons(linearrings, indices=polygon_ids)
+        return gpd.GeoSeries(
+            _collect(polygons, np.diff(self.area_offsets)),
+            index=self.codes,
+            crs="EPSG:4326",
+        )
+
+    def merge(self, groups: pd.Series) -> Any:
+        """Build geometries of groups of areas (e.g. provinces from municipalities) by dropping arcs
+        shared by areas of the same group and chaining the remaining ones.
+
+        :param groups: a series with istat codes as index and groups as values.
+        :type groups: pd.Series
+
+        :return: a GeoSeries with groups as index, in ``EPSG:4326``.
+        :rtype: gpd.GeoSeries
+        """
+        import geopandas as gpd
+
+        area_groups = groups.reindex(self.codes).values
+        ring_area = np.repeat(
+            np.repeat(np.arange(len(self.codes)), np.diff(self.area_offsets)),
+            np.diff(self.polygon_offsets),
+        )
+        entries = pd.DataFrame(
+            {
+                "group": np.repeat(area_groups[ring_area], np.diff(self.ring_offsets)),
+                "ref": self.ring_arcs,
+            }
+        ).dropna(subset=["group"])
+        entries["arc"] = np.where(entries.ref < 0, ~entries.ref, entries.ref)
+        counts = entries.groupby(["group", "arc"]).ref.transform("size")
+        entries = entries[counts.values == 1]
+
+        arcs = entries.arc.values
+        first = self.arc_coords[self.arc_offsets[arcs]]
+        last = self.arc_coords[self.arc_offsets[arcs + 1] - 1]
+        forward = entries.ref.values >= 0
+        entries["start"] = _point_keys(np.where(forward[:, None], first, last))
+        entries["end"] = _point_keys(np.where(forward[:, None], last, first))
+
+        ring_arcs, ring_lengths, ring_groups = [], [], []
+        for group, group_entries in entries.groupby("group", sort=True):
+            by_start = {}
+            for ref, start, end in zip(
+                group_entries.ref.values,
+                group_entries.start.values,
+                group_entries.end.values,
+            ):
+                by_start.setdefault(start, []).append((ref, end))
+            while by_start:
+                ring_start = next(iter(by_start))
+                current, ring = ring_start, []
+                while current in by_start:
+                    ref, end = by_start[current].pop()
+                    if not by_start[current]:
+                        del by_start[current]
+                    ring.append(ref)
+                    current = end
+                    if current == ring_start:
+                        break
+                ring_arcs.extend(ring)
+                ring_lengths.append(len(ring))
+                ring_groups.append(group)
+
+        coords, rings = self._ring_coords(
+            np.array(ring_arcs, dtype=np.int64), _offsets(np.array(ring_lengths))
+        )
+        linearrings = shapely.linearrings(coords, indices=rings)
+        # rings are combined with the even-odd rule (counterclockwise exteriors
+        # contain clockwise holes), which also handles rings touching
+        # themselves where borders of a group pinch
+        polygons = shapely.make_valid(shapely.polygons(linearrings))
+        ring_groups = pd.Series(ring_groups)
+        geometries = {}
+        for group, positions in ring_groups.groupby(
+            ring_groups, sort=True
+        ).indices.items():
+            group_polygons = polygons[positions]
+            if len(group_polygons) == 1:
+                geometry = group_polygons[0]
+            else:
+                geometry = reduce(shapely.symmetric_difference, group_polygons)
+            geometries[group] = _polygonal(geometry)
+        ret = gpd.GeoSeries(geometries, crs="EPSG:4326")
+        return ret.rename_axis(groups.name)
+
+    def simplify(self, tolerance: float) -> "Topology":
+        """Simplify every arc with the Douglas-Peucker algorithm. Since shared borders are stored
+        once and arc endpoints are kept, neighboring areas stay seamless (topology-preserving
+        simplification).
+
+        :param tolerance: the tolerance in degrees.
+        :type tolerance: float
+
+        :return: a new topology with simplified arcs.
+        :rtype: Topology
+        """
+        arc_ids = np.repeat(
+            np.arange(len(self.arc_offsets) - 1), np.diff(self.arc_offsets)
+        )
+        lines = shapely.linestrings(self.arc_coords.astype(float), indices=arc_ids)
+        simplified, indices = shapely.get_coordinates(
+            shapely.simplify(
+                lines, tolerance / self.precision, preserve_topology=False
+            ),
+            return_index=True,
+        )
+        lengths = np.bincount(indices, minlength=len(lines))
+        original_lengths = np.diff(self.arc_offsets)
+        closed = np.all(
+            self.arc_coords[self.arc_offsets[:-1]]
+            == self.arc_coords[self.arc_offsets[1:] - 1],
+            axis=1,
+        )
+        # keep closed arcs that would collapse and a vertex of arcs reduced to a segment
+        keep_original = closed & (lengths < 4)
+        add_middle = ~closed & (lengths == 2) & (original_lengths > 2)
+        arc_coords, arc_lengths = [], []
+        simplified_offsets = _offsets(lengths)
+        for arc in range(len(lines)):
+            start, stop = self.arc_offsets[arc], self.arc_offsets[arc + 1]
+            if keep_original[arc]:
+                coords = self.arc_coords[start:stop]
+            else:
+                simplified_start = simplified_offsets[arc]
+                simplified_stop = simplified_offsets[arc + 1]
+                coords = simplified[simplified_start:simplified_stop].astype(np.int32)
+                if add_middle[arc]:
+                    middle = self.arc_coords[start + original_lengths[arc] // 2]
+                    coords = np.array([coords[0], middle, coords[1]])
+            arc_coords.append(coords)
+            arc_lengths.append(len(coords))
+        return Topology(
+            self.codes,
+            self.area_offsets,
+            self.polygon_offsets,
+            self.ring_offsets,
+            self.ring_arcs,
+            _offsets(np.array(arc_lengths)),
+            np.concatenate(arc_coords).astype(np.int32),
+            self.precision,
+        )
+
+    def save(self, path: os.PathLike | str):
+        """Save the topology to a compressed ``.npz`` file."""
+        np.savez_compressed(
+            path,
+            codes=self.codes.values,
+            area_offsets=self.area_offsets,
+            polygon_offsets=self.polygon_offsets,
+            ring_offsets=self.ring_offsets,
+            ring_arcs=self.ring_arcs,
+            arc_offsets=self.arc_offsets,
+            arc_coords=self.arc_coords,
+            precision=self.precision,
+        )
+
+    @classmethod
+    def load(cls, path: os.PathLike | str, name: str | None = None) -> "Topology":
+        """Load a topology saved with :py:meth:`save`."""
+        with np.load(path) as npz:
+            return cls(
+                pd.Index(npz["codes"], name=name),
+                npz["area_offsets"],
+                npz["polygon_offsets"],
+                npz["ring_offsets"],
+                npz["ring_arcs"],
+                npz["arc_offsets"],
+                npz["arc_coords"],
+                float(npz["precision"]),
+            )
+
+
+def _offsets(lengths: np.ndarray) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+
+
+def _point_keys(coords: np.ndarray) -> np.ndarray:
+    coords = coords.astype(np.int64)
+    return coords[:, 0] * 2**32 + (coords[:, 1] + 2**31)
+
+
+def _polygonal(geometry: Any) -> Any:
+    """Drop points and lines left by ``make_valid`` and overlays, return a Polygon or a MultiPolygon."""
+    parts = shapely.get_parts(geometry)
+    parts = shapely.get_parts(parts[np.isin(shapely.get_type_id(parts), [3, 6])])
+    return parts[0] if len(parts) == 1 else shapely.MultiPolygon(list(parts))
+
+
+def _collect(polygons: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Group consecutive polygons into a geometry per area, a Polygon if the area has one polygon, a MultiPolygon otherwise."""
+    areas = np.repeat(np.arange(len(counts)), counts)
+    ret = shapely.multipolygons(polygons, indices=areas)
+    single = counts == 1
+    ret[single] = polygons[_offsets(counts)[:-1][single]]
+    return ret
+
+
+def get_topology_level(data_directory: os.PathLike | str, year: int) -> str | None:
+    """Return the lowest level whose topology of ``year`` is stored in ``data_directory``, None if there is none."""
+    files = list_data_files(data_directory)
+    for level in _levels:
+        if topology_file_name(year, level) in files:
+            return level
+    return None
+
+
+def has_topology(
+    data_directory: os.PathLike | str, year: int, level: str = "region"
+) -> bool:
+    """Return True if geometry of ``level`` for ``year`` can be derived from a topology stored in
+    ``data_directory``, i.e. the topology of ``level`` or of a lower level."""
+    topology_level = get_topology_level(data_directory, year)
+    return topology_level is not None and _levels.index(
+        topology_level
+    ) <= _levels.index(level)
+
+
+def read_topology(data_directory: os.PathLike | str, year: int) -> Topology | None:
+    """Read the topology of the lowest level available for ``year``, return None if none has been
+    built. Codes are named after the level, e.g. ``province_code``."""
+    level = get_topology_level(data_directory, year)
+    if level is None:
+        return None
+    return Topology.load(
+        os.path.join(data_directory, topology_file_name(year, level)),
+        name=f"{level}_code",
+    )
+
+
+def build_topology_file(
+    data_directory: os.PathLike | str,
+    year: int,
+    geometry: pd.Series,
+    remove_geometry_files: bool = False,
+) -> List[str]:
+    """Build and save the topology of areas of ``year`` into ``data_directory``. This is a build
+    step; once the topology is available, geometry of its level and of upper levels is derived from
+    it, e.g. regions are merged from provinces, so their geometry files are not needed anymore.
+
+    Geometry of municipalities gives the most detailed topology, geometry of provinces is enough to
+    derive provinces and regions.
+
+    :param data_directory: the directory that contains data files.
+    :type data_directory: os.PathLike | str
+    :param year: the year of data.
+    :type year: int
+    :param geometry: a GeoSeries with ``municipality_code`` or ``province_code`` as index, in ``EPSG:4326``.
+    :type geometry: gpd.GeoSeries
+    :param remove_geometry_files: if True geometry files of ``year`` that can be derived from the
+        topology are removed, defaults to False.
+    :type remove_geometry_files: bool, optional
+
+    :raises ValueError: if the index of ``geometry`` is not named after a level or if a geometry
+        file to be removed is the base of deltas of later years.
+
+    :return: names of written files.
+    :rtype: List[str]
+    """
+    level = str(geometry.index.name).removesuffix("_code")
+    if level not in _levels[:-1]:
+        raise ValueError(
+            f'geometry index must be "municipality_code" or "province_code" not "{geometry.index.name}"'
+        )
+    derived_files = []
+    if remove_geometry_files:
+        derived_tables = [
+            _geometry_tables[x]
+            for x in _levels
+            if _levels.index(x) >= _levels.index(level)
+        ]
+        for file in list_data_files(data_directory):
+            parsed = parse_file_name(file)
+            if parsed is None or parsed[0] != year or parsed[1] not in derived_tables:
+                continue
+            if _is_base_year(data_directory, year, parsed[1]):
+                raise ValueError(
+                    f"{file} is the base of deltas of later years, it can't be removed"
+                )
+            derived_files.append(file)
+    file_name = topology_file_name(year, level)
+    Topology.from_geometry(geometry).save(os.path.join(data_directory, file_name))
+    for file in derived_files:
+        os.remove(os.path.join(data_directory, file))
+    clear_listing_cache()
+    return [file_name]
@@ -1,23 +1,32 @@
 from functools import wraps
+import importlib
 from itertools import pairwise
 import os
 import pandas as pd
 import numpy as np
 from typing import Any, Callable, Iterable, Optional, List
 from warnings import warn
+import inspect
 import re
+import threading
+import weakref
+
+from ._manifest import list_data_files, parse_file_name
+
+
+def import_optional(module: str, extra: str) -> Any:
+    """Import an optional dependency, raising an ImportError that explains which extra has to be installed if it is missing."""
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise ImportError(
+            f'"{module}" is required for this feature, install it with `pip install italy-geopop[{extra}]`.'
+        ) from e
 
 
 def get_available_years(data_directory: os.PathLike | str) -> List[int]:
     """Return a list of data available years."""
-    years = []
-    for file in os.listdir(data_directory):
-        if re.match(r"\d{4}_", file):
-            try:
-                years.append(int(file[:4]))
-            except ValueError:
-                pass
-    return sorted(years)
+    return sorted({parse_file_name(x)[0] for x in list_data_files(data_directory)})
 
 
 def get_latest_available_year(data_directory: os.PathLike | str) -> int:
@@ -60,21 +69,76 @@ def simple_cache(fn: Callable) -> Callable:
     return wrapper
 
 
+class KeyedLocks:
+    """A lock for every key, created on first use. Used to compute values once: threads asking for a
+    value that is being computed wait for it instead of computing it again, while values of other
+    keys are computed concurrently.
+
+    Locks are forgotten in forked processes, where a lock held by a thread of the parent would never be released.
+    """
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self):
+        self._reset()
+        KeyedLocks._instances.add(self)
+
+    def _reset(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def __call__(self, key: Any) -> threading.RLock:
+        with self._guard:
+            return self._locks.setdefault(key, threading.RLock())
+
+
+def _reset_keyed_locks():
+    for locks in list(KeyedLocks._instances):
+        locks._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_keyed_locks)
+
+
 def cache(fn: Callable) -> Callable:
+    locks = KeyedLocks()
+    signature = inspect.signature(fn)
+
     @wraps(fn)
     def wrapper(*args, **kwargs) -> Any:
-        key = str(args) + str(tuple(kwargs.items()))
+        # bind arguments so that e.g. f(), f("auto") and f(limits="auto") share the key
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        # instances can define ``_cache_key``, otherwise their repr is used
+        key_args = tuple(getattr(x, "_cache_key", x) for x in bound.args)
+        key = str(key_args) + str(tuple(bound.kwargs.items()))
         if key in wrapper.cache:
             return wrapper.cache[key]
-        else:
-            value = fn(*args, **kwargs)
-            wrapper.cache[key] = value
-            return value
+        with locks(key):
+            # another thread may have computed the value while this one waited
+            if key not in wrapper.cache:
+                wrapper.cache[key] = fn(*args, **kwargs)
+            return wrapper.cache[key]
 
     wrapper.cache = dict()
     return wrapper
 
 
+def once(fn: Callable) -> Callable:
+    """Make concurrent calls of a ``functools.lru_cache``-decorated function with the same arguments
+    wait for a single computation."""
+    locks = KeyedLocks()
+
+    @wraps(fn)
+    def wrapper(*args) -> Any:
+        with locks(args):
+            return fn(*args)
+
+    wrapper.cache_clear = fn.cache_clear
+    return wrapper
+
+
 def _match_every_word(words: Iterable[str], text: str) -> bool:
     """return True if every word in words is found in text, False otherwise. Word is searched as "exact word match" and with "case-insensitive" flag.
 
@@ -174,6 +238,380 @@ def aggregate_region_pop(pop_df: pd.DataFrame, geo_df: pd.DataFrame) -> pd.DataF
     return df.groupby("region_code").sum()
 
 
+def normalize_lookup_keys(values: pd.Series) -> pd.Series:
+    """Normalize values to the lowercase string keys used by lookup tables.
+    Numeric values (e.g. ``1001``, ``1001.0`` or ``'001001'``) are converted to the string of their integer value.
+
+    :param values: values to be normalized.
+    :type values: pd.Series
+
+    :return: a series of normalized keys with the same index of ``values``.
+    :rtype: pd.Series
+    """
+    keys = values.astype(str).str.strip().str.lower()
+    numeric = pd.to_numeric(keys, errors="coerce")
+    is_code = numeric.notna() & np.isfinite(numeric)
+    if is_code.any():
+        keys = keys.where(
+            ~is_code, np.trunc(numeric[is_code]).astype("int64").astype(str)
+        )
+    return keys
+
+
+def _isin(values: pd.Series, index: pd.Index) -> pd.Series:
+    """Same as ``values.isin(index)`` but compared as object arrays, since isin of pyarrow-backed
+    strings converts every item of ``index`` to a scalar."""
+    return pd.Series(
+        values.to_numpy(dtype=object), index=values.index, dtype=object
+    ).isin(index.to_numpy(dtype=object))
+
+
+def detect_lookup_levels(
+    values: pd.Series, lookup_dfs: dict[str, pd.DataFrame]
+) -> pd.Series:
+    """Detect the level (``municipality``, ``province`` or ``region``) of every value.
+
+    - Numbers with 4 or more digits or greater than 999 are municipality istat codes, numbers with 3
+      digits (e.g. ``'015'``) or greater than 20 are province istat codes, other numbers are region
+      istat codes.
+    - Values that look like cadastral codes (e.g. ``F205``) are municipalities.
+    - Two-letter values that are province abbreviations (e.g. ``MI``) are provinces.
+    - Names are looked up in municipalities, then in provinces and then in regions, so ``Milano`` is a municipality.
+
+    :param values: values whose level has to be detected.
+    :type values: pd.Series
+    :param lookup_dfs: lookup tables as returned by :py:meth:`italy_geopop.geopop.Geopop.get_lookup_table` with level as key.
+    :type lookup_dfs: dict[str, pd.DataFrame]
+
+    :return: a series of levels with the same index of ``values``, NaN if level can't be detected.
+    :rtype: pd.Series
+    """
+    raw = values.astype(str).str.strip()
+    keys = normalize_lookup_keys(values)
+    is_code = keys.str.fullmatch(r"\d+")
+    code = pd.to_numeric(keys.where(is_code), errors="coerce")
+    width = raw.str.len().where(raw.str.fullmatch(r"\d+"), 0)
+    is_cadastral = keys.str.fullmatch("[a-z][0-9]{3}")
+    is_short = (keys.str.len() == 2) & _isin(
+        keys,
+        lookup_dfs["province"].index.difference(
+            lookup_dfs["province"].province_code.astype(str)
+        ),
+    )
+    conditions = [
+        is_code & ((width >= 4) | (code > 999)),
+        is_code & ((width == 3) | (code > 20)),
+        is_code,
+        is_cadastral,
+        is_short,
+        _isin(keys, lookup_dfs["municipality"].index),
+        _isin(keys, lookup_dfs["province"].index),
+        _isin(keys, lookup_dfs["region"].index),
+    ]
+    choices = [
+        "municipality",
+        "province",
+        "region",
+        "municipality",
+        "province",
+        "municipality",
+        "province",
+        "region",
+    ]
+    return pd.Series(
+        np.select(conditions, choices, default=None), index=values.index, dtype=object
+    )
+
+
+def resolve_lookup_keys(
+    keys: pd.DataFrame,
+    lookup_df: pd.DataFrame,
+    code_col: str,
+    parent_cols: Iterable[str] = (),
+) -> pd.Series:
+    """Resolve normalized keys into istat codes, using parent codes to break ties between keys matching more than one entry.
+    Resolution runs once per unique combination of key and parent codes.
+
+    :param keys: a dataframe with a ``key`` column of normalized keys and a column for every item of ``parent_cols``.
+    :type keys: pd.DataFrame
+    :param lookup_df: a lookup table as returned by :py:meth:`italy_geopop.geopop.Geopop.get_lookup_table`.
+    :type lookup_df: pd.DataFrame
+    :param code_col: the column of ``lookup_df`` to be returned.
+    :type code_col: str
+    :param parent_cols: codes used to break ties, the first one has the highest priority, defaults to ().
+    :type parent_cols: Iterable[str], optional
+
+    :return: a series of codes with the same index of ``keys``, NaN if key is not found.
+    :rtype: pd.Series
+    """
+    parent_cols = list(parent_cols)
+    unique_keys = keys[["key"] + parent_cols].drop_duplicates().reset_index(drop=True)
+    candidates = pd.merge(
+        unique_keys.reset_index(names="_row"),
+        lookup_df[[code_col] + parent_cols].reset_index(names="key"),
+        how="inner",
+        on="key",
+        suffixes=("", "_candidate"),
+    )
+    candidates["_score"] = 0
+    for weight, col in enumerate(reversed(parent_cols)):
+        matches = candidates[col] == candidates[f"{col}_candidate"]
+        candidates["_score"] += matches.astype(int) * 2**weight
+    # last entry wins among equally scored candidates
+    candidates = candidates.sort_values("_score", kind="stable").drop_duplicates(
+        "_row", keep="last"
+    )
+    unique_keys["_code"] = candidates.set_index("_row")[code_col]
+    ret = pd.merge(
+        keys[["key"] + parent_cols],
+        unique_keys,
+        how="left",
+        on=["key"] + parent_cols,
+    )["_code"]
+    ret.index = keys.index
+    return ret
+
+
+def build_municipality_crosswalk(
+    previous_dfs: dict[int, pd.DataFrame],
+    current_df: pd.DataFrame,
+    population: pd.Series,
+    variations: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """Build a table that maps istat codes, cadastral codes and names of municipalities of previous years to their successors.
+
+    The successor of a municipality is the current municipality with the same istat code or else
+    with the same cadastral code or else, if ``variations`` is provided, the current municipalities
+    it was merged into or split into (following chains of variations).
+    When a municipality has more than one successor, weights are proportional to successors' population.
+    Keys that already resolve to a current municipality are not included.
+
+    :param previous_dfs: municipalities data of previous years
+        (as :py:attr:`italy_geopop.geopop.Geopop.italy_municipalities`) with year as key.
+    :type previous_dfs: dict[int, pd.DataFrame]
+    :param current_df: current municipalities data.
+    :type current_df: pd.DataFrame
+    :param population: current population with ``municipality_code`` as index.
+    :type population: pd.Series
+    :param variations: a dataframe with ``municipality_code`` and ``successor_code`` columns, defaults to None.
+    :type variations: pd.DataFrame | None, optional
+
+    :return: a 2-dimensional dataframe with lookup keys as index and ``municipality_code``,
+        ``weight``, ``from_year`` as columns.
+    :rtype: pd.DataFrame
+    """
+    cadastral_codes = pd.Series(
+        current_df.index, index=current_df.cadastral_code.str.lower()
+    )
+    current_keys = pd.Index(
+        pd.concat(
+            [
+                current_df.index.to_series().astype(str),
+                current_df.municipality.str.lower(),
+                current_df.cadastral_code.str.lower(),
+            ]
+        )
+    )
+    if variations is None:
+        variations = pd.DataFrame(columns=["municipality_code", "successor_code"])
+    variations = variations[["municipality_code", "successor_code"]].astype("int64")
+
+    tables = []
+    for year, df in sorted(previous_dfs.items()):
+        old_df = df.reset_index()
+        successors = old_df.municipality_code.where(
+            old_df.municipality_code.isin(current_df.index),
+            old_df.cadastral_code.str.lower().map(cadastral_codes),
+        )
+        table = pd.merge(
+            old_df[successors.notna()],
+            successors.dropna().astype("int64").rename("successor_code"),
+            left_index=True,
+            right_index=True,
+        )
+        # follow variations until every successor is a current municipality
+        pending = old_df.loc[successors.isna(), ["municipality_code"]]
+        pending["successor_code"] = pending.municipality_code
+        for _ in range(len(variations)):
+            pending = pd.merge(
+                pending,
+                variations.rename(
+                    columns={
+                        "municipality_code": "successor_code",
+                        "successor_code": "_next",
+                    }
+                ),
+                on="successor_code",
+            )
+            pending["successor_code"] = pending.pop("_next")
+            is_current = pending.successor_code.isin(current_df.index)
+            table = pd.concat(
+                [
+                    table,
+                    pd.merge(
+                        old_df, pending[is_current], on="municipality_code", how="inner"
+                    ),
+                ]
+            )
+            pending = pending[~is_current]
+            if pending.empty:
+                break
+
+        for key_col in ["municipality_code", "cadastral_code", "municipality"]:
+            keys = table[[key_col, "successor_code"]].copy()
+            keys["key"] = keys.pop(key_col).astype(str).str.lower()
+            keys["from_year"] = year
+            tables.append(keys)
+
+    if tables:
+        ret = pd.concat(tables, ignore_index=True)
+    else:
+        ret = pd.DataFrame(columns=["successor_code", "key", "from_year"])
+    ret = ret[~ret.key.isin(current_keys)].drop_duplicates()
+    # the latest year wins for keys that map to different successors
+    ret = ret[ret.from_year == ret.groupby("key").from_year.transform("max")]
+    ret = ret.rename(columns={"successor_code": "municipality_code"})
+    weights = ret.municipality_code.map(population).fillna(0).astype(float)
+    totals = weights.groupby(ret.key).transform("sum")
+    counts = ret.groupby("key").municipality_code.transform("count")
+    ret["weight"] = (weights / totals).where(totals > 0, 1 / counts)
+    return ret.set_index("key")[["municipality_code", "weight", "from_year"]]
+
+
+def build_membership_matrix(
+    grouping: pd.Series | pd.DataFrame, municipality_codes: pd.Index
+) -> tuple[Any, pd.Index]:
+    """Build a sparse matrix with a row for every group and a column for every municipality, whose
+    values are membership weights.
+
+    :param grouping: a series with ``municipality_code`` as index and groups as values or a
+        dataframe with ``municipality_code``, ``group`` and optionally ``weight`` columns (a
+        municipality can belong to more than one group).
+    :type grouping: pd.Series | pd.DataFrame
+    :param municipality_codes: istat codes of municipalities in the order of matrix columns.
+    :type municipality_codes: pd.Index
+
+    :return: the membership matrix (``scipy.sparse.csr_matrix``) and the groups in the order of
+        matrix rows. Municipalities not found in ``municipality_codes`` are ignored.
+    :rtype: tuple[scipy.sparse.csr_matrix, pd.Index]
+    """
+    sparse = import_optional("scipy.sparse", "spatial")
+    if isinstance(grouping, pd.Series):
+        grouping = grouping.rename("group").rename_axis("municipality_code")
+        grouping = grouping.reset_index()
+    if "weight" not in grouping.columns:
+        grouping = grouping.assign(weight=1.0)
+    grouping = grouping.dropna(subset=["group"])
+    columns = municipality_codes.get_indexer(grouping.municipality_code)
+    grouping = grouping[columns >= 0]
+    rows, groups = pd.factorize(grouping.group, sort=True)
+    matrix = sparse.csr_matrix(
+        (grouping.weight.astype(float).values, (rows, columns[columns >= 0])),
+        shape=(len(groups), len(municipality_codes)),
+    )
+    return matrix, pd.Index(groups, name="group")
+
+
+def compute_rates(
+    numerators: np.ndarray,
+    denominators: np.ndarray,
+    standard: np.ndarray,
+    z: float = 1.959963984540054,
+) -> dict[str, np.ndarray]:
+    """Compute crude and directly standardized rates with normal approximation confidence intervals
+    for many areas and indicators at once.
+
+    :param numerators: an array of events with shape (areas, indicators, groups).
+    :type numerators: np.ndarray
+    :param denominators: an array of population with shape (areas, groups).
+    :type denominators: np.ndarray
+    :param standard: the standard population with shape (groups,).
+    :type standard: np.ndarray
+    :param z: the standard normal quantile of confidence intervals, defaults to 1.96 (95%).
+    :type z: float, optional
+
+    :return: a dict of arrays with shape (areas, indicators), whose keys are ``crude_rate``,
+        ``crude_rate_lower``, ``crude_rate_upper``, ``standardized_rate``,
+        ``standardized_rate_lower`` and ``standardized_rate_upper``; rates are NaN for areas whose
+        population (of any group, for standardized rates) is missing or 0.
+    :rtype: dict[str, np.ndarray]
+    """
+    numerators = np.asarray(numerators, dtype=float)
+    denominators = np.asarray(denominators, dtype=float)[:, np.newaxis, :]
+    weights = np.asarray(standard, dtype=float) / np.sum(standard)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        events = numerators.sum(axis=2)
+        population = denominators.sum(axis=2)
+        population = np.where(population > 0, population, np.nan)
+        crude = events / population
+        crude_se = np.sqrt(events) / population
+        # rates of groups without population are unknown, so are standardized rates
+        denominators = np.where(denominators > 0, denominators, np.nan)
+        group_rates = numerators / denominators
+        group_variances = numerators / denominators**2
+    standardized = group_rates @ weights
+    standardized_se = np.sqrt(group_variances @ weights**2)
+    return {
+        "crude_rate": crude,
+        "crude_rate_lower": np.maximum(crude - z * crude_se, 0),
+        "crude_rate_upper": crude + z * crude_se,
+        "standardized_rate": standardized,
+        "standardized_rate_lower": np.maximum(standardized - z * standardized_se, 0),
+        "standardized_rate_upper": standardized + z * standardized_se,
+    }
+
+
+def compute_age_quantiles(counts: np.ndarray, quantiles: Iterable[float]) -> np.ndarray:
+    """Compute age quantiles from single-year age counts, interpolating linearly inside every year
+    of age (age ``x`` covers ``[x, x + 1)``).
+
+    :param counts: an array of population with shape (areas, ages), where column ``x`` holds people aged ``x``.
+    :type counts: np.ndarray
+    :param quantiles: quantiles between 0 and 1.
+    :type quantiles: Iterable[float]
+
+    :return: an array of ages with shape (areas, quantiles), NaN for areas without population.
+    :rtype: np.ndarray
+    """
+    counts = np.asarray(counts, dtype=float)
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    ret = []
+    for quantile in quantiles:
+        target = quantile * total
+        age = np.minimum((cumulative < target).sum(axis=1), counts.shape[1] - 1)
+        rows = np.arange(len(counts))
+        before = cumulative[rows, age] - counts[rows, age]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = (target[:, 0] - before) / counts[rows, age]
+        ret.append(np.where(total[:, 0] > 0, age + np.clip(fraction, 0, 1), np.nan))
+    return np.column_stack(ret)
+
+
+def share_unchanged_geometries(geometries: List[pd.Series]) -> List[pd.Series]:
+    """Replace every geometry that is exactly equal (same vertices in the same order) to the
+    geometry with the same index in the previous series with that very object, so that unchanged
+    geometries are stored once and every series keeps its own coordinates.
+
+    :param geometries: a list of GeoSeries, e.g. one for every year.
+    :type geometries: List[gpd.GeoSeries]
+
+    :return: a list of GeoSeries with the same indexes and values of ``geometries``.
+    :rtype: List[gpd.GeoSeries]
+    """
+    ret = geometries[:1]
+    for geometry in geometries[1:]:
+        previous = ret[-1].reindex(geometry.index)
+        unchanged = previous.notna() & geometry.geom_equals_exact(
+            previous, tolerance=0
+        )
+        geometry = geometry.copy()
+        geometry[unchanged] = previous[unchanged]
+        ret.append(geometry)
+    return ret
+
+
 def prepare_limits(population_limits):
     """Prepare population limits for age groups. Adds 0 and np.inf to the limits and sorts them after converting them to int."""
     slices = [0]
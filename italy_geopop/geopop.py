@@ -1,39 +1,247 @@
-import geopandas as gpd
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import os
-from typing import Optional
+import threading
+from statistics import NormalDist
+from typing import Any, Callable, Iterable, Optional
 from warnings import warn
 
+from .__version__ import __version__
+from ._manifest import validate_data_directory
+from ._adjacency import (
+    Adjacency,
+    local_morans_i,
+    morans_i,
+    read_adjacency,
+    smooth_rates,
+)
+from ._spatial import (
+    area_weights,
+    build_tree,
+    compute_centroids,
+    pairs_within,
+    query_nearest,
+    two_step_floating_catchment,
+    weighted_centroids,
+)
+from ._shared import (
+    data_fingerprint,
+    default_shared_directory,
+    read_shared_tables,
+    write_shared_table,
+)
+from ._storage import _normalize_crs, has_table, read_geometry, read_table
+from ._topology import Topology, has_topology, read_topology
 from ._utils import (
     get_available_years,
-    get_latest_available_year,
+    import_optional,
     cache,
+    KeyedLocks,
     generate_labels_for_age_cutoffs,
     aggregate_province_pop,
     aggregate_region_pop,
+    build_membership_matrix,
+    build_municipality_crosswalk,
+    compute_age_quantiles,
+    compute_rates,
     prepare_limits,
+    share_unchanged_geometries,
 )
 
 _current_abs_dir = os.path.dirname(os.path.realpath(__file__))
 _data_abs_dir = os.path.join(_current_abs_dir, "data")
 
+# directories with data built by users (e.g. newer ISTAT releases), a year of a
+# later directory takes precedence over the same year of earlier ones and of
+# packaged data
+_user_data_dirs = [
+    x for x in os.environ.get("ITALY_GEOPOP_DATA_DIRS", "").split(os.pathsep) if x
+]
+
+# tables every year must have, geometry can be stored as tables or as topology
+_required_tables = ["municipalities", "provinces", "regions", "pop"]
+_geometry_tables = ["geo_municipalities", "geo_provinces", "geo_regions"]
+_geometry_table_of_level = dict(
+    zip(["municipality", "province", "region"], _geometry_tables)
+)
+_preload_datasets = ["municipalities", "provinces", "regions", "population", "lookup"]
+_shared_attributes = [
+    "_scope_municipalities",
+    "_italy_municipalities",
+    "_italy_provinces",
+    "_italy_regions",
+    "_population_df",
+]
+_shared_methods = [
+    "get_italian_population_for_municipalites",
+    "get_italian_population_for_provinces",
+    "get_italian_population_for_regions",
+    "get_lookup_table",
+]
+
 _default_age_cutoffs = [0, 3, 11, 19, 25, 50, 65, 75, 120]
 
 
+def add_data_directory(data_directory: os.PathLike | str, checksums: bool = False):
+    """Add a directory with data built by users, e.g. a newer ISTAT release. Its years become
+    available to :py:class:`Geopop` and take precedence over the same years of packaged data and of
+    directories added before.
+
+    Directories can also be added with the ``ITALY_GEOPOP_DATA_DIRS`` environment variable (paths separated by ``os.pathsep``).
+
+    .. code-block:: python
+       :linenos:
+
+       >>> from italy_geopop.geopop import add_data_directory
+       >>> add_data_directory("/data/istat")
+       >>> gp = Geopop(2024)
+
+    :param data_directory: the directory that contains data files, preferably with a manifest
+        (see :py:func:`italy_geopop._manifest.build_manifest`).
+    :type data_directory: os.PathLike | str
+    :param checksums: if True checksums of files are verified against the manifest, defaults to False.
+    :type checksums: bool, optional
+
+    :raises FileNotFoundError: if ``data_directory`` doesn't exist, it has no data files or its files don't match its manifest.
+    """
+    data_directory = os.path.abspath(data_directory)
+    if not os.path.isdir(data_directory):
+        raise FileNotFoundError(f"{data_directory} is not a directory.")
+    problems = validate_data_directory(data_directory, checksums)
+    if problems:
+        raise FileNotFoundError(
+            f"Data in {data_directory} don't match their manifest: {'; '.join(problems)}."
+        )
+    if not get_available_years(data_directory):
+        raise FileNotFoundError(f"No data files found in {data_directory}.")
+    if data_directory in _user_data_dirs:
+        _user_data_dirs.remove(data_directory)
+    _user_data_dirs.append(data_directory)
+
+
+def _get_year_directories() -> dict:
+    """Return available years and the directory each of them is read from."""
+    ret = {}
+    for data_directory in [_data_abs_dir, *_user_data_dirs]:
+        for year in get_available_years(data_directory):
+            ret[year] = data_directory
+    return ret
+
+
+def _get_missing_tables(data_directory: os.PathLike | str, year: int) -> list:
+    """Return tables of ``year`` missing from ``data_directory``, checked against its listing without reading files."""
+    missing = [x for x in _required_tables if not has_table(data_directory, year, x)]
+    missing += [
+        table
+        for level, table in zip(
+            ["municipality", "province", "region"], _geometry_tables
+        )
+        if not has_table(data_directory, year, table)
+        and not has_topology(data_directory, year, level)
+    ]
+    return missing
+
+
+def _normalize_level(level: str, allow_auto: bool = False) -> str:
+    """Return ``level`` lowercase and stripped, ``auto`` is accepted too if ``allow_auto`` is True.
+
+    :raises ValueError: if ``level`` is not one of ``municipality``, ``province`` or ``region`` (or ``auto``).
+    """
+    level = level.lower().strip()
+    if allow_auto and level == "auto":
+        return level
+    if level not in _geometry_table_of_level:
+        choices = '"auto", ' if allow_auto else ""
+        raise ValueError(
+            f'level must be {choices}"municipality", "province" or "region" not "{level}"'
+        )
+    return level
+
+
+def _group_population(
+    pop_df: pd.DataFrame,
+    population_limits: str | list = "auto",
+    population_labels: list | None = None,
+    by: Iterable[str] = ("municipality_code",),
+) -> pd.DataFrame:
+    """Group population in `long` format by ``by`` columns (or index levels) and by age groups
+    according to ``population_limits`` and ``population_labels``."""
+    by = list(by)
+    if isinstance(population_limits, str):
+        population_limits = population_limits.lower().strip()
+        if population_limits == "total":
+            pop_df = pop_df.copy()
+            ret = pop_df.groupby(by)[["F", "M", "tot"]].sum()
+            ret["age_group"] = "population"
+            ret = ret[["age_group", "F", "M", "tot"]].reset_index()
+        elif population_limits == "auto":
+            pop_df = pop_df.copy()
+            slices = _default_age_cutoffs
+            slices_labels = generate_labels_for_age_cutoffs(slices)
+            pop_df["age_group"] = pd.cut(
+                pop_df.age,
+                bins=slices,
+                labels=slices_labels,
+                right=False,
+            )
+            ret = (
+                pop_df.groupby(by + ["age_group"])[["F", "M", "tot"]]
+                .sum()
+                .reset_index()
+            )
+        else:
+            raise ValueError(
+                'population_limits must be a list of int that divides age groups or "auto" or "total" not "{}"'.format(
+                    population_limits
+                )
+            )
+    else:
+        slices = prepare_limits(population_limits)
+        slices_labels = population_labels or generate_labels_for_age_cutoffs(slices)
+        pop_df = pop_df.copy()
+        pop_df["age_group"] = pd.cut(
+            pop_df.age, bins=slices, labels=slices_labels, right=False
+        )
+        ret = pop_df.groupby(by + ["age_group"])[["F", "M", "tot"]].sum().reset_index()
+
+    ret = ret.pivot(index=by, columns="age_group", values=["F", "M", "tot"])
+    ret.columns = ret.columns.map(lambda x: f"{x[1]}_{x[0]}" if x[0] != "tot" else x[1])
+    return ret
+
+
 class Geopop:
     """A class that contains italian geospatial and population data.
 
     :param data_year: the year of the data you need; if None the latests is automatically picked, defaults to None
     :type data_year: int, optional
+    :param regions: codes or names of the regions you need, only their municipalities, provinces,
+        population and geometry are loaded so that memory use and load time scale with the share of
+        the country selected; if None the whole country is loaded, defaults to None
+    :type regions: Iterable[int | str], optional
 
-    :raises ValueError: if ``data_year`` is not available
+    :raises ValueError: if ``data_year`` is not available or a region is not found
+
+    .. code-block:: python
+       :linenos:
+
+       >>> gp = Geopop(data_year=2023, regions=["Lombardia", 5])  # Lombardia and Veneto
+       >>> gp.italy_provinces.region.unique().to_list()
+       ['Lombardia', 'Veneto']
     """
 
-    def __init__(self, data_year: Optional[int] = None):
-        available_years = get_available_years(_data_abs_dir)
+    def __init__(
+        self,
+        data_year: Optional[int] = None,
+        regions: Optional[Iterable[int | str]] = None,
+    ):
+        self._locks = KeyedLocks()
+        year_directories = _get_year_directories()
+        available_years = sorted(year_directories)
         if data_year is None:
-            data_year = get_latest_available_year(_data_abs_dir)
+            data_year = max(available_years)
             warn(f"No data_year specified, using latest available ({data_year}).")
         elif data_year not in available_years:
             raise ValueError(
@@ -42,54 +250,143 @@ class Geopop:
                 )
             )
         self.data_year = data_year
+        self._data_dir = year_directories[data_year]
+        missing_tables = _get_missing_tables(self._data_dir, data_year)
+        if missing_tables:
+            warn(
+                f"Data of {data_year} in {self._data_dir} lack "
+                f"{', '.join(missing_tables)}, properties that need them will fail."
+            )
+        self.regions = None if regions is None else self._resolve_regions(regions)
+
+    def __repr__(self) -> str:
+        if self.regions is None:
+            return f"Geopop(data_year={self.data_year})"
+        return f"Geopop(data_year={self.data_year}, regions={self.regions})"
+
+    @property
+    def _cache_key(self) -> str:
+        # instances with the same data share cached results, see ``cache``; the data
+        # directory is part of it since ``add_data_directory`` can override a year
+        return f"{self!r} from {self._data_dir}"
+
+    def _load_once(self, attr: str, loader: Callable[[], Any]) -> Any:
+        """Return attribute ``attr``, setting it with ``loader`` the first time it is requested.
+        Concurrent first requests wait for a single load instead of reading and decoding the same
+        data many times."""
+        if not hasattr(self, attr):
+            with self._locks(attr):
+                # another thread may have loaded it while this one waited
+                if not hasattr(self, attr):
+                    setattr(self, attr, loader())
+        return getattr(self, attr)
+
+    def _resolve_regions(self, regions: Iterable[int | str]) -> tuple:
+        """Return sorted codes of ``regions``, given as codes or names (case insensitive)."""
+        regions_df = read_table(self._data_dir, self.data_year, "regions")
+        codes = dict(
+            zip(regions_df.region.str.lower().str.strip(), regions_df.region_code)
+        )
+        codes.update({x: x for x in regions_df.region_code})
+        ret = set()
+        for region in [regions] if isinstance(regions, (int, str)) else regions:
+            key = region.lower().strip() if isinstance(region, str) else region
+            if key not in codes:
+                raise ValueError(
+                    f'regions must be codes or names of italian regions, "{region}" is not.'
+                )
+            ret.add(int(codes[key]))
+        return tuple(sorted(ret))
+
+    def _get_scope_municipalities(self) -> pd.DataFrame:
+        """Return the municipalities table (without stats) of selected ``regions``, read once since
+        it defines which rows of every other table are read."""
+        return self._load_once(
+            "_scope_municipalities",
+            lambda: read_table(
+                self._data_dir,
+                self.data_year,
+                "municipalities",
+                {"region_code": self.regions},
+            ),
+        )
+
+    def _get_scope_codes(self, level: str) -> np.ndarray:
+        """Return codes of municipalities, provinces or regions of selected ``regions``."""
+        if level == "region":
+            return np.array(self.regions)
+        return self._get_scope_municipalities()[f"{level}_code"].unique()
+
+    def _read_table(self, table: str) -> pd.DataFrame:
+        """Read ``table`` of ``data_year``, only rows of selected ``regions`` if any."""
+        if self.regions is None:
+            filters = None
+        elif table == "municipalities":
+            return self._get_scope_municipalities().copy()
+        elif table in ("provinces", "regions"):
+            filters = {"region_code": self.regions}
+        elif table == "pop":
+            filters = {"municipality_code": self._get_scope_codes("municipality")}
+        else:
+            # geometry and stats tables of a level
+            level = {
+                "municipalities": "municipality",
+                "provinces": "province",
+                "regions": "region",
+            }[table.split("_")[-1]]
+            filters = {f"{level}_code": self._get_scope_codes(level)}
+        return read_table(self._data_dir, self.data_year, table, filters)
 
     @property
     def italy_municipalities(self) -> pd.DataFrame:
         """Property to get italian municipalities data.
 
+        When municipality statistics have been built for ``data_year``, ``area_km2``, bounding box
+        (``min_lon``, ``min_lat``, ``max_lon``, ``max_lat``) and centroid (``centroid_lon``,
+        ``centroid_lat``) columns are included without loading geometry.
+
         :return: a 2-dimensional dataframe with ``municipality_code`` as index and ``municipality``, ``province_code``, ``province``, ``province_short``, ``region``, ``region_code`` as columns.
         :rtype: pd.DataFrame
         """
 
-        if not hasattr(self, "_italy_municipalities"):
-            setattr(
-                self,
-                "_italy_municipalities",
-                pd.read_feather(
-                    os.path.join(
-                        _data_abs_dir,
-                        f"{self.data_year}_italy_municipalities.feather",
-                    ),
-                ).set_index("municipality_code"),
-            )
-        return self._italy_municipalities
+        return self._load_once(
+            "_italy_municipalities",
+            lambda: self._join_stats(
+                self._read_table("municipalities").set_index("municipality_code"),
+                "stats_municipalities",
+            ),
+        )
 
     @property
     def italy_provinces(self) -> pd.DataFrame:
         """Property to get italian provinces data.
 
+        Area (``area_km2``), bounding box (``min_lon``, ``min_lat``, ``max_lon``, ``max_lat``) and
+        centroid (``centroid_lon``, ``centroid_lat``) of every province are included when available
+        for ``data_year``, plus its population-weighted centroid (``weighted_centroid_lon``,
+        ``weighted_centroid_lat``) if they were built together with municipality population.
+
         .. note::
             To understand how ``municipalities`` are grouped, see above :ref:`Municipality data <municipality-data>`.
 
         :return: a 2-dimensional dataframe with ``province_code`` as index and ``province``, ``province_short``, ``municipalities``, ``region``, ``region_code`` as columns.
         :rtype: pd.DataFrame
         """
-        if not hasattr(self, "_italy_provinces"):
-            setattr(
-                self,
-                "_italy_provinces",
-                pd.read_feather(
-                    os.path.join(
-                        _data_abs_dir, f"{self.data_year}_italy_provinces.feather"
-                    ),
-                ).set_index("province_code"),
-            )
-        return self._italy_provinces
+        return self._load_once(
+            "_italy_provinces",
+            lambda: self._join_stats(
+                self._read_table("provinces").set_index("province_code"),
+                "stats_provinces",
+            ),
+        )
 
     @property
     def italy_regions(self) -> pd.DataFrame:
         """Property to get italian regions data.
 
+        The same precomputed columns of :py:attr:`italy_provinces` are included for every region
+        when available for ``data_year``.
+
         .. note::
             To understand how ``provinces`` are grouped, see above :ref:`Province data <province-data>`.
 
@@ -97,17 +394,20 @@ class Geopop:
         :rtype: pd.DataFrame
         """
 
-        if not hasattr(self, "_italy_regions"):
-            setattr(
-                self,
-                "_italy_regions",
-                pd.read_feather(
-                    os.path.join(
-                        _data_abs_dir, f"{self.data_year}_italy_regions.feather"
-                    ),
-                ).set_index("region_code"),
-            )
-        return self._italy_regions
+        return self._load_once(
+            "_italy_regions",
+            lambda: self._join_stats(
+                self._read_table("regions").set_index("region_code"),
+                "stats_regions",
+            ),
+        )
+
+    def _join_stats(self, df: pd.DataFrame, table: str) -> pd.DataFrame:
+        """Join precomputed area, bounding box and centroid columns, if they have been built for ``data_year``."""
+        if not has_table(self._data_dir, self.data_year, table):
+            return df
+        stats_df = self._read_table(table)
+        return df.join(stats_df.set_index(df.index.name))
 
     @property
     def italy_municipalities_geometry(self) -> pd.DataFrame:
@@ -116,18 +416,10 @@ class Geopop:
         :return: a 2-dimensional dataframe with ``municipality_code`` as index and ``geometry`` as column.
         :rtype: pd.DataFrame
         """
-        if not hasattr(self, "_italy_municipalities_geometry"):
-            setattr(
-                self,
-                "_italy_municipalities_geometry",
-                gpd.read_feather(
-                    os.path.join(
-                        _data_abs_dir,
-                        f"{self.data_year}_italy_geo_municipalities.feather",
-                    )
-                ).set_index("municipality_code"),
-            )
-        return self._italy_municipalities_geometry
+        return self._load_once(
+            "_italy_municipalities_geometry",
+            lambda: self._read_geometry("municipality"),
+        )
 
     @property
     def italy_provinces_geometry(self) -> pd.DataFrame:
@@ -136,17 +428,10 @@ class Geopop:
         :return: a 2-dimensional dataframe with ``province_code`` as index and ``geometry`` as column.
         :rtype: pd.DataFrame
         """
-        if not hasattr(self, "_italy_provinces_geometry"):
-            setattr(
-                self,
-                "_italy_provinces_geometry",
-                gpd.read_feather(
-                    os.path.join(
-                        _data_abs_dir, f"{self.data_year}_italy_geo_provinces.feather"
-                    )
-                ).set_index("province_code"),
-            )
-        return self._italy_provinces_geometry
+        return self._load_once(
+            "_italy_provinces_geometry",
+            lambda: self._read_geometry("province"),
+        )
 
     @property
     def italy_regions_geometry(self) -> pd.DataFrame:
@@ -155,17 +440,115 @@ class Geopop:
         :return: a 2-dimensional dataframe with ``region_code`` as index and ``geometry`` as column.
         :rtype: pd.DataFrame
         """
-        if not hasattr(self, "_italy_regions_geometry"):
-            setattr(
-                self,
-                "_italy_regions_geometry",
-                gpd.read_feather(
-                    os.path.join(
-                        _data_abs_dir, f"{self.data_year}_italy_geo_regions.feather"
-                    )
-                ).set_index("region_code"),
+        return self._load_once(
+            "_italy_regions_geometry",
+            lambda: self._read_geometry("region"),
+        )
+
+    def _read_geometry(self, level: str) -> pd.DataFrame:
+        """Read geometry of ``level`` from its own file or, if it is not available, from the stored
+        topology (areas of upper levels are merged from areas of the topology, e.g. regions from
+        provinces)."""
+        table = _geometry_table_of_level[level]
+        if has_table(self._data_dir, self.data_year, table) or not has_topology(
+            self._data_dir, self.data_year, level
+        ):
+            return self._read_table(table).set_index(f"{level}_code")
+        topology = self.get_topology()
+        topology_level = topology.codes.name[: -len("_code")]
+        if topology_level == level:
+            geometry = topology.to_geometry()
+            if self.regions is not None:
+                geometry = geometry[geometry.index.isin(self._get_scope_codes(level))]
+        else:
+            areas_df = getattr(
+                self, f"italy_{_geometry_table_of_level[topology_level][4:]}"
             )
-        return self._italy_regions_geometry
+            geometry = topology.merge(areas_df[f"{level}_code"])
+        return geometry.rename("geometry").rename_axis(f"{level}_code").to_frame()
+
+    @cache
+    def get_topology(self) -> Topology:
+        """Method to get the shared-arc topology of areas, where every border between two areas is
+        stored once. Geometry of upper levels can be derived from it with :py:meth:`Topology.merge`
+        and it can be simplified without opening gaps between neighbors with
+        :py:meth:`Topology.simplify`.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> topology = gp.get_topology().simplify(0.001)
+           >>> topology.codes.name  # packaged data store the topology of provinces
+           'province_code'
+           >>> topology.merge(gp.italy_provinces.region_code)  # seamless regions
+
+        The topology of the lowest level available is read from the data directory
+        (see :py:func:`italy_geopop._topology.build_topology_file`), if none has been built it is
+        computed from geometry of municipalities.
+
+        :return: the topology, whose codes are named after its level (e.g. ``province_code``).
+        :rtype: Topology
+        """
+        topology = read_topology(self._data_dir, self.data_year)
+        if topology is None:
+            topology = Topology.from_geometry(
+                self.italy_municipalities_geometry.geometry
+            )
+        return topology
+
+    def get_geometry(self, level: str = "province", crs: Any = None) -> pd.DataFrame:
+        """Method to get geospatial data of municipalities, provinces or regions, optionally reprojected into ``crs``.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> gp.get_geometry("region", crs="EPSG:3857")  # Web Mercator, e.g. for tiles
+
+        Reprojected geometries are kept in a bounded cache, so that reprojecting into the same crs
+        again is immediate; common crs can be prebuilt when data are built
+        (see :py:func:`italy_geopop._storage.build_reprojected_files`).
+
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'province'.
+        :type level: str, optional
+        :param crs: anything accepted by ``GeoDataFrame.to_crs``, if None geometry is returned in
+            its original crs (``EPSG:4326``), defaults to None.
+        :type crs: Any, optional
+
+        :raises ValueError: if ``level`` is not valid.
+
+        :return: a copy of the 2-dimensional dataframe with istat codes of ``level`` as index and ``geometry`` as column.
+        :rtype: gpd.GeoDataFrame
+        """
+        level = _normalize_level(level)
+        table = _geometry_table_of_level[level]
+        if crs is None:
+            return getattr(self, f"italy_{table[4:]}_geometry").copy()
+        if not has_table(self._data_dir, self.data_year, table):
+            # e.g. geometry merged from the topology of municipalities
+            return self._reproject_geometry(level, _normalize_crs(crs)).copy()
+        ret = read_geometry(self._data_dir, self.data_year, table, crs).set_index(
+            f"{level}_code"
+        )
+        if self.regions is not None:
+            ret = ret[ret.index.isin(self._get_scope_codes(level))]
+        return ret
+
+    def _reproject_geometry(self, level: str, crs: str) -> pd.DataFrame:
+        """Return geometry of ``level`` reprojected into ``crs``, keeping the last 8 reprojected
+        geometries like :py:func:`italy_geopop._storage.read_geometry`."""
+        key = (level, crs)
+        with self._locks("_reprojected_geometries"):
+            if not hasattr(self, "_reprojected_geometries"):
+                setattr(self, "_reprojected_geometries", OrderedDict())
+            if key in self._reprojected_geometries:
+                self._reprojected_geometries.move_to_end(key)
+            else:
+                table = _geometry_table_of_level[level]
+                geometry = getattr(self, f"italy_{table[4:]}_geometry")
+                self._reprojected_geometries[key] = geometry.to_crs(crs)
+                if len(self._reprojected_geometries) > 8:
+                    self._reprojected_geometries.popitem(last=False)
+            return self._reprojected_geometries[key]
 
     @property
     def population_df(self) -> pd.DataFrame:
@@ -175,15 +558,10 @@ class Geopop:
         :rtype: pd.DataFrame
         """
 
-        if not hasattr(self, "_population_df"):
-            setattr(
-                self,
-                "_population_df",
-                pd.read_feather(
-                    os.path.join(_data_abs_dir, f"{self.data_year}_italy_pop.feather"),
-                ).set_index("municipality_code"),
-            )
-        return self._population_df
+        return self._load_once(
+            "_population_df",
+            lambda: self._read_table("pop").set_index("municipality_code"),
+        )
 
     @cache
     def get_italian_population_for_municipalites(
@@ -204,56 +582,9 @@ class Geopop:
         :rtype: pd.DataFrame
         """
 
-        if isinstance(population_limits, str):
-            population_limits = population_limits.lower().strip()
-            if population_limits == "total":
-                pop_df = self.population_df.copy()
-                ret = pop_df.groupby("municipality_code")[["F", "M", "tot"]].sum()
-                ret["age_group"] = "population"
-                ret = ret[["age_group", "F", "M", "tot"]]
-            elif population_limits == "auto":
-                pop_df = self.population_df.copy()
-                slices = _default_age_cutoffs
-                slices_labels = generate_labels_for_age_cutoffs(slices)
-                pop_df["age_group"] = pd.cut(
-                    pop_df.age,
-                    bins=slices,
-                    labels=slices_labels,
-                    right=False,
-                )
-                ret = (
-                    pop_df.groupby(["municipality_code", "age_group"])[
-                        ["F", "M", "tot"]
-                    ]
-                    .sum()
-                    .reset_index()
-                    .set_index("municipality_code")
-                )
-            else:
-                raise ValueError(
-                    'population_limits must be a list of int that divides age groups or "auto" or "total" not "{}"'.format(
-                        population_limits
-                    )
-                )
-        else:
-            slices = prepare_limits(population_limits)
-            slices_labels = population_labels or generate_labels_for_age_cutoffs(slices)
-            pop_df = self.population_df.copy()
-            pop_df["age_group"] = pd.cut(
-                pop_df.age, bins=slices, labels=slices_labels, right=False
-            )
-            ret = (
-                pop_df.groupby(["municipality_code", "age_group"])[["F", "M", "tot"]]
-                .sum()
-                .reset_index()
-                .set_index("municipality_code")
-            )
-
-        ret = ret.pivot(columns="age_group", values=["F", "M", "tot"])
-        ret.columns = ret.columns.map(
-            lambda x: f"{x[1]}_{x[0]}" if x[0] != "tot" else x[1]
+        return _group_population(
+            self.population_df, population_limits, population_labels
         )
-        return ret
 
     @cache
     def get_italian_population_for_provinces(
@@ -303,15 +634,1062 @@ class Geopop:
         geo_df = self.italy_municipalities
         return aggregate_region_pop(pop_df, geo_df)
 
+    def _get_population(
+        self,
+        level: str,
+        population_limits: str | list = "auto",
+        population_labels: list | None = None,
+    ) -> pd.DataFrame:
+        """Return population of ``level`` (already normalized), see :py:meth:`get_italian_population_for_municipalites`."""
+        return {
+            "municipality": self.get_italian_population_for_municipalites,
+            "province": self.get_italian_population_for_provinces,
+            "region": self.get_italian_population_for_regions,
+        }[level](population_limits, population_labels)
+
+    @cache
+    def get_lookup_table(self, level: str = "municipality") -> pd.DataFrame:
+        """Method to get the table used to resolve names and codes into istat codes.
+
+        Keys are lowercase strings: istat codes and names for every level, cadastral codes for
+        municipalities and abbreviations for provinces.
+        Municipality names are not unique, so the same key may appear more than once.
+
+        :param level: the level of the table that can be ``municipality`` or ``province`` or
+            ``region``, defaults to 'municipality'.
+        :type level: str, optional
+
+        :raises ValueError: if ``level`` is not one of ``municipality``, ``province`` or ``region``.
+
+        :return: a 2-dimensional dataframe with lookup keys as index and istat codes of the level
+            and of its upper levels as columns.
+        :rtype: pd.DataFrame
+        """
+        level = _normalize_level(level)
+        if level == "municipality":
+            df = self.italy_municipalities.reset_index()
+            key_cols = ["municipality", "cadastral_code"]
+            code_cols = ["municipality_code", "province_code", "region_code"]
+        elif level == "province":
+            df = self.italy_provinces.reset_index()
+            key_cols = ["province", "province_short"]
+            code_cols = ["province_code", "region_code"]
+        else:
+            df = self.italy_regions.reset_index()
+            key_cols = ["region"]
+            code_cols = ["region_code"]
+        tables = []
+        for key_col in [f"{level}_code"] + key_cols:
+            table = df[code_cols].copy()
+            table.index = df[key_col].astype(str).str.lower().rename("key")
+            tables.append(table)
+        return pd.concat(tables)
+
+    def preload(
+        self,
+        datasets: Iterable[str] = (
+            "municipalities",
+            "provinces",
+            "regions",
+            "population",
+            "lookup",
+        ),
+        population_limits: Iterable[str | list] = ("auto",),
+        include_geometry: bool = False,
+        max_workers: Optional[int] = None,
+    ) -> Future:
+        """Method to load data in background threads, so that the first requests that need them
+        don't pay for reading and decoding files.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> future = gp.preload(["provinces", "population"], population_limits=["total", [0, 18, 65]])
+           >>> ...  # do something else
+           >>> future.result()  # wait for data to be loaded
+           Geopop(data_year=2023)
+
+        Files are read concurrently (decoding releases the GIL), then derived tables are computed:
+        population for every level in ``datasets`` and every item of ``population_limits``, lookup
+        tables of levels in ``datasets``. If ``datasets`` has no level (e.g. only ``'lookup'``),
+        every level is loaded. Everything is stored as if it had been requested, see
+        :py:meth:`apreload` for ``asyncio``.
+
+        :param datasets: datasets to load among ``'municipalities'``, ``'provinces'``,
+            ``'regions'``, ``'population'`` and ``'lookup'``, defaults to all of them.
+        :type datasets: Iterable[str], optional
+        :param population_limits: values of ``population_limits``
+            (see :py:meth:`get_italian_population_for_municipalites`) to compute population for,
+            defaults to ('auto',).
+        :type population_limits: Iterable[str | list], optional
+        :param include_geometry: if True geometry of levels in ``datasets`` is loaded too, defaults
+            to False.
+        :type include_geometry: bool, optional
+        :param max_workers: the number of threads, if None the default of ``ThreadPoolExecutor``,
+            defaults to None.
+        :type max_workers: int | None, optional
+
+        :raises ValueError: if a dataset is not valid.
+
+        :return: a future that resolves to this instance once data are loaded, or to the exception
+            raised while loading them.
+        :rtype: concurrent.futures.Future
+        """
+        reads, derived = self._get_preload_stages(
+            datasets, population_limits, include_geometry
+        )
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                with ThreadPoolExecutor(max_workers) as executor:
+                    for stage in (reads, derived):
+                        for stage_future in [executor.submit(fn) for fn in stage]:
+                            stage_future.result()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(self)
+
+        threading.Thread(target=run, name=f"{self!r}.preload", daemon=True).start()
+        return future
+
+    def _get_preload_stages(
+        self,
+        datasets: Iterable[str],
+        population_limits: Iterable[str | list],
+        include_geometry: bool,
+    ) -> tuple[list[Callable], list[Callable]]:
+        """Return the functions that read files and the ones that compute derived tables from them, see :py:meth:`preload`."""
+        datasets = [dataset.lower().strip() for dataset in datasets]
+        for dataset in datasets:
+            if dataset not in _preload_datasets:
+                raise ValueError(
+                    'datasets must be "municipalities", "provinces", "regions", "population" or "lookup" not "{}"'.format(
+                        dataset
+                    )
+                )
+        # e.g. "municipalities" of level "municipality"
+        plurals = {
+            level: table[4:] for level, table in _geometry_table_of_level.items()
+        }
+        levels = [level for level, plural in plurals.items() if plural in datasets]
+        if not levels:
+            # e.g. only lookup tables, that need data of every level
+            levels = list(plurals)
+        reads = [
+            lambda level=level: getattr(self, f"italy_{plurals[level]}")
+            for level in levels
+        ]
+        if include_geometry:
+            reads += [
+                lambda level=level: getattr(self, f"italy_{plurals[level]}_geometry")
+                for level in levels
+            ]
+        derived = []
+        if "population" in datasets:
+            reads.append(lambda: self.population_df)
+            # municipalities first, other levels are aggregated from them
+            population_levels = ["municipality"] + [
+                level for level in levels if level != "municipality"
+            ]
+            derived += [
+                lambda level=level, limits=limits: self._get_population(level, limits)
+                for level in population_levels
+                for limits in population_limits
+            ]
+        if "lookup" in datasets:
+            derived += [
+                lambda level=level: self.get_lookup_table(level) for level in levels
+            ]
+        return reads, derived
+
+    async def apreload(self, *args, **kwargs) -> "Geopop":
+        """Same as :py:meth:`preload` but awaitable, the event loop keeps running while data are loaded.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> await gp.apreload(["provinces", "population"])
+           Geopop(data_year=2023)
+
+        :return: this instance.
+        :rtype: Geopop
+        """
+        return await asyncio.wrap_future(self.preload(*args, **kwargs))
+
+    def share(self, directory: os.PathLike | str | None = None) -> "Geopop":
+        """Method to move loaded data into memory-mapped files, so that processes share a single
+        read-only copy of them, e.g. workers of a prefork server.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> # gunicorn.conf.py, with preload_app = True
+           >>> gp = Geopop().preload().result().share()
+
+        Tables, population tables and lookup tables that have been loaded (see :py:meth:`preload`)
+        are written into uncompressed Arrow files of ``directory`` and replaced by dataframes backed
+        by them. Forked processes inherit the mapping: since data pages hold no Python objects,
+        reference counting never writes to them and memory of workers stays flat over time.
+        Tables that this instance has not loaded but are found in ``directory`` are attached
+        instead, so that processes that are not forked can share data written by another process;
+        files are kept apart by package version and by a fingerprint of the data directory (its path
+        and the size and modification time of its files), so tables of other data are never
+        attached.
+        Geometry is not shared, since it is made of Python objects.
+
+        :param directory: the directory of shared files, if None a directory in ``/dev/shm`` (or in
+            the temporary directory), defaults to None.
+        :type directory: os.PathLike | str | None, optional
+
+        :return: this instance.
+        :rtype: Geopop
+        """
+        scope = str(self.data_year)
+        if self.regions is not None:
+            scope += "-regions-" + "-".join(map(str, self.regions))
+        # tables written from other data (or by another version) are never attached
+        directory = os.path.join(
+            directory or default_shared_directory(),
+            __version__,
+            data_fingerprint(self._data_dir, __version__),
+            scope,
+        )
+        # cache keys of this instance start with its ``_cache_key``, see ``cache``
+        prefix = f"({self._cache_key!r}, "
+        for attr in _shared_attributes:
+            if attr in self.__dict__:
+                write_shared_table(directory, attr, self.__dict__[attr])
+        for method in _shared_methods:
+            for key, value in list(getattr(Geopop, method).cache.items()):
+                if key.startswith(prefix) and isinstance(value, pd.DataFrame):
+                    write_shared_table(
+                        directory, f"{method}:{key[len(prefix):]}", value
+                    )
+        for name, df in read_shared_tables(directory).items():
+            if name in _shared_attributes:
+                with self._locks(name):
+                    setattr(self, name, df)
+            else:
+                method, key = name.split(":", 1)
+                getattr(Geopop, method).cache[prefix + key] = df
+        return self
+
+    def get_municipality_crosswalk(
+        self, variations: pd.DataFrame | None = None
+    ) -> pd.DataFrame:
+        """Method to get the table that maps istat codes, cadastral codes and names of
+        municipalities of previous available years to municipalities of ``data_year``.
+
+        Municipalities are matched by istat code or else by cadastral code, so renamed
+        municipalities and municipalities whose istat code changed are mapped.
+        Merged and split municipalities are mapped only if ``variations`` lists them; when a
+        municipality has more than one successor, weights are proportional to successors'
+        population.
+
+        :param variations: a dataframe of administrative variations with ``municipality_code`` (the
+            old istat code) and ``successor_code`` (the new istat code) columns, a municipality
+            split into more municipalities has one row for every successor, defaults to None.
+        :type variations: pd.DataFrame | None, optional
+
+        :return: a 2-dimensional dataframe with lookup keys (istat codes, cadastral codes and names,
+            lowercase) as index and ``municipality_code``, ``weight``, ``from_year`` as columns.
+            Keys that resolve to a municipality of ``data_year`` are not included.
+        :rtype: pd.DataFrame
+        """
+
+        def build() -> pd.DataFrame:
+            previous_dfs = {
+                year: self._get_year_geopop(year).italy_municipalities
+                for year in _get_year_directories()
+                if year < self.data_year
+            }
+            return build_municipality_crosswalk(
+                previous_dfs,
+                self.italy_municipalities,
+                self.get_italian_population_for_municipalites("total").population,
+                variations=variations,
+            )
+
+        if variations is None:
+            return self._load_once("_municipality_crosswalk", build)
+        return build()
+
+    def aggregate(
+        self,
+        groupings: dict[str, pd.Series | pd.DataFrame | str],
+        data: pd.DataFrame | None = None,
+        population_limits: str | list | None = "total",
+        population_labels: list | None = None,
+    ) -> dict[str, pd.DataFrame]:
+        """Method to aggregate municipality data and population into custom groups of municipalities
+        (e.g. health districts or sales territories), provinces and regions.
+        A sparse membership matrix is built for every grouping and every column of every grouping is
+        aggregated with a single sparse matrix multiplication.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> districts = pd.Series({1001: "north", 1002: "north", 1003: "south"})
+           >>> data = pd.DataFrame({"visits": [10, 20, 5]}, index=[1001, 1002, 1003])
+           >>> aggregated = gp.aggregate({"district": districts, "region": "region"}, data=data)
+           >>> aggregated["district"].columns.to_list()
+           ['visits', 'population']
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param groupings: a dict whose values are ``'province'``, ``'region'``, a series with
+            ``municipality_code`` as index and groups as values or a dataframe with
+            ``municipality_code``, ``group`` and ``weight`` columns (municipality values are
+            multiplied by weight, e.g. to split a municipality between groups).
+        :type groupings: dict[str, pd.Series | pd.DataFrame | str]
+        :param data: a dataframe with ``municipality_code`` as index and numeric columns to be
+            summed, NaNs are ignored, defaults to None.
+        :type data: pd.DataFrame | None, optional
+        :param population_limits: a list of int or ``'total'`` or ``'auto'``, if None population is
+            not included, defaults to 'total'.
+        :type population_limits: str | list | None, optional
+        :param population_labels: a list of strings that defines labels name, defaults to None.
+        :type population_labels: list[str] | None, optional
+
+        :raises ImportError: if ``scipy`` is not installed.
+
+        :return: a dict with the same keys of ``groupings`` whose values are 2-dimensional
+            dataframes with groups as index and ``data`` columns and population columns as columns.
+        :rtype: dict[str, pd.DataFrame]
+        """
+        sparse = import_optional("scipy.sparse", "spatial")
+        municipality_codes = self.italy_municipalities.index
+        values_dfs = []
+        if data is not None:
+            values_dfs.append(data.reindex(municipality_codes))
+        if population_limits is not None:
+            values_dfs.append(
+                self.get_italian_population_for_municipalites(
+                    population_limits, population_labels
+                ).reindex(municipality_codes)
+            )
+        values_df = pd.concat(values_dfs, axis=1)
+
+        matrices, groups = [], []
+        for name, grouping in groupings.items():
+            if isinstance(grouping, str):
+                grouping = self.italy_municipalities[f"{grouping.lower().strip()}_code"]
+            matrix, group_index = build_membership_matrix(grouping, municipality_codes)
+            matrices.append(matrix)
+            groups.append(group_index.rename(name))
+        result = sparse.vstack(matrices).tocsr() @ values_df.fillna(0).values
+
+        ret = {}
+        start = 0
+        for name, group_index in zip(groupings, groups):
+            stop = start + len(group_index)
+            ret[name] = pd.DataFrame(
+                result[start:stop], index=group_index, columns=values_df.columns
+            )
+            start = stop
+        return ret
+
+    def get_rates(
+        self,
+        numerators: pd.DataFrame,
+        level: str = "province",
+        population_limits: str | list = "auto",
+        population_labels: list | None = None,
+        standard_population: pd.Series | None = None,
+        per: float = 100_000,
+        confidence: float = 0.95,
+    ) -> pd.DataFrame:
+        """Method to compute crude and directly age-standardized rates with confidence intervals for
+        many indicators at once, using italian population as denominator.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> numerators = pd.DataFrame(
+           ...     {("deaths", "<50"): [10, 3], ("deaths", ">=50"): [120, 40]},
+           ...     index=[1, 2],
+           ... )
+           >>> gp.get_rates(numerators, level="region", population_limits=[50])["deaths"].columns.to_list()
+           ['crude_rate', 'crude_rate_lower', 'crude_rate_upper',
+            'standardized_rate', 'standardized_rate_lower', 'standardized_rate_upper']
+
+        Columns of ``numerators`` are a ``(indicator, age_group)`` multiindex where age groups are
+        population columns according to ``population_limits`` and ``population_labels`` (e.g.
+        ``'<50'`` or ``'<50_F'``). Age groups should not overlap, use either total columns or ``_F``
+        and ``_M`` columns; missing age groups count as zero events.
+
+        :param numerators: a 2-dimensional dataframe with istat codes of ``level`` as index and events as values.
+        :type numerators: pd.DataFrame
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'province'.
+        :type level: str, optional
+        :param population_limits: a list of int or ``'total'`` or ``'auto'``, defaults to 'auto'.
+        :type population_limits: str | list, optional
+        :param population_labels: a list of strings that defines labels name, defaults to None.
+        :type population_labels: list[str] | None, optional
+        :param standard_population: a series with age groups as index and the standard population as
+            values, if None italian population of ``data_year`` is used, defaults to None.
+        :type standard_population: pd.Series | None, optional
+        :param per: the multiplier of rates, defaults to 100000.
+        :type per: float, optional
+        :param confidence: the confidence level of intervals, defaults to 0.95.
+        :type confidence: float, optional
+
+        :raises ValueError: if ``level`` is not valid or if an age group of ``numerators`` is not a population column.
+
+        :return: a 2-dimensional dataframe with istat codes of ``level`` as index and a
+            ``(indicator, statistic)`` multiindex as columns.
+        :rtype: pd.DataFrame
+        """
+        level = _normalize_level(level)
+        pop_df = self._get_population(level, population_limits, population_labels)
+        indicators = numerators.columns.get_level_values(0).unique()
+        groups = numerators.columns.get_level_values(1).unique()
+        unknown_groups = groups.difference(pop_df.columns)
+        if len(unknown_groups):
+            raise ValueError(
+                "age groups must be population columns ({}) not {}".format(
+                    ", ".join(pop_df.columns), ", ".join(map(str, unknown_groups))
+                )
+            )
+        numerators = numerators.reindex(
+            columns=pd.MultiIndex.from_product([indicators, groups]), fill_value=0
+        ).fillna(0)
+        denominators = pop_df.reindex(index=numerators.index, columns=groups)
+        if standard_population is None:
+            standard_population = pop_df[groups].sum()
+
+        rates = compute_rates(
+            numerators.values.reshape(len(numerators), len(indicators), len(groups)),
+            denominators.values,
+            standard_population.reindex(groups).fillna(0).values,
+            z=NormalDist().inv_cdf(0.5 + confidence / 2),
+        )
+        ret = pd.concat(
+            {
+                statistic: pd.DataFrame(
+                    values * per, index=numerators.index, columns=indicators
+                )
+                for statistic, values in rates.items()
+            },
+            axis=1,
+        )
+        return ret.swaplevel(axis=1)[
+            pd.MultiIndex.from_product([indicators, list(rates)])
+        ]
+
+    @cache
+    def get_demographic_indicators(
+        self, level: str = "municipality", quantiles: tuple = (0.25, 0.75)
+    ) -> pd.DataFrame:
+        """Method to get standard demographic indicators computed from single-year ages of italian population.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> gp.get_demographic_indicators("region").columns.to_list()
+           ['population', 'mean_age', 'median_age', 'age_q25', 'age_q75', 'old_age_index',
+            'dependency_ratio', 'young_dependency_ratio', 'old_dependency_ratio', 'sex_ratio']
+
+        Ages are considered as intervals (age ``x`` covers ``[x, x + 1)``), so mean age is computed
+        on ``x + 0.5`` and median and quantile ages are interpolated inside every year of age.
+        Old-age index is population aged 65 or more per 100 people aged 0-14, dependency ratios are
+        people aged 0-14 and/or 65 or more per 100 people aged 15-64 and sex ratio is males per 100
+        females.
+
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param quantiles: quantiles of age to be computed besides median, defaults to (0.25, 0.75).
+        :type quantiles: tuple, optional
+
+        :raises ValueError: if ``level`` is not valid.
+
+        :return: a 2-dimensional dataframe with istat codes of ``level`` as index and indicators as columns.
+        :rtype: pd.DataFrame
+        """
+        level = _normalize_level(level)
+        pop_df = self.population_df
+        if level == "municipality":
+            area_codes = pop_df.index.values
+        else:
+            area_codes = (
+                self.italy_municipalities[f"{level}_code"].reindex(pop_df.index).values
+            )
+        rows, areas = pd.factorize(area_codes, sort=True)
+        ages = pop_df.age.values
+        shape = (len(areas), ages.max() + 1)
+        counts = {}
+        for col in ["F", "M", "tot"]:
+            counts[col] = np.zeros(shape)
+            np.add.at(counts[col], (rows, ages), pop_df[col].values)
+        tot = counts["tot"]
+
+        population = tot.sum(axis=1)
+        young = tot[:, :15].sum(axis=1)
+        adult = tot[:, 15:65].sum(axis=1)
+        old = tot[:, 65:].sum(axis=1)
+        age_quantiles = compute_age_quantiles(tot, (0.5,) + tuple(quantiles))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ret = {
+                "population": population,
+                "mean_age": tot @ (np.arange(shape[1]) + 0.5) / population,
+                "median_age": age_quantiles[:, 0],
+            }
+            for i, quantile in enumerate(quantiles, start=1):
+                ret[f"age_q{quantile * 100:g}"] = age_quantiles[:, i]
+            ret["old_age_index"] = old / young * 100
+            ret["dependency_ratio"] = (young + old) / adult * 100
+            ret["young_dependency_ratio"] = young / adult * 100
+            ret["old_dependency_ratio"] = old / adult * 100
+            ret["sex_ratio"] = counts["M"].sum(axis=1) / counts["F"].sum(axis=1) * 100
+        return pd.DataFrame(ret, index=pd.Index(areas, name=f"{level}_code"))
+
+    @cache
+    def neighbors(
+        self, level: str = "province", contiguity: str = "queen"
+    ) -> Adjacency:
+        """Method to get the contiguity graph of municipalities, provinces or regions.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> adjacency = gp.neighbors("province")
+           >>> adjacency[1].to_list()  # neighbors of Torino
+           [2, 4, 5, 6, 7, 96]
+           >>> adjacency.to_frame([1, 2]).columns.to_list()
+           ['code', 'neighbor_code', 'border_length']
+           >>> matrix = adjacency.to_sparse("row")  # row-standardized scipy sparse matrix
+
+        Graphs are precomputed when data are built; if a graph is not shipped (e.g. for
+        municipalities) it is computed from geometries the first time it is requested.
+
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'province'.
+        :type level: str, optional
+        :param contiguity: ``'queen'`` (areas that share at least a point) or ``'rook'`` (areas that
+            share a border), defaults to 'queen'.
+        :type contiguity: str, optional
+
+        :raises ValueError: if ``level`` or ``contiguity`` are not valid.
+
+        :return: the contiguity graph, see :py:class:`italy_geopop._adjacency.Adjacency`.
+        :rtype: Adjacency
+        """
+        level = _normalize_level(level)
+        if contiguity not in ("queen", "rook"):
+            raise ValueError(f'contiguity must be "queen" or "rook" not "{contiguity}"')
+        if contiguity == "rook":
+            return self.neighbors(level, "queen").rook()
+        adjacency = read_adjacency(self._data_dir, self.data_year, level)
+        if adjacency is None:
+            geo_attr = {
+                "municipality": "italy_municipalities_geometry",
+                "province": "italy_provinces_geometry",
+                "region": "italy_regions_geometry",
+            }[level]
+            adjacency = Adjacency.from_geometry(getattr(self, geo_attr).geometry)
+        elif self.regions is not None:
+            adjacency = adjacency.subset(self._get_scope_codes(level))
+        return adjacency
+
+    def smooth_rates(
+        self,
+        numerators: pd.DataFrame | pd.Series,
+        level: str = "municipality",
+        method: str = "empirical_bayes",
+        per: float = 1,
+    ) -> pd.DataFrame | pd.Series:
+        """Method to smooth per-capita rates of many indicators at once using italian population as
+        denominator and the contiguity graph of ``level`` (see :py:meth:`neighbors`).
+
+        .. code-block:: python
+           :linenos:
+
+           >>> cases = pd.DataFrame({"flu": [...], "covid": [...]}, index=municipality_codes)
+           >>> gp.smooth_rates(cases, method="local_empirical_bayes", per=1000)
+
+        ``'empirical_bayes'`` shrinks every rate towards the national rate, the more the smaller the
+        population is; ``'local_empirical_bayes'`` does the same towards the rate of the area
+        together with its neighbors and ``'neighborhood'`` returns the rate of the area together
+        with its neighbors.
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param numerators: a series or a dataframe with istat codes of ``level`` as index and events
+            as values, missing areas count as zero events.
+        :type numerators: pd.DataFrame | pd.Series
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param method: one of ``'empirical_bayes'``, ``'local_empirical_bayes'`` or
+            ``'neighborhood'``, defaults to 'empirical_bayes'.
+        :type method: str, optional
+        :param per: the multiplier of rates, defaults to 1.
+        :type per: float, optional
+
+        :raises ValueError: if ``level`` or ``method`` are not valid.
+
+        :return: smoothed rates with the same type and columns of ``numerators`` and every area of ``level`` as index.
+        :rtype: pd.DataFrame | pd.Series
+        """
+        level = _normalize_level(level)
+        adjacency = self.neighbors(level)
+        pop_df = self._get_population(level, "total")
+        events_df = (
+            numerators.to_frame() if isinstance(numerators, pd.Series) else numerators
+        )
+        events_df = events_df.reindex(adjacency.codes).fillna(0)
+        smoothed = smooth_rates(
+            events_df.values,
+            pop_df.population.reindex(adjacency.codes).fillna(0).values,
+            adjacency.to_sparse() if method != "empirical_bayes" else None,
+            method,
+        )
+        ret = pd.DataFrame(
+            smoothed * per, index=adjacency.codes, columns=events_df.columns
+        )
+        return ret.iloc[:, 0] if isinstance(numerators, pd.Series) else ret
+
+    def morans_i(
+        self,
+        values: pd.DataFrame | pd.Series,
+        level: str = "municipality",
+        local: bool = False,
+    ) -> pd.DataFrame:
+        """Method to compute global or local Moran's I spatial autocorrelation of many variables at
+        once, using the row-standardized queen contiguity graph of ``level``
+        (see :py:meth:`neighbors`).
+
+        .. code-block:: python
+           :linenos:
+
+           >>> rates = gp.smooth_rates(cases, per=1000)
+           >>> gp.morans_i(rates).columns.to_list()
+           ['I', 'expected', 'variance', 'z_score', 'p_value']
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param values: a series or a dataframe with istat codes of ``level`` as index, missing areas
+            and NaNs are replaced with the mean of their column.
+        :type values: pd.DataFrame | pd.Series
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param local: if True local Moran's I of every area is returned, defaults to False.
+        :type local: bool, optional
+
+        :raises ValueError: if ``level`` is not valid.
+
+        :return: if ``local`` is False a 2-dimensional dataframe with columns of ``values`` as index
+            and ``I``, ``expected``, ``variance``, ``z_score`` and ``p_value`` (normality
+            assumption, two-sided) as columns, otherwise a 2-dimensional dataframe with every area
+            of ``level`` as index and local Moran's I of every column of ``values`` as columns.
+        :rtype: pd.DataFrame
+        """
+        adjacency = self.neighbors(level)
+        values_df = values.to_frame() if isinstance(values, pd.Series) else values
+        values_df = values_df.reindex(adjacency.codes)
+        weights = adjacency.to_sparse("row")
+        if local:
+            return pd.DataFrame(
+                local_morans_i(values_df.values, weights),
+                index=adjacency.codes,
+                columns=values_df.columns,
+            )
+        return pd.DataFrame(
+            morans_i(values_df.values, weights), index=values_df.columns
+        )
+
+    @cache
+    def get_centroids(
+        self, level: str = "municipality", weighted: bool = False
+    ) -> pd.DataFrame:
+        """Method to get centroids of municipalities, provinces or regions.
+
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param weighted: if True centroids of provinces and regions are population-weighted
+            centroids of their municipalities (municipality centroids are the same), defaults to
+            False.
+        :type weighted: bool, optional
+
+        :raises ValueError: if ``level`` is not valid.
+
+        :return: a 2-dimensional dataframe with istat codes of ``level`` as index and ``lon`` and ``lat`` columns.
+        :rtype: pd.DataFrame
+        """
+        level = _normalize_level(level)
+        data_df = getattr(
+            self,
+            {
+                "municipality": "italy_municipalities",
+                "province": "italy_provinces",
+                "region": "italy_regions",
+            }[level],
+        )
+        prefix = (
+            "weighted_centroid" if weighted and level != "municipality" else "centroid"
+        )
+        if f"{prefix}_lon" in data_df.columns:
+            return pd.DataFrame(
+                {"lon": data_df[f"{prefix}_lon"], "lat": data_df[f"{prefix}_lat"]}
+            )
+        if weighted and level != "municipality":
+            centroids_df = self.get_centroids("municipality")
+            population = (
+                self.get_italian_population_for_municipalites("total")
+                .population.reindex(centroids_df.index)
+                .fillna(0)
+            )
+            groups = self.italy_municipalities[f"{level}_code"].reindex(
+                centroids_df.index
+            )
+            return weighted_centroids(centroids_df, population, groups).rename_axis(
+                f"{level}_code"
+            )
+        geo_attr = {
+            "municipality": "italy_municipalities_geometry",
+            "province": "italy_provinces_geometry",
+            "region": "italy_regions_geometry",
+        }[level]
+        return compute_centroids(getattr(self, geo_attr).geometry)
+
+    @cache
+    def get_centroid_tree(self, level: str = "municipality", weighted: bool = False):
+        """Method to get a KD-tree over centroids of ``level`` (see :py:meth:`get_centroids`), whose
+        points are in the same order of centroids.
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param weighted: if True population-weighted centroids are used, defaults to False.
+        :type weighted: bool, optional
+
+        :return: a KD-tree over centroids converted into points of the unit sphere.
+        :rtype: scipy.spatial.cKDTree
+        """
+        return build_tree(self.get_centroids(level, weighted)[["lon", "lat"]].values)
+
+    def assign_nearest(
+        self,
+        facilities_lonlat: pd.DataFrame,
+        k: int = 1,
+        level: str = "municipality",
+        weighted: bool = True,
+        population_limits: str | list = "auto",
+        population_labels: list | None = None,
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Method to assign every area to its ``k`` nearest facilities (great-circle distance
+        between centroids and facilities) and to sum the population served by every facility.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> hospitals = pd.DataFrame({"lon": [7.68, 9.19], "lat": [45.07, 45.46]}, index=["Torino", "Milano"])
+           >>> assignment_df, served_df = gp.assign_nearest(hospitals, k=2)
+           >>> assignment_df.columns.to_list()
+           ['rank', 'facility', 'distance_km']
+           >>> served_df.loc["Torino", "population"]  # people whose nearest hospital is Torino
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param facilities_lonlat: a 2-dimensional dataframe with facilities as index and ``lon`` and ``lat`` columns.
+        :type facilities_lonlat: pd.DataFrame
+        :param k: the number of nearest facilities of every area, defaults to 1.
+        :type k: int, optional
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param weighted: if True population-weighted centroids are used, defaults to True.
+        :type weighted: bool, optional
+        :param population_limits: a list of int or ``'total'`` or ``'auto'``, defaults to 'auto'.
+        :type population_limits: str | list, optional
+        :param population_labels: a list of strings that defines labels name, defaults to None.
+        :type population_labels: list[str] | None, optional
+
+        :raises ValueError: if ``level`` is not valid.
+
+        :return: an assignment dataframe with istat codes of ``level`` as index (repeated ``k``
+            times) and ``rank`` (1 is the nearest), ``facility`` and ``distance_km`` columns, and a
+            served population dataframe with facilities as index and population columns according to
+            ``population_limits`` and ``population_labels``, where every area counts only for its
+            nearest facility.
+        :rtype: tuple[pd.DataFrame, pd.DataFrame]
+        """
+        level = _normalize_level(level)
+        centroids_df = self.get_centroids(level, weighted)
+        positions, distances = query_nearest(
+            build_tree(facilities_lonlat[["lon", "lat"]].values),
+            centroids_df[["lon", "lat"]].values,
+            k,
+        )
+        k = positions.shape[1]
+        assignment_df = pd.DataFrame(
+            {
+                "rank": np.tile(np.arange(1, k + 1), len(centroids_df)),
+                "facility": facilities_lonlat.index.values[positions.ravel()],
+                "distance_km": distances.ravel(),
+            },
+            index=centroids_df.index.repeat(k),
+        )
+
+        pop_df = self._get_population(level, population_limits, population_labels)
+        nearest = assignment_df[assignment_df["rank"] == 1].facility
+        served_df = (
+            pop_df.reindex(centroids_df.index)
+            .groupby(nearest.values)
+            .sum()
+            .reindex(facilities_lonlat.index, fill_value=0)
+        )
+        return assignment_df, served_df
+
+    def accessibility(
+        self,
+        facilities: pd.DataFrame,
+        radius_km: float,
+        decay: str | Callable | list = "uniform",
+        level: str = "municipality",
+        weighted: bool = True,
+        population_limits: str | list = "total",
+        population_labels: list | None = None,
+        demand: str = "population",
+    ) -> pd.DataFrame:
+        """Method to compute two-step floating catchment area (2SFCA) accessibility, i.e. supply per
+        capita within ``radius_km``, of many facility types at once.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> facilities = pd.DataFrame(
+           ...     {"lon": [7.68, 9.19], "lat": [45.07, 45.46], "beds": [1200, 3000], "doctors": [300, 800]}
+           ... )
+           >>> gp.accessibility(facilities, radius_km=30, decay=["uniform", "gaussian"])
+           # a dataframe with municipality_code as index and (decay, supply) columns
+
+        Distances are great-circle distances between centroids of areas
+        (see :py:meth:`get_centroids`) and facilities; pairs within ``radius_km`` are found with a
+        radius query on KD-trees and both steps are sparse matrix products.
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param facilities: a 2-dimensional dataframe with ``lon`` and ``lat`` columns and a column
+            of supply (e.g. beds) for every facility type.
+        :type facilities: pd.DataFrame
+        :param radius_km: the catchment radius.
+        :type radius_km: float
+        :param decay: ``'uniform'``, ``'linear'``, ``'gaussian'``, a function of distances and
+            radius that returns weights or a list of them, defaults to 'uniform'.
+        :type decay: str | Callable | list, optional
+        :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param weighted: if True population-weighted centroids are used, defaults to True.
+        :type weighted: bool, optional
+        :param population_limits: a list of int or ``'total'`` or ``'auto'``, defaults to 'total'.
+        :type population_limits: str | list, optional
+        :param population_labels: a list of strings that defines labels name, defaults to None.
+        :type population_labels: list[str] | None, optional
+        :param demand: the population column used as demand according to ``population_limits`` and
+            ``population_labels`` (e.g. ``'>=65'`` with ``population_limits=[65]``), defaults to
+            'population'.
+        :type demand: str, optional
+
+        :raises ValueError: if ``level`` or ``decay`` are not valid.
+
+        :return: a 2-dimensional dataframe with istat codes of ``level`` as index and supply columns
+            as columns, or ``(decay, supply)`` columns if ``decay`` is a list.
+        :rtype: pd.DataFrame
+        """
+        level = _normalize_level(level)
+        centroids_df = self.get_centroids(level, weighted)
+        pop_df = self._get_population(level, population_limits, population_labels)
+        supply_df = facilities.drop(columns=["lon", "lat"])
+        areas, facility_positions, distance_km = pairs_within(
+            self.get_centroid_tree(level, weighted),
+            build_tree(facilities[["lon", "lat"]].values),
+            radius_km,
+        )
+        decays = decay if isinstance(decay, list) else [decay]
+        ret = {}
+        for decay_ in decays:
+            ret[getattr(decay_, "__name__", decay_)] = pd.DataFrame(
+                two_step_floating_catchment(
+                    areas,
+                    facility_positions,
+                    distance_km,
+                    pop_df[demand].reindex(centroids_df.index).fillna(0).values,
+                    supply_df.fillna(0).values,
+                    radius_km,
+                    decay_,
+                ),
+                index=centroids_df.index,
+                columns=supply_df.columns,
+            )
+        if isinstance(decay, list):
+            return pd.concat(ret, axis=1)
+        return next(iter(ret.values()))
+
+    def interpolate_population(
+        self,
+        targets: pd.DataFrame | pd.Series,
+        level: str = "municipality",
+        population_limits: str | list = "auto",
+        population_labels: list | None = None,
+        batch_size: int = 1000,
+        n_jobs: int = 1,
+    ) -> pd.DataFrame:
+        """Method to estimate population inside arbitrary polygons (e.g. flood zones, service areas
+        or buffers) by area-weighted interpolation, i.e. assuming that population is evenly spread
+        inside every area of ``level``.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> zones = gpd.GeoDataFrame(geometry=[...], crs="EPSG:4326")
+           >>> gp.interpolate_population(zones, population_limits="total")
+           # a dataframe with the index of zones and population_F, population_M and population columns
+
+        .. note::
+            Requires ``scipy``, install it with ``pip install italy-geopop[spatial]``.
+
+        :param targets: a GeoDataFrame or a GeoSeries of target polygons with a crs.
+        :type targets: gpd.GeoDataFrame | gpd.GeoSeries
+        :param level: the level of source areas, one of ``'municipality'``, ``'province'`` or
+            ``'region'``, defaults to 'municipality'.
+        :type level: str, optional
+        :param population_limits: a list of int or ``'total'`` or ``'auto'``, defaults to 'auto'.
+        :type population_limits: str | list, optional
+        :param population_labels: a list of strings that defines labels name, defaults to None.
+        :type population_labels: list[str] | None, optional
+        :param batch_size: the number of targets intersected at once, defaults to 1000.
+        :type batch_size: int, optional
+        :param n_jobs: the number of threads that process batches, defaults to 1.
+        :type n_jobs: int, optional
+
+        :raises ValueError: if ``level`` is not valid.
+
+        :return: a 2-dimensional dataframe with the index of ``targets`` and population columns
+            according to ``population_limits`` and ``population_labels``.
+        :rtype: pd.DataFrame
+        """
+        level = _normalize_level(level)
+        geo_attr = {
+            "municipality": "italy_municipalities_geometry",
+            "province": "italy_provinces_geometry",
+            "region": "italy_regions_geometry",
+        }[level]
+        pop_df = self._get_population(level, population_limits, population_labels)
+        source = getattr(self, geo_attr).geometry
+        weights = area_weights(
+            source,
+            getattr(targets, "geometry", targets),
+            batch_size=batch_size,
+            n_jobs=n_jobs,
+        )
+        return pd.DataFrame(
+            weights @ pop_df.reindex(source.index).fillna(0).values,
+            index=targets.index,
+            columns=pop_df.columns,
+        )
+
+    def _get_year_geopop(self, data_year: int) -> "Geopop":
+        """Return a :py:class:`Geopop` for ``data_year``, reusing self and instances already created."""
+        if data_year == self.data_year:
+            return self
+        with self._locks("_year_geopops"):
+            if not hasattr(self, "_year_geopops"):
+                setattr(self, "_year_geopops", {})
+            if data_year not in self._year_geopops:
+                self._year_geopops[data_year] = Geopop(
+                    data_year=data_year, regions=self.regions
+                )
+            return self._year_geopops[data_year]
+
+    def _compose_panel(
+        self,
+        level: str,
+        years: list,
+        include_geometry: bool,
+        population_limits: str | list,
+        population_labels: list | None,
+        crs: Any = None,
+    ) -> pd.DataFrame:
+        geopops = [self._get_year_geopop(int(year)) for year in sorted(set(years))]
+        data_attr = {
+            "municipality": "italy_municipalities",
+            "province": "italy_provinces",
+            "region": "italy_regions",
+        }[level]
+        ret = pd.concat(
+            [gp._add_density(getattr(gp, data_attr), level) for gp in geopops],
+            keys=[gp.data_year for gp in geopops],
+            names=["year"],
+        )
+        if include_geometry:
+            geo_dfs = [gp.get_geometry(level, crs) for gp in geopops]
+            geometries = share_unchanged_geometries([x.geometry for x in geo_dfs])
+            geo_df = pd.concat(
+                geometries, keys=[gp.data_year for gp in geopops], names=["year"]
+            ).to_frame("geometry")
+            ret = pd.merge(ret, geo_df, how="left", left_index=True, right_index=True)
+
+        pop_df = pd.concat(
+            [gp.population_df for gp in geopops],
+            keys=[gp.data_year for gp in geopops],
+            names=["year"],
+        )
+        pop_df = _group_population(
+            pop_df,
+            population_limits,
+            population_labels,
+            by=["year", "municipality_code"],
+        )
+        if level != "municipality":
+            mun_df = pd.concat(
+                [gp.italy_municipalities[[f"{level}_code"]] for gp in geopops],
+                keys=[gp.data_year for gp in geopops],
+                names=["year"],
+            )
+            pop_df = (
+                pd.merge(mun_df, pop_df, how="left", left_index=True, right_index=True)
+                .groupby(["year", f"{level}_code"])
+                .sum()
+            )
+        ret = pd.merge(ret, pop_df, how="left", left_index=True, right_index=True)
+        if "density" in ret.columns:
+            # last, as in ``compose_df``
+            ret = ret[[x for x in ret.columns if x != "density"] + ["density"]]
+        return ret.reset_index()
+
+    def _add_density(self, df: pd.DataFrame, level: str) -> pd.DataFrame:
+        """Add ``density`` (inhabitants per km²) column if ``area_km2`` column is available."""
+        if "area_km2" not in df.columns:
+            return df
+        pop_df = self._get_population(level, "total")
+        df = df.copy()
+        df["density"] = pop_df.population.reindex(df.index) / df.area_km2
+        return df
+
     def compose_df(
         self,
         level="municipality",
         include_geometry=False,
         population_limits: str | list = "auto",
         population_labels: list | None = None,
+        years: list | None = None,
+        crs: Any = None,
     ):
         """Method to get a dataframe with administrative, geospatial and population data.
 
+        If ``years`` is provided, a long panel with data of every year and a ``year`` column is returned.
+        Population of every year is grouped at once and geometries that did not change from the
+        previous year are the same objects, so they are stored only once.
+        If precomputed ``area_km2`` column is available, ``density`` column (inhabitants per km²) is included too.
+
         :param level: the level of details of the dataframe that can be ``muncipality`` or ``province`` or ``region``, defaults to 'muncipality'.
         :type level: str, optional
         :param include_geometry: if True the dataframe will include geospatial data, defaults to False.
@@ -320,12 +1698,28 @@ class Geopop:
         :type population_limits: str | list, optional
         :param population_labels: a list of str that defines labels name, defaults to None.
         :type population_labels: list | None, optional
+        :param years: a list of years to be included in the panel, if None only data of
+            ``data_year`` is returned without ``year`` column, defaults to None.
+        :type years: list[int] | None, optional
+        :param crs: the crs of geospatial data, see :py:meth:`get_geometry`, defaults to None.
+        :type crs: Any, optional
+
+        :raises ValueError: if ``level`` is not valid or one of ``years`` is not available.
 
         """
-        level = level.lower().strip()
+        level = _normalize_level(level)
+        if years is not None:
+            return self._compose_panel(
+                level,
+                years,
+                include_geometry,
+                population_limits,
+                population_labels,
+                crs,
+            )
         if level == "municipality":
             if include_geometry:
-                geo_df = self.italy_municipalities_geometry
+                geo_df = self.get_geometry(level, crs)
             pop_df = self.get_italian_population_for_municipalites(
                 population_limits=population_limits, population_labels=population_labels
             )
@@ -341,10 +1735,10 @@ class Geopop:
                 ret = pd.merge(
                     mun_df, pop_df, how="left", left_index=True, right_index=True
                 )
-            return ret.reset_index()
+            return self._add_density(ret, level).reset_index()
         elif level == "province":
             if include_geometry:
-                geo_df = self.italy_provinces_geometry
+                geo_df = self.get_geometry(level, crs)
             pop_df = self.get_italian_population_for_provinces(
                 population_limits=population_limits, population_labels=population_labels
             )
@@ -360,10 +1754,10 @@ class Geopop:
                 ret = pd.merge(
                     pro_df, pop_df, how="left", left_index=True, right_index=True
                 )
-            return ret.reset_index()
+            return self._add_density(ret, level).reset_index()
         elif level == "region":
             if include_geometry:
-                geo_df = self.italy_regions_geometry
+                geo_df = self.get_geometry(level, crs)
             pop_df = self.get_italian_population_for_regions(
                 population_limits=population_limits, population_labels=population_labels
             )
@@ -379,7 +1773,7 @@ class Geopop:
                 ret = pd.merge(
                     reg_df, pop_df, how="left", left_index=True, right_index=True
                 )
-            return ret.reset_index()
+            return self._add_density(ret, level).reset_index()
         else:
             raise ValueError(
                 f'level must be "municipality", "province" or "region" not "{level}"'
@@ -0,0 +1,165 @@
+"""Scalar lookups for low-latency services: resolve a single value, e.g. ``"MI"``, into the data of
+its municipality, province or region.
+
+.. code-block:: python
+   :linenos:
+
+   >>> from italy_geopop import lookup
+   >>> lookup.province("MI")
+   {'province_code': 15, 'province': 'Milano', 'province_short': 'MI', ...}
+
+Data of every level are indexed the first time they are requested (or by :py:func:`prepare`),
+afterwards a lookup is a couple of dictionary accesses that take microseconds and involve no pandas
+objects.
+"""
+
+from typing import Any, Iterable, Optional
+
+from ._utils import KeyedLocks
+
+_locks = KeyedLocks()
+_indices = {}
+
+# columns whose lowercase values resolve to a row of the level, with istat codes
+_key_columns = {
+    "municipality": ["municipality", "cadastral_code"],
+    "province": ["province", "province_short"],
+    "region": ["region"],
+}
+
+
+def _to_python(value: Any) -> Any:
+    # arrays of object columns, e.g. municipalities of a province
+    return value.tolist() if hasattr(value, "tolist") else value
+
+
+def _index_key(level: str, data_year: Optional[int], population_limits: str | list):
+    if not isinstance(population_limits, str):
+        population_limits = tuple(population_limits)
+    return level, data_year, population_limits
+
+
+def _build_index(
+    level: str, data_year: Optional[int], population_limits: str | list
+) -> dict:
+    from .geopop import Geopop
+
+    df = Geopop(data_year).compose_df(level=level, population_limits=population_limits)
+    index = {}
+    for record in df.to_dict("records"):
+        row = {column: _to_python(value) for column, value in record.items()}
+        for column in _key_columns[level]:
+            index[str(row[column]).lower()] = row
+        index[row[f"{level}_code"]] = row
+    return index
+
+
+def _get_index(
+    level: str, data_year: Optional[int], population_limits: str | list
+) -> dict:
+    key = _index_key(level, data_year, population_limits)
+    index = _indices.get(key)
+    if index is None:
+        with _locks(key):
+            if key not in _indices:
+                _indices[key] = _build_index(level, data_year, population_limits)
+            index = _indices[key]
+    return index
+
+
+def _lookup(index: dict, value: Any) -> Optional[dict]:
+    row = index.get(value)
+    if row is None and not isinstance(value, int):
+        key = str(value).strip().lower()
+        row = index.get(key)
+        if row is None:
+            try:
+                row = index.get(int(float(key)))
+            except (ValueError, OverflowError):
+                return None
+    # a copy, so that callers can't alter the index
+    return None if row is None else row.copy()
+
+
+def municipality(
+    value: Any, data_year: Optional[int] = None, population_limits: str | list = "total"
+) -> Optional[dict]:
+    """Return data of a municipality given its istat code, cadastral code or name (case
+    insensitive); municipality names are not unique, an ambiguous name resolves to the last
+    municipality with that name.
+
+    :param value: the istat code, cadastral code or name.
+    :type value: Any
+    :param data_year: the year of data, if None the latest available, defaults to None.
+    :type data_year: int | None, optional
+    :param population_limits: a list of int or ``'total'`` or ``'auto'``,
+        see :py:meth:`italy_geopop.geopop.Geopop.compose_df`, defaults to 'total'.
+    :type population_limits: str | list, optional
+
+    :return: a dictionary with the same fields of :py:meth:`italy_geopop.geopop.Geopop.compose_df`
+        (without geometry) or None if ``value`` is not found.
+    :rtype: dict | None
+    """
+    return _lookup(_get_index("municipality", data_year, population_limits), value)
+
+
+def province(
+    value: Any, data_year: Optional[int] = None, population_limits: str | list = "total"
+) -> Optional[dict]:
+    """Return data of a province given its istat code, abbreviation or name (case insensitive).
+
+    :param value: the istat code, abbreviation or name.
+    :type value: Any
+    :param data_year: the year of data, if None the latest available, defaults to None.
+    :type data_year: int | None, optional
+    :param population_limits: a list of int or ``'total'`` or ``'auto'``,
+        see :py:meth:`italy_geopop.geopop.Geopop.compose_df`, defaults to 'total'.
+    :type population_limits: str | list, optional
+
+    :return: a dictionary with the same fields of :py:meth:`italy_geopop.geopop.Geopop.compose_df`
+        (without geometry) or None if ``value`` is not found.
+    :rtype: dict | None
+    """
+    return _lookup(_get_index("province", data_year, population_limits), value)
+
+
+def region(
+    value: Any, data_year: Optional[int] = None, population_limits: str | list = "total"
+) -> Optional[dict]:
+    """Return data of a region given its istat code or name (case insensitive).
+
+    :param value: the istat code or name.
+    :type value: Any
+    :param data_year: the year of data, if None the latest available, defaults to None.
+    :type data_year: int | None, optional
+    :param population_limits: a list of int or ``'total'`` or ``'auto'``,
+        see :py:meth:`italy_geopop.geopop.Geopop.compose_df`, defaults to 'total'.
+    :type population_limits: str | list, optional
+
+    :return: a dictionary with the same fields of :py:meth:`italy_geopop.geopop.Geopop.compose_df`
+        (without geometry) or None if ``value`` is not found.
+    :rtype: dict | None
+    """
+    return _lookup(_get_index("region", data_year, population_limits), value)
+
+
+def prepare(
+    levels: Iterable[str] = ("municipality", "province", "region"),
+    data_year: Optional[int] = None,
+    population_limits: str | list = "total",
+):
+    """Index data of ``levels`` in advance, e.g. when a service starts, so that the first lookups don't pay for it.
+
+    :param levels: levels to be indexed, defaults to all of them.
+    :type levels: Iterable[str], optional
+    :param data_year: the year of data, if None the latest available, defaults to None.
+    :type data_year: int | None, optional
+    :param population_limits: a list of int or ``'total'`` or ``'auto'``, defaults to 'total'.
+    :type population_limits: str | list, optional
+
+    :raises ValueError: if a level is not valid.
+    """
+    from .geopop import _normalize_level
+
+    for level in levels:
+        _get_index(_normalize_level(level), data_year, population_limits)
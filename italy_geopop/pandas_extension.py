@@ -4,11 +4,19 @@ import re
 import numpy as np
 import pandas as pd
 
-from typing import Any, Optional
-
-from ._utils import handle_return_cols, match_single_key
+from typing import Any, Iterable, Optional
+
+from ._utils import (
+    handle_return_cols,
+    match_single_key,
+    detect_lookup_levels,
+    normalize_lookup_keys,
+    resolve_lookup_keys,
+)
 from . import geopop
 
+_levels = ["region", "province", "municipality"]
+
 
 class ItalyGeopop:
     """Serves as base for registering ``italy_geopop`` as pandas accessor. You shouldn't initalize it directly.
@@ -21,9 +29,10 @@ class ItalyGeopop:
         pandas_obj: Any,
         include_geometry: bool = False,
         data_year: Optional[int] = None,
+        regions: Optional[Iterable[int | str]] = None,
     ) -> None:
         self.data_year = data_year
-        self.geopop = geopop.Geopop(data_year=self.data_year)
+        self.geopop = geopop.Geopop(data_year=self.data_year, regions=regions)
         self.include_geometry = include_geometry
         self._obj = pandas_obj
 
@@ -79,10 +88,13 @@ class ItalyGeopop:
         regex: bool = False,
         population_limits: list | str = "auto",
         population_labels: list | None = None,
+        remap: bool = False,
     ) -> pd.DataFrame:
         """Get data for municipalities.
         Input series can contain municipalities names, municipalities istat codes or municipalities cadastral code (also known as Belfiore's code); *data types can also be mixed*.
         If input data is not found in italian data, a row of NaNs is returned, *this behaviour may change in the future.*
+        If ``remap`` is True, municipalities of previous years are replaced by their successors
+        before resolution, see ``remap_municipality``.
 
         :param return_cols: used to subset the returned data in order to provide the requested fields. If None, all available fields are returned. If is an instance of re.Pattern or is a string and regex param is True columns will be filtered and returned only if their names match the regular expression. The available fields are listed above, defaults to None.
         :type return_cols: list[str] | None, optional.
@@ -92,12 +104,22 @@ class ItalyGeopop:
         :type population_limits: list[int] | str, optional.
         :param population_labels: a list of strings that defines labels name, if None the :ref:`default label naming rule<default-label-naming-rule>` will be used, defaults to None.
         :type population_labels: list[str] | None, optional.
+        :param remap: if True, municipalities of previous years are replaced by their successors
+            (the most populated one if they are more than one), defaults to False.
+        :type remap: bool, optional.
 
         :raises KeyError: if return_cols is or contains a column not listed above or includes ``geometry`` and accessor was intialize without geometry data.
 
         :return: Requested data in a 2-dimensional dataframe that has the same index of input data.
         :rtype: pandas.DataFrame
         """
+        obj = self._obj
+        if remap:
+            successors_df = self._get_successor_codes().drop_duplicates("position")
+            obj = obj.astype(object)
+            obj.iloc[successors_df.position.values] = (
+                successors_df.municipality_code.values
+            )
         str_indexed, code_indexed, cadastral_indexed = self._generate_municipality_dfs(
             population_limits=population_limits,
             population_labels=population_labels,
@@ -120,7 +142,78 @@ class ItalyGeopop:
                 else:
                     return str_indexed.get(x, empty_serie)
 
-        return handle_return_cols(self._obj.apply(get_data), return_cols, regex)
+        return handle_return_cols(obj.apply(get_data), return_cols, regex)
+
+    def _get_successor_codes(
+        self, variations: pd.DataFrame | None = None
+    ) -> pd.DataFrame:
+        """Return successors of municipalities of previous years in a dataframe with ``position``
+        (of the value in input data), ``municipality_code`` and ``weight`` columns, ordered by
+        position and descending weight."""
+        crosswalk_df = self.geopop.get_municipality_crosswalk(variations=variations)
+        keys = normalize_lookup_keys(self._obj).to_frame("key")
+        keys["position"] = np.arange(len(keys))
+        ret = pd.merge(keys, crosswalk_df, how="inner", left_on="key", right_index=True)
+        ret = ret.sort_values(
+            ["position", "weight"], ascending=[True, False], kind="stable"
+        )
+        return ret[["position", "municipality_code", "weight"]]
+
+    def remap_municipality(
+        self, variations: pd.DataFrame | None = None, splits: bool = False
+    ) -> pd.Series | pd.DataFrame:
+        """Get istat codes of municipalities, mapping municipalities of previous years to their successors.
+        Input series can contain the same values of ``from_municipality`` and also istat codes,
+        cadastral codes and names of municipalities of previous available years.
+        Municipalities are matched by istat code or else by cadastral code; merged and split
+        municipalities are mapped only if ``variations`` lists them,
+        see :py:meth:`italy_geopop.geopop.Geopop.get_municipality_crosswalk`.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> variations = pd.DataFrame({"municipality_code": [5079, 5110], "successor_code": [5005, 5005]})
+           >>> pd.Series([5079, "Tonengo", "Agliè"]).italy_geopop.remap_municipality(variations=variations)
+           0    5005.0
+           1    5005.0
+           2    1001.0
+           dtype: float64
+
+        :param variations: a dataframe of administrative variations with ``municipality_code`` and
+            ``successor_code`` columns, defaults to None.
+        :type variations: pd.DataFrame | None, optional.
+        :param splits: if True, a row for every successor of split municipalities is returned
+            together with its population-based ``weight``, otherwise only the most populated
+            successor is returned, defaults to False.
+        :type splits: bool, optional.
+
+        :return: a series of istat codes with the same index of input data (NaN if not found) or, if
+            ``splits`` is True, a 2-dimensional dataframe with ``municipality_code`` and ``weight``
+            columns whose index may repeat input index.
+        :rtype: pandas.Series | pandas.DataFrame
+        """
+        keys = normalize_lookup_keys(self._obj).to_frame("key")
+        current_codes = resolve_lookup_keys(
+            keys, self.geopop.get_lookup_table("municipality"), "municipality_code"
+        )
+        successors_df = self._get_successor_codes(variations=variations)
+        if splits:
+            current_df = pd.DataFrame(
+                {
+                    "position": np.arange(len(keys)),
+                    "municipality_code": current_codes.values,
+                    "weight": 1.0,
+                }
+            ).dropna()
+            ret = pd.concat([current_df, successors_df]).sort_values(
+                "position", kind="stable"
+            )
+            ret.index = self._obj.index[ret.position.values]
+            return ret[["municipality_code", "weight"]]
+        successors_df = successors_df.drop_duplicates("position")
+        codes = current_codes.values.astype(float)
+        codes[successors_df.position.values] = successors_df.municipality_code.values
+        return pd.Series(codes, index=self._obj.index)
 
     def _generate_province_dfs(
         self,
@@ -264,6 +357,109 @@ class ItalyGeopop:
 
         return handle_return_cols(self._obj.apply(get_data), return_cols, regex)
 
+    def resolve(
+        self,
+        level: str = "auto",
+        return_cols: list | str | re.Pattern | None = None,
+        regex: bool = False,
+        population_limits: list | str = "auto",
+        population_labels: list | None = None,
+    ) -> pd.DataFrame | pd.Series:
+        """Get istat codes and population for series that mix municipalities, provinces and regions.
+        Input series can contain everything accepted by ``from_municipality``, ``from_province`` and
+        ``from_region``; the level of every value is detected with these rules:
+
+        - numbers with 4 or more digits or greater than 999 are municipality istat codes, numbers
+          with 3 digits (e.g. ``'015'``) or greater than 20 are province istat codes, other numbers
+          are region istat codes.
+        - values that look like cadastral codes (e.g. ``F205``) are municipalities.
+        - two-letter values that are province abbreviations (e.g. ``MI``) are provinces.
+        - names are looked up in municipalities, then in provinces and then in regions, so ``Milano`` is a municipality.
+
+        Returned columns are ``level``, ``municipality_code``, ``province_code``, ``region_code``
+        and population columns of the detected level.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> s = pd.Series(["Lombardia", "MI", "Milano", "015146", "F205"])
+           >>> s.italy_geopop.resolve(return_cols=["level", "municipality_code", "province_code", "region_code"])
+                     level  municipality_code  province_code  region_code
+           0        region                NaN            NaN          3.0
+           1      province                NaN           15.0          3.0
+           2  municipality            15146.0           15.0          3.0
+           3  municipality            15146.0           15.0          3.0
+           4  municipality            15146.0           15.0          3.0
+
+        :param level: ``'auto'`` to detect the level of every value or one of ``municipality``,
+            ``province`` or ``region`` to force it, defaults to 'auto'.
+        :type level: str, optional.
+        :param return_cols: used to subset the returned data in order to provide the requested
+            fields. If None, all available fields are returned. If is an instance of re.Pattern or
+            is a string and regex param is True columns will be filtered and returned only if their
+            names match the regular expression, defaults to None.
+        :type return_cols: list[str] | None, optional.
+        :param regex: if True, return_cols is interpreted as a regex pattern, defaults to False.
+        :type regex: bool, optional.
+        :param population_limits: see above, can be a list of int or ``'total'`` or ``'auto'``, defaults to 'auto'.
+        :type population_limits: list[int] | str, optional.
+        :param population_labels: a list of strings that defines labels name, if None the
+            :ref:`default label naming rule<default-label-naming-rule>` will be used, defaults to None.
+        :type population_labels: list[str] | None, optional.
+
+        :raises ValueError: if ``level`` is not one of ``auto``, ``municipality``, ``province`` or ``region``.
+        :raises KeyError: if return_cols is or contains a column not available.
+
+        :return: Requested data in a 2-dimensional dataframe that has the same index of input data.
+        :rtype: pandas.DataFrame
+        """
+        level = geopop._normalize_level(level, allow_auto=True)
+        lookup_dfs = {x: self.geopop.get_lookup_table(x) for x in _levels}
+        positions, unique_values = pd.factorize(self._obj, use_na_sentinel=False)
+        unique_values = pd.Series(unique_values, dtype=object)
+        keys = normalize_lookup_keys(unique_values).to_frame("key")
+        if level == "auto":
+            keys["level"] = detect_lookup_levels(unique_values, lookup_dfs)
+        else:
+            keys["level"] = level
+
+        ret = pd.DataFrame(
+            index=keys.index,
+            columns=["level"] + [f"{x}_code" for x in reversed(_levels)],
+        )
+        pop_dfs = []
+        for x in _levels:
+            mask = keys.level == x
+            if not mask.any():
+                continue
+            codes = resolve_lookup_keys(keys[mask], lookup_dfs[x], f"{x}_code")
+            found = codes.notna()
+            ret.loc[codes.index[found], "level"] = x
+            upper_df = (
+                lookup_dfs[x]
+                .drop_duplicates(f"{x}_code")
+                .set_index(f"{x}_code", drop=False)
+                .reindex(codes[found].values)
+                .set_axis(codes.index[found])
+            )
+            ret.loc[upper_df.index, upper_df.columns] = upper_df
+            pop_df = {
+                "municipality": self.geopop.get_italian_population_for_municipalites,
+                "province": self.geopop.get_italian_population_for_provinces,
+                "region": self.geopop.get_italian_population_for_regions,
+            }[x](population_limits, population_labels)
+            pop_dfs.append(
+                pop_df.reindex(codes[found].values).set_axis(codes.index[found])
+            )
+
+        for x in _levels:
+            ret[f"{x}_code"] = pd.to_numeric(ret[f"{x}_code"])
+        if pop_dfs:
+            ret = ret.join(pd.concat(pop_dfs))
+        ret = ret.iloc[positions]
+        ret.index = self._obj.index
+        return handle_return_cols(ret, return_cols, regex)
+
     def smart_from_municipality(
         self,
         return_cols: list | str | re.Pattern | None = None,
@@ -271,7 +467,8 @@ class ItalyGeopop:
         population_limits: list | str = "auto",
         population_labels: list | None = None,
     ) -> pd.DataFrame | pd.Series:
-        """Same as ``from_municipality`` but can understand more complex text. Values are returned only if match is unequivocal.
+        """Same as ``from_municipality`` but can understand more complex text. Values are returned
+        only if match is unequivocal.
 
 
         .. code-block:: python
@@ -403,13 +600,188 @@ class ItalyGeopop:
         return handle_return_cols(ret, return_cols, regex)
 
 
-def pandas_activate(include_geometry=False, data_year: Optional[int] = None):
-    """Activate pandas extension registering class :py:class:ItalyGeopop as pandas.Series `accessor <https://pandas.pydata.org/docs/development/extending.html>`_ named ``italy_geopop``.
+class ItalyGeopopDataFrame:
+    """Serves as base for registering ``italy_geopop`` as pandas DataFrame accessor. You shouldn't initalize it directly.
+
+    Instead, from a ``pandas.DataFrame`` object you can access its methods via ``italy_geopop`` attribute.
+    """
+
+    def __init__(
+        self,
+        pandas_obj: Any,
+        include_geometry: bool = False,
+        data_year: Optional[int] = None,
+        regions: Optional[Iterable[int | str]] = None,
+    ) -> None:
+        self.data_year = data_year
+        self.geopop = geopop.Geopop(data_year=self.data_year, regions=regions)
+        self.include_geometry = include_geometry
+        self._obj = pandas_obj
+
+    def _resolve_codes(self, columns: dict[str, str]) -> pd.DataFrame:
+        """Resolve every column of ``columns`` into istat codes of its level, from the upper to the
+        lower level, so that codes of upper levels can break ties between same-named
+        municipalities."""
+        levels = {}
+        for col, level in columns.items():
+            level = geopop._normalize_level(level)
+            if level in levels:
+                raise ValueError(
+                    f'level "{level}" is mapped to more than one column ("{levels[level]}", "{col}")'
+                )
+            levels[level] = col
+
+        codes = pd.DataFrame(index=self._obj.index)
+        for level in _levels:
+            if level not in levels:
+                continue
+            parent_cols = [
+                f"{x}_code" for x in reversed(_levels[: _levels.index(level)])
+            ]
+            parent_cols = [x for x in parent_cols if x in codes.columns]
+            keys = codes[parent_cols].copy()
+            keys["key"] = normalize_lookup_keys(self._obj[levels[level]])
+            codes[f"{level}_code"] = resolve_lookup_keys(
+                keys,
+                self.geopop.get_lookup_table(level),
+                f"{level}_code",
+                parent_cols=parent_cols,
+            )
+        return codes
+
+    def resolve(
+        self,
+        columns: dict[str, str],
+        return_cols: list | str | re.Pattern | None = None,
+        regex: bool = False,
+        population_limits: list | str = "auto",
+        population_labels: list | None = None,
+    ) -> pd.DataFrame | pd.Series:
+        """Get data for rows described by more than one column, e.g. a municipality column together
+        with a province and a region column.
+        Every column is resolved as ``from_municipality``, ``from_province`` or ``from_region``
+        would do, but all of them in a single vectorized pass.
+        Province and region columns are used to pick the right municipality among municipalities
+        with the same name (e.g. ``Samone``, ``TO``).
+
+        Data of the lowest mapped level is returned together with consistency flags, one for each pair of mapped levels:
+
+        - ``municipality_in_province`` - True if municipality belongs to the given province.
+        - ``municipality_in_region`` - True if municipality belongs to the given region.
+        - ``province_in_region`` - True if province belongs to the given region.
+
+        Flags are ``<NA>`` if one of the two values is not found in italian data.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> df = pd.DataFrame({"comune": ["Samone", "Samone", "Milano"], "provincia": ["TO", "TN", "RM"]})
+           >>> df.italy_geopop.resolve(
+           ...     {"comune": "municipality", "provincia": "province"},
+           ...     return_cols=["municipality_code", "municipality_in_province"],
+           ... )
+              municipality_code  municipality_in_province
+           0               1235                      True
+           1              22165                      True
+           2              15146                     False
+
+        :param columns: a dict whose keys are columns of the dataframe and values are their levels
+            (``municipality``, ``province`` or ``region``).
+        :type columns: dict[str, str]
+        :param return_cols: same as ``from_municipality``, consistency flags can be selected too, defaults to None.
+        :type return_cols: list[str] | None, optional.
+        :param regex: if True, return_cols is interpreted as a regex pattern, defaults to False.
+        :type regex: bool, optional.
+        :param population_limits: see above, can be a list of int or ``'total'`` or ``'auto'``, defaults to 'auto'.
+        :type population_limits: list[int] | str, optional.
+        :param population_labels: a list of strings that defines labels name, if None the
+            :ref:`default label naming rule<default-label-naming-rule>` will be used, defaults to None.
+        :type population_labels: list[str] | None, optional.
+
+        :raises ValueError: if a level is not valid or is mapped to more than one column.
+        :raises KeyError: if a column is not found in the dataframe or return_cols is or contains a column not available.
+
+        :return: Requested data in a 2-dimensional dataframe that has the same index of input data,
+            istat codes are nullable integers (``Int64``), ``<NA>`` if not found, but codes of upper
+            levels are kept from the columns that resolved when the lowest level is not found.
+        :rtype: pandas.DataFrame
+        """
+        codes = self._resolve_codes(columns)
+        level = [x for x in _levels if f"{x}_code" in codes.columns][-1]
+        data_df = self.geopop.compose_df(
+            level=level,
+            population_limits=population_limits,
+            population_labels=population_labels,
+            include_geometry=self.include_geometry,
+        ).set_index(f"{level}_code", drop=False)
+        ret = data_df.reindex(codes[f"{level}_code"].values)
+        ret.index = self._obj.index
+        # rows not found would make codes float
+        for x in _levels:
+            if f"{x}_code" in ret.columns:
+                ret[f"{x}_code"] = ret[f"{x}_code"].astype("Int64")
+
+        for lower, upper in [
+            ("municipality", "province"),
+            ("municipality", "region"),
+            ("province", "region"),
+        ]:
+            if f"{lower}_code" not in codes.columns or f"{upper}_code" not in codes:
+                continue
+            if lower == level:
+                lower_upper_codes = ret[f"{upper}_code"]
+            else:
+                lower_upper_codes = self._upper_codes(codes, lower, upper)
+            flag = (lower_upper_codes == codes[f"{upper}_code"]).astype("boolean")
+            flag[lower_upper_codes.isna() | codes[f"{upper}_code"].isna()] = pd.NA
+            ret[f"{lower}_in_{upper}"] = flag
+
+        # rows whose lowest level is not found keep codes of upper levels that resolved
+        for upper in reversed(_levels[: _levels.index(level)]):
+            upper_codes = ret[f"{upper}_code"]
+            if f"{upper}_code" in codes.columns:
+                upper_codes = upper_codes.fillna(codes[f"{upper}_code"])
+            for lower in _levels[: _levels.index(level)]:
+                if (
+                    _levels.index(lower) > _levels.index(upper)
+                    and f"{lower}_code" in codes.columns
+                ):
+                    upper_codes = upper_codes.fillna(
+                        self._upper_codes(codes, lower, upper)
+                    )
+            ret[f"{upper}_code"] = upper_codes.astype("Int64")
+
+        return handle_return_cols(ret, return_cols, regex)
+
+    def _upper_codes(self, codes: pd.DataFrame, lower: str, upper: str) -> pd.Series:
+        """Get codes of ``upper`` level of the ``lower`` level codes resolved by :py:meth:`_resolve_codes`."""
+        return (
+            self.geopop.get_lookup_table(lower)
+            .drop_duplicates(f"{lower}_code")
+            .set_index(f"{lower}_code")[f"{upper}_code"]
+            .reindex(codes[f"{lower}_code"].values)
+            .set_axis(self._obj.index)
+            .astype("Int64")
+        )
+
+
+def pandas_activate(
+    include_geometry=False,
+    data_year: Optional[int] = None,
+    regions: Optional[Iterable[int | str]] = None,
+):
+    """Activate pandas extension registering class :py:class:ItalyGeopop as pandas.Series `accessor
+    <https://pandas.pydata.org/docs/development/extending.html>`_ named ``italy_geopop``.
+    Class :py:class:ItalyGeopopDataFrame is registered as pandas.DataFrame accessor with the same name.
 
     :param include_geometry: specifies if geometry column should also be returned when accessor is used, defaults to False.
     :type include_geometry: bool, optional.
     :param data_year: year of data to use, if None the latest available data will be used, defaults to None.
     :type data_year: int, optional.
+    :param regions: codes or names of regions to use, only their data are loaded
+        (see :py:class:`italy_geopop.geopop.Geopop`), areas of other regions are not found; if None
+        the whole country is used, defaults to None.
+    :type regions: Iterable[int | str], optional.
 
     :return: None
 
@@ -421,12 +793,29 @@ def pandas_activate(include_geometry=False, data_year: Optional[int] = None):
     class Accessor(ItalyGeopop):
         def __init__(self, pandas_obj) -> None:
             super().__init__(
-                pandas_obj, include_geometry=include_geometry, data_year=data_year
+                pandas_obj,
+                include_geometry=include_geometry,
+                data_year=data_year,
+                regions=regions,
+            )
+
+    @pd.api.extensions.register_dataframe_accessor("italy_geopop")
+    class DataFrameAccessor(ItalyGeopopDataFrame):
+        def __init__(self, pandas_obj) -> None:
+            super().__init__(
+                pandas_obj,
+                include_geometry=include_geometry,
+                data_year=data_year,
+                regions=regions,
             )
 
 
 @contextmanager
-def pandas_activate_context(include_geometry=False, data_year: Optional[int] = None):
+def pandas_activate_context(
+    include_geometry=False,
+    data_year: Optional[int] = None,
+    regions: Optional[Iterable[int | str]] = None,
+):
     """
     Same as activate but lives within the context. Useful if you want to register the accessor with different
     initialization options more than once in your code or if you want to free up memory right after you get the needed data
@@ -434,8 +823,9 @@ def pandas_activate_context(include_geometry=False, data_year: Optional[int] = N
 
     :param include_geometry: same as `italy_geopop.activate <#italy_geopop.pandas_extension.pandas_activate>`_.
     :param data_year: same as `italy_geopop.activate <#italy_geopop.pandas_extension.pandas_activate>`_.
+    :param regions: same as `italy_geopop.activate <#italy_geopop.pandas_extension.pandas_activate>`_.
 
-    :yields: Context with ``italy_geopop`` accessor registered to pd.Series.
+    :yields: Context with ``italy_geopop`` accessor registered to pd.Series and pd.DataFrame.
     .. code-block:: python
 
        # pandas_activate_context example
@@ -446,7 +836,9 @@ def pandas_activate_context(include_geometry=False, data_year: Optional[int] = N
        # You cannot access italy_geopop here
     """
     try:
-        pandas_activate(include_geometry=include_geometry, data_year=data_year)
+        pandas_activate(
+            include_geometry=include_geometry, data_year=data_year, regions=regions
+        )
         yield
     except Exception as e:
         raise e
@@ -455,3 +847,7 @@ def pandas_activate_context(include_geometry=False, data_year: Optional[int] = N
             del pd.Series.italy_geopop
         except AttributeError:
             pass
+        try:
+            del pd.DataFrame.italy_geopop
+        except AttributeError:
+            pass
@@ -0,0 +1,240 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from typing import Any, List, Optional
+
+from ._utils import import_optional
+from . import geopop
+
+# renderer of the current worker process, see render_choropleths
+_worker_renderer = None
+
+
+def _geometry_to_path(geometry: Any, path_cls: Any) -> Any:
+    """Convert a (multi)polygon into a single compound matplotlib path, holes included."""
+    vertices, codes = [], []
+    for polygon in shapely.get_parts(geometry):
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = np.asarray(ring.coords)[:, :2]
+            ring_codes = np.full(len(coords), path_cls.LINETO, dtype=path_cls.code_type)
+            ring_codes[0] = path_cls.MOVETO
+            ring_codes[-1] = path_cls.CLOSEPOLY
+            vertices.append(coords)
+            codes.append(ring_codes)
+    if not vertices:
+        return path_cls(np.empty((0, 2)))
+    return path_cls(np.concatenate(vertices), np.concatenate(codes))
+
+
+@lru_cache(maxsize=8)
+def _build_paths(
+    data_year: int,
+    level: str,
+    crs: Any,
+    simplify: float | str | None,
+    pixels: Optional[int] = None,
+) -> tuple:
+    """Build matplotlib paths of every area once per year, level, crs and resolution.
+    If ``simplify`` is ``'auto'``, the resolution is the size of a pixel when the larger side of
+    the geometry spans ``pixels``.
+    """
+    path_cls = import_optional("matplotlib.path", "plot").Path
+    geometry = geopop.Geopop(data_year=data_year).get_geometry(level, crs).geometry
+    geometries = np.asarray(geometry.values)
+    if simplify == "auto":
+        bounds = shapely.total_bounds(geometries)
+        simplify = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / pixels
+    if simplify:
+        geometries = shapely.simplify(geometries, simplify)
+    paths = [_geometry_to_path(x, path_cls) for x in geometries]
+    bounds = shapely.total_bounds(geometries)
+    return geometry.index, paths, bounds
+
+
+class ChoroplethRenderer:
+    """Renders many choropleth maps of the same areas, building the figure and the collection of
+    area paths once and then only swapping face colors for every map.
+
+    .. code-block:: python
+       :linenos:
+
+       >>> renderer = ChoroplethRenderer(level="province", data_year=2022)
+       >>> for indicator in df.columns:
+       ...     renderer.render(df[indicator], f"{indicator}.png", title=indicator)
+
+    .. note::
+        Requires ``matplotlib``, install it with ``pip install italy-geopop[plot]``.
+
+    :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'province'.
+    :type level: str, optional
+    :param data_year: the year of geometry, if None the latest available year is used, defaults to None.
+    :type data_year: int | None, optional
+    :param crs: the crs maps are drawn in, defaults to 'EPSG:32632'.
+    :type crs: Any, optional
+    :param simplify: the tolerance (in units of ``crs``) used to simplify geometry, i.e. the
+        resolution of maps, if ``'auto'`` the size of a pixel is used, if None geometry is not
+        simplified, defaults to 'auto'.
+    :type simplify: float | str | None, optional
+    :param cmap: the name of a matplotlib colormap, defaults to 'viridis'.
+    :type cmap: str, optional
+    :param figsize: the size of the figure in inches, defaults to (6, 7).
+    :type figsize: tuple, optional
+    :param dpi: the resolution of images, defaults to 100.
+    :type dpi: int, optional
+    :param colorbar: if True a colorbar is drawn, defaults to True.
+    :type colorbar: bool, optional
+
+    :raises ValueError: if ``level`` is not valid.
+    :raises ImportError: if ``matplotlib`` is not installed.
+    """
+
+    def __init__(
+        self,
+        level: str = "province",
+        data_year: Optional[int] = None,
+        crs: Any = "EPSG:32632",
+        simplify: float | str | None = "auto",
+        cmap: str = "viridis",
+        figsize: tuple = (6, 7),
+        dpi: int = 100,
+        colorbar: bool = True,
+    ):
+        level = geopop._normalize_level(level)
+        mpl = import_optional("matplotlib", "plot")
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import PathCollection
+        from matplotlib.figure import Figure
+
+        self.data_year = geopop.Geopop(data_year=data_year).data_year
+        # the size of a pixel is computed with the paths, so cached paths need no geometry
+        pixels = max(figsize) * dpi if simplify == "auto" else None
+        self.codes, paths, bounds = _build_paths(
+            self.data_year, level, crs, simplify, pixels
+        )
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        cmap = mpl.colormaps[cmap].copy()
+        cmap.set_bad("lightgrey")
+        self.collection = PathCollection(
+            paths, cmap=cmap, edgecolor="white", linewidth=0.2
+        )
+        self.collection.set_array(np.ma.masked_all(len(paths)))
+        self.ax.add_collection(self.collection)
+        self.ax.set_xlim(bounds[0], bounds[2])
+        self.ax.set_ylim(bounds[1], bounds[3])
+        self.ax.set_aspect("equal")
+        self.ax.set_axis_off()
+        self.colorbar = (
+            self.figure.colorbar(self.collection, ax=self.ax, shrink=0.6)
+            if colorbar
+            else None
+        )
+
+    def render(
+        self,
+        values: pd.Series,
+        path: os.PathLike | str | None = None,
+        title: str | None = None,
+        vmin: float | None = None,
+        vmax: float | None = None,
+    ) -> Any:
+        """Color areas according to ``values`` and optionally save the map.
+
+        :param values: a series with istat codes of ``level`` as index, missing areas are drawn in grey.
+        :type values: pd.Series
+        :param path: the path of the image to be written, if None the map is not saved, defaults to None.
+        :type path: os.PathLike | str | None, optional
+        :param title: the title of the map, defaults to None.
+        :type title: str | None, optional
+        :param vmin: the value of the lowest color, if None the minimum of ``values``, defaults to None.
+        :type vmin: float | None, optional
+        :param vmax: the value of the highest color, if None the maximum of ``values``, defaults to None.
+        :type vmax: float | None, optional
+
+        :return: the figure.
+        :rtype: matplotlib.figure.Figure
+        """
+        array = values.reindex(self.codes).astype(float).values
+        self.collection.set_array(np.ma.masked_invalid(array))
+        self.collection.set_clim(
+            np.nanmin(array) if vmin is None else vmin,
+            np.nanmax(array) if vmax is None else vmax,
+        )
+        if self.colorbar is not None:
+            self.colorbar.update_normal(self.collection)
+        self.ax.set_title(title or "")
+        if path is not None:
+            self.figure.savefig(path)
+        return self.figure
+
+
+def _init_worker(renderer_kwargs: dict):
+    global _worker_renderer
+    _worker_renderer = ChoroplethRenderer(**renderer_kwargs)
+
+
+def _render_worker(args: tuple) -> str:
+    values, path, title, vmin, vmax = args
+    _worker_renderer.render(values, path, title, vmin, vmax)
+    return path
+
+
+def render_choropleths(
+    df: pd.DataFrame,
+    output_directory: os.PathLike | str,
+    level: str = "province",
+    n_jobs: int = 1,
+    vmin: float | None = None,
+    vmax: float | None = None,
+    **renderer_kwargs,
+) -> List[str]:
+    """Render a choropleth map of every column of ``df`` into ``output_directory`` as ``<column>.png``.
+
+    Every process builds its :py:class:`ChoroplethRenderer` once and then renders a share of the
+    maps, so the cost of building paths and figures is paid once per process instead of once per
+    map.
+
+    .. code-block:: python
+       :linenos:
+
+       >>> df = gp.get_demographic_indicators("province")
+       >>> render_choropleths(df, "maps", level="province", n_jobs=4)
+       ['maps/population.png', 'maps/mean_age.png', ...]
+
+    :param df: a 2-dimensional dataframe with istat codes of ``level`` as index and indicators as columns.
+    :type df: pd.DataFrame
+    :param output_directory: the directory images are written in, it is created if it doesn't exist.
+    :type output_directory: os.PathLike | str
+    :param level: one of ``'municipality'``, ``'province'`` or ``'region'``, defaults to 'province'.
+    :type level: str, optional
+    :param n_jobs: the number of worker processes, defaults to 1.
+    :type n_jobs: int, optional
+    :param vmin: the value of the lowest color of every map, if None the minimum of every column, defaults to None.
+    :type vmin: float | None, optional
+    :param vmax: the value of the highest color of every map, if None the maximum of every column, defaults to None.
+    :type vmax: float | None, optional
+    :param renderer_kwargs: other arguments of :py:class:`ChoroplethRenderer` (e.g. ``data_year``,
+        ``crs``, ``simplify``, ``cmap``).
+
+    :return: paths of written images, in the order of ``df`` columns.
+    :rtype: List[str]
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    renderer_kwargs["level"] = level
+    tasks = [
+        (df[col], os.path.join(output_directory, f"{col}.png"), str(col), vmin, vmax)
+        for col in df.columns
+    ]
+    if n_jobs > 1:
+        with ProcessPoolExecutor(
+            n_jobs, initializer=_init_worker, initargs=(renderer_kwargs,)
+        ) as executor:
+            return list(executor.map(_render_worker, tasks))
+    renderer = ChoroplethRenderer(**renderer_kwargs)
+    for task in tasks:
+        renderer.render(*task)
+    return [task[1] for task in tasks]
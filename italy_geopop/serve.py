@@ -0,0 +1,522 @@
+"""A local HTTP service that resolves codes and names, reverse geocodes points and
+returns population, for programs that are not written in Python.
+
+.. code-block:: bash
+
+   $ python -m italy_geopop.serve --port 8000
+   $ curl "http://127.0.0.1:8000/resolve?value=MI&value=Milano"
+   {"results": [{"level": "province", "municipality_code": null, ...}, ...]}
+
+Endpoints answer ``GET`` requests with values in the query string (``value`` can be
+repeated) and ``POST`` requests with a JSON object in the body, results are in the same
+order of values:
+
+- ``/resolve``: ``value`` (or ``values``) and ``level`` (``'auto'``,
+  ``'municipality'``, ``'province'`` or ``'region'``), returns the level and istat
+  codes of every value, see
+  :py:meth:`italy_geopop.pandas_extension.ItalyGeopop.resolve`.
+- ``/population``: same as ``/resolve`` plus ``limits`` (``'total'``, ``'auto'`` or
+  comma separated ages, e.g. ``0,18,65``), returns population columns too.
+- ``/reverse``: ``lon`` and ``lat`` (or ``points``, a list of ``[lon, lat]``),
+  returns the municipality that contains every point, null if none does. It needs
+  geometry of municipalities (a ``geo_municipalities`` table or the topology of
+  municipalities, see :py:func:`italy_geopop.geopop.add_data_directory`), which is
+  not part of packaged data: without it the endpoint answers 503.
+- ``/metrics``: requests, errors, throughput, latency percentiles and batch sizes.
+- ``/health``: the year of data.
+
+Data and indices are loaded when the service starts and requests that arrive together
+are merged into batches, each answered by a single vectorized call, so that throughput
+grows with concurrency. The service uses only the standard library and data of the
+package, so it runs offline.
+"""
+
+import argparse
+import asyncio
+import copy
+from collections import defaultdict, deque
+from http import HTTPStatus
+import json
+import math
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from typing import Any, Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ._storage import has_table
+from .geopop import _normalize_level
+from ._topology import has_topology
+from .pandas_extension import ItalyGeopop
+
+_code_columns = ["municipality_code", "province_code", "region_code"]
+_endpoints = ["resolve", "population", "reverse", "metrics", "health"]
+
+
+def _to_json_value(value: Any) -> Any:
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def _records(df: pd.DataFrame) -> List[dict]:
+    return [
+        {column: _to_json_value(value) for column, value in record.items()}
+        for record in df.to_dict("records")
+    ]
+
+
+def _parse_limits(limits: str | list) -> str | list:
+    if isinstance(limits, list):
+        return [int(limit) for limit in limits]
+    limits = limits.strip().lower()
+    if limits in ("total", "auto"):
+        return limits
+    try:
+        return [int(limit) for limit in limits.split(",")]
+    except ValueError:
+        raise ValueError(
+            f'limits must be "total", "auto" or comma separated ages not "{limits}"'
+        )
+
+
+def _parse_body(body: bytes) -> dict:
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("body must be a JSON object")
+    if "value" in data:
+        # as in the query string, ``value`` holds one or more values
+        if "values" in data:
+            raise ValueError("only one of value and values is allowed")
+        value = data.pop("value")
+        data["values"] = value if isinstance(value, list) else [value]
+    return data
+
+
+class Unavailable(Exception):
+    """Raised when data needed by an endpoint are not available."""
+
+
+class Metrics:
+    """Counters and latencies of requests and sizes of batches, by endpoint."""
+
+    def __init__(self, window: int = 10000):
+        self.started = time.monotonic()
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        # latencies of the last ``window`` requests, in seconds
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.batches = defaultdict(int)
+        self.batched_items = defaultdict(int)
+        self.max_batch_size = defaultdict(int)
+
+    def record_request(self, endpoint: str, latency: float, error: bool):
+        self.requests[endpoint] += 1
+        self.errors[endpoint] += error
+        self.latencies[endpoint].append(latency)
+
+    def record_batch(self, endpoint: str, size: int):
+        self.batches[endpoint] += 1
+        self.batched_items[endpoint] += size
+        self.max_batch_size[endpoint] = max(self.max_batch_size[endpoint], size)
+
+    def snapshot(self) -> dict:
+        """Return metrics as a JSON-serializable dictionary."""
+        uptime = time.monotonic() - self.started
+        endpoints = {}
+        for endpoint, count in self.requests.items():
+            latencies = np.array(self.latencies[endpoint]) * 1000
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            endpoints[endpoint] = {
+                "requests": count,
+                "errors": self.errors[endpoint],
+                "throughput_rps": count / uptime,
+                "latency_ms": {
+                    "mean": float(latencies.mean()),
+                    "p50": float(p50),
+                    "p95": float(p95),
+                    "p99": float(p99),
+                    "max": float(latencies.max()),
+                },
+            }
+        for endpoint, count in self.batches.items():
+            endpoints.setdefault(endpoint, {})["batches"] = {
+                "count": count,
+                "items": self.batched_items[endpoint],
+                "mean_size": self.batched_items[endpoint] / count,
+                "max_size": self.max_batch_size[endpoint],
+            }
+        return {
+            "uptime_s": uptime,
+            "requests": sum(self.requests.values()),
+            "throughput_rps": sum(self.requests.values()) / uptime,
+            "endpoints": endpoints,
+        }
+
+
+class MicroBatcher:
+    """Merge items submitted concurrently into batches for ``fn``, a function that takes
+    a list of items and returns the list of their results.
+
+    A batch is run when ``max_batch_size`` items are waiting or ``max_delay`` seconds
+    after its first item. Batches run one at a time in a thread, so items that arrive
+    while a batch runs wait for it to end and form the next batch: the busier the
+    service, the larger the batches.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[list], list],
+        max_batch_size: int = 512,
+        max_delay: float = 0.001,
+        on_batch: Optional[Callable[[int], None]] = None,
+    ):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.on_batch = on_batch
+        self._pending = []
+        self._running = False
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Return the result of ``item``, once its batch has run."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None and not self._running:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running or not self._pending:
+            return
+        size = self.max_batch_size
+        batch, self._pending = self._pending[:size], self._pending[size:]
+        self._running = True
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        # keep a reference, the event loop only keeps weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, self.fn, [item for item, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._running = False
+            if self.on_batch is not None:
+                self.on_batch(len(batch))
+            self._flush()
+
+
+class Resolver:
+    """Vectorized resolution of batches of values and points, with data and indices
+    kept in memory.
+
+    :param data_year: the year of data, if None the latest available, defaults to None.
+    :type data_year: int | None, optional
+    """
+
+    def __init__(self, data_year: Optional[int] = None):
+        # built once, every batch uses a copy of it that shares its Geopop
+        self._accessor = ItalyGeopop(pd.Series(dtype=object), data_year=data_year)
+        self.geopop = self._accessor.geopop
+        self.data_year = self.geopop.data_year
+        # geometry of municipalities is not packaged, see ``/reverse``
+        self.can_reverse = has_table(
+            self.geopop._data_dir, self.data_year, "geo_municipalities"
+        ) or has_topology(self.geopop._data_dir, self.data_year, "municipality")
+
+    def warm_up(self):
+        """Load data and build indices of every endpoint."""
+        self.geopop.preload(population_limits=["auto", "total"]).result()
+        # a value of every kind, so that every code path has run once
+        self.resolve(["MI", "Milano", "F205", "015146", "Lombardia"])
+        self.resolve(["MI"], population_limits="auto")
+        if self.can_reverse:
+            self._get_tree()
+
+    def resolve(
+        self,
+        values: list,
+        level: str = "auto",
+        population_limits: str | list | None = None,
+    ) -> List[dict]:
+        """Resolve ``values`` into their level and istat codes and, if
+        ``population_limits`` is not None, population.
+
+        :raises ValueError: if ``level`` or ``population_limits`` are not valid.
+        """
+        accessor = copy.copy(self._accessor)
+        accessor._obj = pd.Series(values, dtype=object)
+        df = accessor.resolve(
+            level=level,
+            population_limits=(
+                "total" if population_limits is None else population_limits
+            ),
+        )
+        if population_limits is None:
+            df = df[["level"] + _code_columns]
+        return _records(df)
+
+    def _get_tree(self):
+        if not hasattr(self, "_tree"):
+            geometry = self.geopop.italy_municipalities_geometry.geometry
+            municipalities = self.geopop.italy_municipalities.reindex(geometry.index)
+            self._tree_rows = [
+                {"municipality_code": code, **row}
+                for code, row in zip(
+                    geometry.index.tolist(),
+                    _records(
+                        municipalities[
+                            [
+                                "municipality",
+                                "province_code",
+                                "province",
+                                "region_code",
+                                "region",
+                            ]
+                        ]
+                    ),
+                )
+            ]
+            self._tree = shapely.STRtree(geometry.values)
+        return self._tree
+
+    def reverse(self, points: list) -> List[Optional[dict]]:
+        """Return the municipality that contains every point given as ``(lon, lat)``,
+        None if no municipality does.
+
+        :raises Unavailable: if geometry of municipalities is not available.
+        """
+        if not self.can_reverse:
+            raise Unavailable(
+                f"geometry of municipalities of {self.data_year} is not available, "
+                "add a data directory that has it to reverse geocode points"
+            )
+        tree = self._get_tree()
+        lonlat = np.asarray(points, dtype=float).reshape(-1, 2)
+        point_positions, tree_positions = tree.query(
+            shapely.points(lonlat), predicate="intersects"
+        )
+        ret = [None] * len(lonlat)
+        # points on a border belong to the first municipality found
+        for point_position, tree_position in zip(
+            point_positions[::-1].tolist(), tree_positions[::-1].tolist()
+        ):
+            ret[point_position] = self._tree_rows[tree_position]
+        return ret
+
+
+class Server:
+    """The HTTP service, see the documentation of the module.
+
+    :param resolver: the resolver of requests.
+    :type resolver: Resolver
+    :param max_batch_size: the largest number of values resolved by a single call,
+        defaults to 512.
+    :type max_batch_size: int, optional
+    :param max_delay: seconds a value waits for other values before its batch runs,
+        defaults to 0.001.
+    :type max_delay: float, optional
+    """
+
+    def __init__(
+        self, resolver: Resolver, max_batch_size: int = 512, max_delay: float = 0.001
+    ):
+        self.resolver = resolver
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.metrics = Metrics()
+        self._batchers = {}
+
+    def _get_batcher(self, endpoint: str, *options) -> MicroBatcher:
+        # values are batched together only if they share endpoint and options
+        key = (endpoint, *options)
+        if key not in self._batchers:
+            if endpoint == "reverse":
+                fn = self.resolver.reverse
+            else:
+
+                def fn(values, options=options):
+                    return self.resolver.resolve(values, *options)
+
+            self._batchers[key] = MicroBatcher(
+                fn,
+                self.max_batch_size,
+                self.max_delay,
+                lambda size: self.metrics.record_batch(endpoint, size),
+            )
+        return self._batchers[key]
+
+    async def _answer(self, endpoint: str, params: dict) -> Any:
+        if endpoint == "health":
+            return {"status": "ok", "data_year": self.resolver.data_year}
+        if endpoint == "metrics":
+            return self.metrics.snapshot()
+        if endpoint == "reverse":
+            items = [(float(lon), float(lat)) for lon, lat in params["points"]]
+            batcher = self._get_batcher("reverse")
+        else:
+            items = params["values"]
+            if not isinstance(items, list) or not all(
+                item is None or isinstance(item, (str, int, float)) for item in items
+            ):
+                raise ValueError("values must be a list of strings or numbers")
+            level = _normalize_level(str(params.get("level", "auto")), allow_auto=True)
+            limits = None
+            if endpoint == "population":
+                limits = _parse_limits(params.get("limits", "total"))
+            batcher = self._get_batcher(
+                endpoint, level, tuple(limits) if isinstance(limits, list) else limits
+            )
+        results = await asyncio.gather(*(batcher.submit(item) for item in items))
+        return {"results": list(results)}
+
+    async def handle(self, method: str, target: str, body: bytes = b"") -> tuple:
+        """Answer a request.
+
+        :return: the HTTP status and the JSON-serializable payload.
+        :rtype: tuple[int, Any]
+        """
+        started = time.perf_counter()
+        url = urlsplit(target)
+        endpoint = url.path.strip("/")
+        query = parse_qs(url.query)
+        # repeated parameters are lists, other parameters are scalars
+        params = {name: values[-1] for name, values in query.items()}
+        params["values"] = query.get("value", [])
+        params["points"] = list(zip(query.get("lon", []), query.get("lat", [])))
+        try:
+            if endpoint not in _endpoints:
+                status, payload = 404, {"error": f"no endpoint /{endpoint}"}
+            elif method not in ("GET", "POST"):
+                status, payload = 405, {"error": f"method {method} not allowed"}
+            else:
+                if method == "POST" and body:
+                    params.update(_parse_body(body))
+                status, payload = 200, await self._answer(endpoint, params)
+        except (ValueError, TypeError) as e:
+            status, payload = 400, {"error": str(e)}
+        except Unavailable as e:
+            status, payload = 503, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        if endpoint in _endpoints and endpoint not in ("health", "metrics"):
+            self.metrics.record_request(
+                endpoint, time.perf_counter() - started, status != 200
+            )
+        return status, payload
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            # connections are kept alive as HTTP/1.1 requires by default
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    body = await reader.readexactly(
+                        int(headers.get("content-length", 0))
+                    )
+                except ValueError:
+                    status, payload = 400, {"error": "malformed request"}
+                    version, headers = "HTTP/1.0", {}
+                else:
+                    status, payload = await self.handle(method, target, body)
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                data = json.dumps(payload).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000):
+        """Start listening, return the ``asyncio`` server."""
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m italy_geopop.serve",
+        description=" ".join(__doc__.split("\n\n")[0].split()),
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--data-year", type=int, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=512)
+    parser.add_argument(
+        "--max-delay-ms",
+        type=float,
+        default=1.0,
+        help="milliseconds a value waits for other values before its batch runs",
+    )
+    args = parser.parse_args(argv)
+
+    resolver = Resolver(args.data_year)
+    resolver.warm_up()
+    server = Server(resolver, args.max_batch_size, args.max_delay_ms / 1000)
+
+    async def serve():
+        async with await server.start(args.host, args.port) as asyncio_server:
+            print(
+                f"Serving data of {resolver.data_year} on http://{args.host}:{args.port}"
+            )
+            await asyncio_server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,33 @@
+import asyncio
 import geopandas as gpd
+import numpy as np
+import os
 import pandas as pd
 import pytest
+import shutil
+import shapely
+import subprocess
+import sys
+import threading
+import time
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from shapely.geometry import Polygon
 
 from helper import get_info_per_year
 
+from italy_geopop import geopop
+from italy_geopop._adjacency import Adjacency
+from italy_geopop._shared import data_fingerprint
+from italy_geopop._utils import (
+    KeyedLocks,
+    build_municipality_crosswalk,
+    cache,
+    compute_age_quantiles,
+    compute_rates,
+    share_unchanged_geometries,
+)
 from italy_geopop.geopop import Geopop
 
 _municipality_columns = [
@@ -17,18 +40,28 @@ _municipality_columns = [
     "region_code",
 ]
 
+_geo_stats_columns = [
+    "area_km2",
+    "min_lon",
+    "min_lat",
+    "max_lon",
+    "max_lat",
+    "centroid_lon",
+    "centroid_lat",
+]
+
 _province_columns = [
     "region",
     "region_code",
     "province",
     "province_short",
     "municipalities",
-]
+] + _geo_stats_columns
 
 _region_columns = [
     "region",
     "provinces",
-]
+] + _geo_stats_columns
 
 _auto_population_limits_columns = [
     "<3_F",
@@ -255,3 +288,640 @@ def test_if_population_data_is_missing(gp):
 )
 def test_population_data_is_correct(gp, data_year):
     assert gp.population_df.tot.sum() == get_info_per_year(data_year, "population")
+
+
+@pytest.mark.parametrize("level", ["municipality", "province", "region"])
+def test_compose_df_with_years_returns_panel(gp, level):
+    panel_df = gp.compose_df(level=level, population_limits="total", years=[2022, 2023])
+    assert panel_df.columns[0] == "year"
+    for data_year in [2022, 2023]:
+        expected = Geopop(data_year=data_year).compose_df(
+            level=level, population_limits="total"
+        )
+        year_df = panel_df[panel_df.year == data_year]
+        assert len(year_df) == len(expected)
+        assert year_df.population.sum() == expected.population.sum()
+
+
+@pytest.mark.parametrize("level", ["province", "region"])
+def test_compose_df_with_years_shares_unchanged_geometries(gp, level):
+    panel_df = gp.compose_df(
+        level=level, include_geometry=True, years=[2022, 2023]
+    ).set_index(["year", f"{level}_code"])
+    for data_year in [2022, 2023]:
+        expected = Geopop(data_year=data_year).compose_df(
+            level=level, include_geometry=True
+        )
+        year_df = panel_df.loc[data_year]
+        assert list(year_df.columns) == list(expected.columns.drop(f"{level}_code"))
+        # every year keeps its own coordinates
+        expected = expected.set_index(f"{level}_code").geometry.reindex(year_df.index)
+        assert (
+            shapely.to_wkb(year_df.geometry.values) == shapely.to_wkb(expected.values)
+        ).all()
+    geometry_2022 = panel_df.loc[2022].geometry
+    geometry_2023 = panel_df.loc[2023].geometry
+    for code in geometry_2022.index.intersection(geometry_2023.index):
+        if geometry_2022[code].equals_exact(geometry_2023[code], tolerance=0):
+            assert geometry_2022[code] is geometry_2023[code]
+        else:
+            assert geometry_2022[code] is not geometry_2023[code]
+
+
+def test_share_unchanged_geometries_compares_exactly():
+    square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    # same shape, vertices in another order
+    rotated = Polygon([(1, 0), (1, 1), (0, 1), (0, 0)])
+    geometries = share_unchanged_geometries(
+        [
+            gpd.GeoSeries([square, square], index=[1, 2]),
+            gpd.GeoSeries([Polygon(square.exterior), rotated], index=[1, 2]),
+        ]
+    )
+    assert geometries[1][1] is geometries[0][1]
+    assert geometries[1][2] is not geometries[0][2]
+    assert geometries[1][2].equals_exact(rotated, tolerance=0)
+
+
+def test_compose_df_with_years_raises_if_year_is_not_available(gp):
+    with pytest.raises(ValueError):
+        gp.compose_df(level="region", years=[2022, 1900])
+
+
+def test_municipality_crosswalk_maps_changed_codes_and_names():
+    current_df = pd.DataFrame(
+        {"municipality": ["Agliè", "Airasca"], "cadastral_code": ["A074", "A109"]},
+        index=pd.Index([1001, 1002], name="municipality_code"),
+    )
+    previous_df = pd.DataFrame(
+        {
+            "municipality": ["Aglie", "Airasca", "Gone"],
+            "cadastral_code": ["A074", "Z999", "Z998"],
+        },
+        index=pd.Index([999, 1002, 1003], name="municipality_code"),
+    )
+    crosswalk_df = build_municipality_crosswalk(
+        {2021: previous_df},
+        current_df,
+        pd.Series([10, 30], index=[1001, 1002]),
+        variations=pd.DataFrame(
+            {"municipality_code": [1003, 1003], "successor_code": [1001, 1002]}
+        ),
+    )
+    assert crosswalk_df.loc["999"].municipality_code == 1001
+    assert crosswalk_df.loc["aglie"].municipality_code == 1001
+    assert crosswalk_df.loc["z999"].municipality_code == 1002
+    assert crosswalk_df.loc["gone"].weight.to_list() == [0.25, 0.75]
+    assert "airasca" not in crosswalk_df.index
+
+
+def test_municipality_crosswalk_excludes_current_municipalities():
+    crosswalk_df = Geopop(data_year=2023).get_municipality_crosswalk(
+        variations=pd.DataFrame({"municipality_code": [5079], "successor_code": [5005]})
+    )
+    assert crosswalk_df.loc["5079"].municipality_code == 5005
+    assert crosswalk_df.loc["moransengo"].municipality_code == 5005
+    assert not crosswalk_df.index.isin(["5005", "1001", "agliè"]).any()
+
+
+def test_aggregate_matches_built_in_hierarchy(gp):
+    aggregated = gp.aggregate(
+        {"province": "province", "region": "region"}, population_limits="auto"
+    )
+    for level in ["province", "region"]:
+        expected = getattr(gp, f"get_italian_population_for_{level}s")()
+        assert (
+            aggregated[level].loc[expected.index, expected.columns].values
+            == expected.values
+        ).all()
+
+
+def test_aggregate_applies_weights_and_ignores_missing_data(gp):
+    grouping = pd.DataFrame(
+        {
+            "municipality_code": [1001, 1001, 1002],
+            "group": ["a", "b", "b"],
+            "weight": [0.25, 0.75, 1],
+        }
+    )
+    data = pd.DataFrame({"visits": [4, 10, None]}, index=[1001, 1002, 1003])
+    aggregated = gp.aggregate({"custom": grouping}, data=data, population_limits=None)[
+        "custom"
+    ]
+    assert aggregated.columns.to_list() == ["visits"]
+    assert aggregated.visits.to_dict() == {"a": 1, "b": 13}
+
+
+def test_get_rates_standardizes_on_population_groups(gp):
+    pop_df = gp.get_italian_population_for_regions([50])
+    numerators = pd.DataFrame(
+        {("deaths", "<50"): [10, 3], ("deaths", ">=50"): [120, 40]}, index=[1, 2]
+    )
+    rates = gp.get_rates(numerators, level="region", population_limits=[50], per=1)
+    weights = pop_df[["<50", ">=50"]].sum() / pop_df[["<50", ">=50"]].sum().sum()
+    expected = (
+        10 / pop_df.loc[1, "<50"] * weights["<50"]
+        + 120 / pop_df.loc[1, ">=50"] * weights[">=50"]
+    )
+    assert rates.loc[1, ("deaths", "standardized_rate")] == pytest.approx(expected)
+    assert rates.loc[1, ("deaths", "crude_rate")] == pytest.approx(
+        130 / pop_df.loc[1, ["<50", ">=50"]].sum()
+    )
+    row = rates.loc[2, "deaths"]
+    assert row.crude_rate_lower < row.crude_rate < row.crude_rate_upper
+    assert (
+        row.standardized_rate_lower
+        < row.standardized_rate
+        < row.standardized_rate_upper
+    )
+
+
+def test_get_rates_are_nan_without_population(gp):
+    numerators = pd.DataFrame(
+        {("deaths", "<50"): [10, 3], ("deaths", ">=50"): [120, 40]}, index=[1, 999]
+    )
+    rates = gp.get_rates(numerators, level="region", population_limits=[50])
+    assert rates.loc[999, "deaths"].isna().all()
+    assert rates.loc[1, "deaths"].notna().all()
+    # a group without population makes the standardized rate unknown
+    rates = compute_rates([[[5, 5]]], [[100, 0]], [1, 1])
+    assert rates["crude_rate"][0, 0] == 0.1
+    assert np.isnan(rates["standardized_rate"][0, 0])
+    assert np.isnan(rates["standardized_rate_lower"][0, 0])
+
+
+def test_get_rates_raises_if_age_group_is_unknown(gp):
+    with pytest.raises(ValueError):
+        gp.get_rates(pd.DataFrame({("deaths", "<40"): [1]}, index=[1]))
+
+
+def test_compute_age_quantiles_interpolates_inside_ages():
+    quantiles = compute_age_quantiles([[10, 10, 0, 20], [0, 0, 0, 0]], [0.25, 0.5])
+    assert quantiles[0].tolist() == [1, 2]
+    assert np.isnan(quantiles[1]).all()
+
+
+@pytest.mark.parametrize("level", ["municipality", "province", "region"])
+def test_demographic_indicators_are_coherent_with_population(gp, level):
+    indicators = gp.get_demographic_indicators(level)
+    pop_df = getattr(
+        gp,
+        (
+            "get_italian_population_for_municipalites"
+            if level == "municipality"
+            else f"get_italian_population_for_{level}s"
+        ),
+    )([15, 65])
+    assert indicators.index.equals(pop_df.index)
+    assert (indicators.population == pop_df.sum(axis=1) / 2).all()
+    assert np.allclose(
+        indicators.old_age_index,
+        pop_df[">=65"] / pop_df["<15"] * 100,
+        equal_nan=True,
+    )
+    assert (indicators.age_q25 <= indicators.median_age).all()
+    assert (indicators.median_age <= indicators.age_q75).all()
+    assert gp.get_demographic_indicators(level) is indicators
+
+
+@pytest.mark.parametrize("level", ["province", "region"])
+def test_neighbors_are_shipped_and_match_geometries(gp, level):
+    adjacency = gp.neighbors(level)
+    geometry = getattr(gp, f"italy_{level}s_geometry").geometry
+    computed = Adjacency.from_geometry(geometry)
+    assert adjacency.codes.equals(computed.codes)
+    assert (adjacency.indptr == computed.indptr).all()
+    assert (adjacency.indices == computed.indices).all()
+    assert gp.neighbors(level) is adjacency
+
+
+def test_neighbors_queries(gp):
+    adjacency = gp.neighbors("province")
+    matrix = adjacency.to_sparse()
+    assert (matrix != matrix.T).nnz == 0
+    assert adjacency[1].to_list() == [2, 4, 5, 6, 7, 96]
+    edges = adjacency.to_frame([1, 2])
+    assert edges.code.value_counts().to_dict() == {1: 6, 2: 7}
+    assert (edges.border_length > 0).all()
+    assert gp.neighbors("province", "rook").cardinalities().sum() <= len(
+        adjacency.indices
+    )
+    with pytest.raises(KeyError):
+        adjacency.to_frame([0])
+    with pytest.raises(ValueError):
+        gp.neighbors("province", "bishop")
+
+
+def test_smooth_rates_shrink_towards_the_mean(gp):
+    pop = gp.get_italian_population_for_provinces("total").population
+    cases = (pop * 0.01).round()
+    cases.iloc[:5] = 0
+    crude = cases / pop
+    for method in ["empirical_bayes", "local_empirical_bayes", "neighborhood"]:
+        smoothed = gp.smooth_rates(cases, level="province", method=method)
+        assert isinstance(smoothed, pd.Series)
+        assert smoothed.index.equals(gp.neighbors("province").codes)
+        assert smoothed.std() < crude.std()
+        assert smoothed.min() >= crude.min() and smoothed.max() <= crude.max()
+    with pytest.raises(ValueError):
+        gp.smooth_rates(cases, level="province", method="median")
+    # level is normalized like in every other method
+    assert gp.smooth_rates(cases, level=" Province ").equals(
+        gp.smooth_rates(cases, level="province")
+    )
+    with pytest.raises(ValueError):
+        gp.smooth_rates(cases, level="country")
+
+
+def test_morans_i_matches_dense_computation(gp):
+    values = gp.get_demographic_indicators("province")[["median_age", "sex_ratio"]]
+    adjacency = gp.neighbors("province")
+    weights = adjacency.to_sparse("row").toarray()
+    deviations = values.reindex(adjacency.codes) - values.mean()
+    expected = [
+        len(deviations) / weights.sum() * (z @ weights @ z) / (z @ z)
+        for z in deviations.T.values
+    ]
+    global_df = gp.morans_i(values, level="province")
+    assert np.allclose(global_df.I, expected)
+    local_df = gp.morans_i(values, level="province", local=True)
+    assert np.allclose(local_df.sum() / weights.sum(), expected)
+
+
+def test_weighted_centroids_are_inside_the_area(gp):
+    centroids_df = gp.get_centroids("region", weighted=True)
+    geometry = gp.italy_regions_geometry.geometry.reindex(centroids_df.index)
+    points = gpd.GeoSeries(
+        gpd.points_from_xy(centroids_df.lon, centroids_df.lat),
+        index=centroids_df.index,
+        crs=geometry.crs,
+    )
+    assert geometry.contains(points).mean() > 0.8
+
+
+def test_assign_nearest_matches_brute_force(gp):
+    facilities = pd.DataFrame(
+        {
+            "lon": [7.68, 9.19, 12.5, 14.25, 13.36],
+            "lat": [45.07, 45.46, 41.9, 40.85, 38.12],
+        },
+        index=["Torino", "Milano", "Roma", "Napoli", "Palermo"],
+    )
+    assignment_df, served_df = gp.assign_nearest(
+        facilities, k=2, level="province", population_limits="total"
+    )
+    centroids_df = gp.get_centroids("province", weighted=True)
+    lon, lat = np.radians(centroids_df.lon.values), np.radians(centroids_df.lat.values)
+    f_lon, f_lat = np.radians(facilities.lon.values), np.radians(facilities.lat.values)
+    haversine = (
+        np.sin((f_lat - lat[:, None]) / 2) ** 2
+        + np.cos(lat[:, None]) * np.cos(f_lat) * np.sin((f_lon - lon[:, None]) / 2) ** 2
+    )
+    distances = 2 * 6371.0088 * np.arcsin(np.sqrt(haversine))
+    nearest = assignment_df[assignment_df["rank"] == 1]
+    assert (nearest.facility.values == facilities.index[distances.argmin(axis=1)]).all()
+    assert np.allclose(nearest.distance_km, distances.min(axis=1))
+    assert len(assignment_df) == 2 * len(centroids_df)
+    assert (
+        served_df.population.sum()
+        == gp.get_italian_population_for_provinces("total").population.sum()
+    )
+
+
+def test_accessibility_preserves_supply(gp):
+    facilities = pd.DataFrame(
+        {
+            "lon": [7.68, 9.19, 12.5, 14.25, 13.36],
+            "lat": [45.07, 45.46, 41.9, 40.85, 38.12],
+            "beds": [100, 200, 300, 400, 500],
+            "doctors": [10, 20, 30, 40, 50],
+        }
+    )
+    accessibility_df = gp.accessibility(
+        facilities, radius_km=150, decay=["uniform", "gaussian"], level="province"
+    )
+    population = gp.get_italian_population_for_provinces("total").population
+    for decay in ["uniform", "gaussian"]:
+        served = accessibility_df[decay].mul(population, axis=0).sum()
+        assert np.allclose(served, facilities[["beds", "doctors"]].sum())
+    assert (accessibility_df.loc[[1, 15], ("uniform", "beds")] > 0).all()
+    with pytest.raises(ValueError):
+        gp.accessibility(facilities, radius_km=150, decay="cubic", level="province")
+    assert gp.accessibility(facilities, radius_km=150, level="Region").equals(
+        gp.accessibility(facilities, radius_km=150, level="region")
+    )
+    with pytest.raises(ValueError):
+        gp.accessibility(facilities, radius_km=150, level="country")
+
+
+def test_interpolate_population_into_polygons(gp):
+    geometry = gp.italy_provinces_geometry.geometry
+    targets = gpd.GeoDataFrame(
+        {"name": ["whole", "torino", "half_torino"]},
+        geometry=[
+            geometry.union_all(),
+            geometry[1],
+            geometry[1].intersection(geometry[1].envelope.centroid.buffer(0.3)),
+        ],
+        crs=geometry.crs,
+    ).set_index("name")
+    interpolated = gp.interpolate_population(
+        targets, level="province", population_limits="total", batch_size=2
+    )
+    population = gp.get_italian_population_for_provinces("total").population
+    assert interpolated.loc["whole", "population"] == pytest.approx(population.sum())
+    assert interpolated.loc["torino", "population"] == pytest.approx(
+        population[1], rel=1e-3
+    )
+    assert 0 < interpolated.loc["half_torino", "population"] < population[1]
+    parallel = gp.interpolate_population(
+        targets, level="province", population_limits="total", n_jobs=2
+    )
+    assert np.allclose(parallel, interpolated)
+
+
+@pytest.mark.parametrize("level", ["province", "region"])
+def test_geo_stats_match_geometry(gp, level):
+    data_df = getattr(gp, f"italy_{level}s")
+    geometry = getattr(gp, f"italy_{level}s_geometry").geometry
+    bounds = geometry.bounds.reindex(data_df.index)
+    assert np.allclose(data_df.min_lon, bounds.minx)
+    assert np.allclose(data_df.max_lat, bounds.maxy)
+    assert np.allclose(
+        data_df.area_km2, geometry.to_crs(32632).area.reindex(data_df.index) / 1e6
+    )
+    composed = gp.compose_df(level, population_limits="total").set_index(
+        f"{level}_code"
+    )
+    assert np.allclose(composed.density, composed.population / composed.area_km2)
+
+
+def test_geo_stats_are_read_without_geopandas():
+    code = (
+        "import sys; from italy_geopop.geopop import Geopop; "
+        "Geopop(data_year=2022).italy_provinces.area_km2; "
+        "sys.exit('geopandas' in sys.modules)"
+    )
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+def test_get_geometry_reprojects(gp):
+    geometry = gp.get_geometry("region", crs="EPSG:32632")
+    assert geometry.crs.to_epsg() == 32632
+    assert geometry.index.equals(gp.italy_regions_geometry.index)
+    # always a copy, cached data can't be altered
+    original = gp.get_geometry("region")
+    assert original is not gp.italy_regions_geometry
+    pd.testing.assert_frame_equal(original, gp.italy_regions_geometry)
+    composed = gp.compose_df("region", include_geometry=True, crs=32632)
+    assert composed.geometry.iloc[0].bounds[0] > 1000
+    with pytest.raises(ValueError):
+        gp.get_geometry("country")
+
+
+def test_get_geometry_caches_reprojection_without_files(gp, monkeypatch):
+    monkeypatch.setattr(geopop, "has_table", lambda *args: False)
+    # geometry tables are not found in the data directory, reproject loaded geometry
+    monkeypatch.setattr(gp, "_reprojected_geometries", OrderedDict(), raising=False)
+    first = gp.get_geometry("region", crs="EPSG:32632")
+    second = gp.get_geometry("region", crs=32632)
+    assert first.crs.to_epsg() == 32632
+    assert first is not second
+    pd.testing.assert_frame_equal(first, second)
+    assert list(gp._reprojected_geometries) == [("region", "EPSG:32632")]
+    first.drop(first.index, inplace=True)
+    assert len(gp.get_geometry("region", crs=32632)) == len(second)
+
+
+def test_region_scoped_geopop_loads_only_selected_regions(gp):
+    scoped = Geopop(gp.data_year, regions=["lombardia", 5])
+    assert scoped.regions == (3, 5)
+    assert repr(scoped) == f"Geopop(data_year={gp.data_year}, regions=(3, 5))"
+    expected = gp.italy_municipalities[gp.italy_municipalities.region_code.isin([3, 5])]
+    assert scoped.italy_municipalities.equals(expected)
+    assert scoped.italy_provinces.index.equals(
+        gp.italy_provinces.index[gp.italy_provinces.region_code.isin([3, 5])]
+    )
+    assert scoped.italy_regions.index.to_list() == [3, 5]
+    assert set(scoped.population_df.index) == set(expected.index)
+    assert set(scoped.italy_provinces_geometry.index) == set(
+        scoped.italy_provinces.index
+    )
+    pd.testing.assert_frame_equal(
+        scoped.compose_df("province"),
+        gp.compose_df("province").query("region_code in [3, 5]").reset_index(drop=True),
+    )
+    adjacency = scoped.neighbors("region")
+    assert adjacency.to_frame().code.to_list() == [3, 5]
+    assert adjacency.to_frame().neighbor_code.to_list() == [5, 3]
+    with pytest.raises(ValueError):
+        Geopop(gp.data_year, regions=["Atlantide"])
+
+
+def test_adjacency_subset_drops_links_to_other_areas(gp):
+    adjacency = gp.neighbors("province")
+    subset = adjacency.subset([1, 2, 3])
+    assert subset.codes.to_list() == [1, 2, 3]
+    expected = adjacency.to_frame([1, 2, 3]).query("neighbor_code in [1, 2, 3]")
+    assert (
+        subset.to_frame().reset_index(drop=True).equals(expected.reset_index(drop=True))
+    )
+    with pytest.raises(KeyError):
+        adjacency.subset([1, -1])
+
+
+def test_concurrent_first_access_loads_once(monkeypatch):
+    calls = []
+    read_table = geopop.read_table
+
+    def slow_read_table(data_directory, data_year, table, filters=None):
+        calls.append(table)
+        time.sleep(0.05)
+        return read_table(data_directory, data_year, table, filters)
+
+    monkeypatch.setattr(geopop, "read_table", slow_read_table)
+    gp = Geopop(2022)
+    barrier = threading.Barrier(8)
+
+    def access(_):
+        barrier.wait()
+        return gp.italy_municipalities
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(access, range(8)))
+    assert calls == ["municipalities"]
+    assert all(result is results[0] for result in results)
+
+
+def test_cache_is_not_shared_with_overridden_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(geopop, "_user_data_dirs", [])
+    lookup_table = Geopop(2022).get_lookup_table("region")
+    for table in ["municipalities", "pop", "provinces"]:
+        shutil.copy(geopop._data_abs_dir + f"/2022_italy_{table}.feather", tmp_path)
+    regions_df = pd.read_feather(geopop._data_abs_dir + "/2022_italy_regions.feather")
+    regions_df.loc[regions_df.region_code == 3, "region"] = "Lombardy"
+    regions_df.to_feather(tmp_path / "2022_italy_regions.feather")
+    geopop.add_data_directory(tmp_path)
+    with pytest.warns(UserWarning):
+        gp = Geopop(2022)
+    overridden = gp.get_lookup_table("region")
+    assert overridden is not lookup_table
+    assert "lombardy" in overridden.index
+    assert "lombardy" not in lookup_table.index
+
+
+def test_cache_computes_once_per_key():
+    calls = []
+
+    class Cached:
+        def __repr__(self):
+            return "Cached()"
+
+        @cache
+        def value(self, key):
+            calls.append(key)
+            time.sleep(0.05)
+            return [key]
+
+    obj = Cached()
+    barrier = threading.Barrier(8)
+
+    def access(i):
+        barrier.wait()
+        return obj.value(i % 2)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(access, range(8)))
+    assert sorted(calls) == [0, 1]
+    assert all(result is results[i % 2] for i, result in enumerate(results))
+
+
+def test_preload_warms_up_data(monkeypatch):
+    gp = Geopop(2022)
+    future = gp.preload(
+        ["provinces", "population", "lookup"],
+        population_limits=["total", [18, 65]],
+        include_geometry=True,
+    )
+    assert future.result(timeout=60) is gp
+
+    def read_table(*args, **kwargs):
+        raise AssertionError("data read after preload")
+
+    monkeypatch.setattr(geopop, "read_table", read_table)
+    assert "province" in gp.italy_provinces.columns
+    assert "geometry" in gp.italy_provinces_geometry.columns
+    assert gp.get_italian_population_for_provinces("total") is (
+        gp.get_italian_population_for_provinces(population_limits="total")
+    )
+    gp.get_italian_population_for_municipalites([18, 65])
+    gp.get_lookup_table("province")
+
+    with pytest.raises(ValueError):
+        gp.preload(["provinces", "streets"])
+
+
+def test_preload_derived_datasets_only(monkeypatch, isolated_caches):
+    gp = Geopop(2022)
+    assert gp.preload(["lookup"]).result(timeout=60) is gp
+    assert {"_italy_municipalities", "_italy_provinces", "_italy_regions"} <= set(
+        gp.__dict__
+    )
+    assert len(Geopop.get_lookup_table.cache) == 3
+
+    def read_table(*args, **kwargs):
+        raise AssertionError("data read after preload")
+
+    monkeypatch.setattr(geopop, "read_table", read_table)
+    for level in ["municipality", "province", "region"]:
+        gp.get_lookup_table(level)
+
+
+def test_apreload():
+    async def main():
+        gp = Geopop(2022)
+        return gp, await gp.apreload(["regions"])
+
+    gp, result = asyncio.run(main())
+    assert result is gp
+    assert "_italy_regions" in gp.__dict__
+
+
+@pytest.fixture
+def isolated_caches(monkeypatch):
+    # shared dataframes would otherwise stay in caches of other tests
+    for method in geopop._shared_methods:
+        monkeypatch.setattr(getattr(Geopop, method), "cache", {})
+
+
+def test_share_moves_data_into_mapped_files(tmp_path, monkeypatch, isolated_caches):
+    gp = Geopop(2022)
+    provinces = gp.italy_provinces
+    lookup_table = gp.get_lookup_table("province")
+    population = gp.get_italian_population_for_provinces("total")
+    assert gp.share(tmp_path) is gp
+    # provinces, municipalities, population, population of municipalities and
+    # provinces, lookup table
+    assert len(list(tmp_path.glob("**/*.arrow"))) == 6
+    pd.testing.assert_frame_equal(gp.italy_provinces, provinces)
+    pd.testing.assert_frame_equal(gp.get_lookup_table("province"), lookup_table)
+    shared_population = gp.get_italian_population_for_provinces("total")
+    pd.testing.assert_frame_equal(shared_population, population)
+    assert not shared_population.population.to_numpy().flags.writeable
+
+    def read_table(*args, **kwargs):
+        raise AssertionError("data read instead of attached")
+
+    monkeypatch.setattr(geopop, "read_table", read_table)
+    for method in geopop._shared_methods:
+        getattr(Geopop, method).cache.clear()
+    other = Geopop(2022).share(tmp_path)
+    pd.testing.assert_frame_equal(other.italy_provinces, provinces)
+    pd.testing.assert_frame_equal(other.get_lookup_table("province"), lookup_table)
+    # tables shared from other data are not attached
+    monkeypatch.setattr(geopop, "data_fingerprint", lambda *args: "other")
+    assert "_italy_provinces" not in Geopop(2022).share(tmp_path).__dict__
+
+
+@pytest.mark.parametrize("level", ["municipality", "province", "region"])
+def test_share_keeps_compose_df_identical(tmp_path, isolated_caches, level):
+    gp = Geopop(2022)
+    expected = gp.compose_df(level, population_limits="total")
+    gp.share(tmp_path)
+    composed = gp.compose_df(level, population_limits="total")
+    assert composed.dtypes.equals(expected.dtypes)
+    pd.testing.assert_frame_equal(composed, expected)
+    if level == "province":
+        assert type(composed.municipalities.iloc[0]) is type(
+            expected.municipalities.iloc[0]
+        )
+
+
+def test_data_fingerprint_changes_with_data(tmp_path):
+    (tmp_path / "2022_italy_regions.feather").write_bytes(b"data")
+    fingerprint = data_fingerprint(tmp_path, "1.0")
+    assert data_fingerprint(tmp_path, "1.0") == fingerprint
+    assert data_fingerprint(tmp_path, "1.1") != fingerprint
+    os.utime(tmp_path / "2022_italy_regions.feather", ns=(0, 0))
+    assert data_fingerprint(tmp_path, "1.0") != fingerprint
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_keyed_locks_are_reset_in_forked_processes():
+    locks = KeyedLocks()
+    acquired, release = threading.Event(), threading.Event()
+
+    def hold():
+        with locks("key"):
+            acquired.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    acquired.wait()
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if locks("key").acquire(timeout=1) else 1)
+    release.set()
+    thread.join()
+    assert os.waitpid(pid, 0)[1] == 0
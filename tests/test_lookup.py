@@ -0,0 +1,47 @@
+import pytest
+
+from italy_geopop import lookup
+from italy_geopop.geopop import Geopop
+
+
+@pytest.mark.parametrize("data_year", [2022, 2023])
+def test_lookup_matches_compose_df(data_year):
+    df = Geopop(data_year).compose_df(level="province", population_limits="total")
+    expected = df.set_index("province_code").loc[15]
+    for value in [15, "15", "015", 15.0, "MI", " mi ", "Milano", "MILANO"]:
+        row = lookup.province(value, data_year)
+        assert row["province_code"] == 15
+        assert row["province"] == expected.province
+        assert row["population"] == expected.population
+
+
+def test_lookup_levels():
+    municipality = lookup.municipality("F205", 2022)
+    assert municipality["municipality"] == "Milano"
+    assert lookup.municipality(municipality["municipality_code"], 2022) == municipality
+    region = lookup.region("lombardia", 2022)
+    assert region["region_code"] == municipality["region_code"]
+    assert lookup.region(region["region_code"], 2022) == region
+
+
+def test_lookup_returns_python_objects():
+    row = lookup.province("MI", 2022, population_limits=[18, 65])
+    # no numpy scalars nor pandas objects
+    assert {type(value) for value in row.values()} <= {int, float, str, list}
+    # rows are copies
+    row["province"] = "changed"
+    assert lookup.province("MI", 2022, population_limits=[18, 65])["province"] == (
+        "Milano"
+    )
+
+
+def test_lookup_not_found():
+    for value in ["not a province", "XX", 999, float("nan"), None, float("inf")]:
+        assert lookup.province(value, 2022) is None
+
+
+def test_prepare():
+    lookup.prepare(["region"], 2023)
+    assert ("region", 2023, "total") in lookup._indices
+    with pytest.raises(ValueError):
+        lookup.prepare(["country"])
@@ -0,0 +1,94 @@
+import os
+import shutil
+
+import pytest
+
+from italy_geopop import geopop
+from italy_geopop._manifest import (
+    build_manifest,
+    list_data_files,
+    manifest_file_name,
+    read_manifest,
+    validate_data_directory,
+)
+from italy_geopop._storage import read_table, write_table
+from italy_geopop.geopop import Geopop, _data_abs_dir, add_data_directory
+
+
+@pytest.fixture
+def data_directory(tmp_path):
+    for file in [
+        "2022_italy_provinces.feather",
+        "2023_italy_provinces.delta.feather",
+        "2022_italy_adjacency_province.npz",
+    ]:
+        shutil.copy(os.path.join(_data_abs_dir, file), tmp_path)
+    return tmp_path
+
+
+def test_build_manifest_describes_files(data_directory):
+    manifest = build_manifest(data_directory)
+    assert manifest == read_manifest(data_directory)
+    entry = manifest["files"]["2022_italy_provinces.feather"]
+    assert entry["year"] == 2022
+    assert entry["table"] == "provinces"
+    assert entry["variant"] is None
+    assert entry["format"] == "feather"
+    assert entry["rows"] == 107
+    assert entry["schema"]["province_code"] == "int64"
+    assert manifest["files"]["2023_italy_provinces.delta.feather"]["variant"] == "delta"
+    assert manifest["files"]["2022_italy_adjacency_province.npz"]["rows"] is None
+
+
+def test_list_data_files_reads_manifest_instead_of_directory(
+    data_directory, monkeypatch
+):
+    build_manifest(data_directory)
+
+    def listdir(path):
+        raise AssertionError("directory scanned")
+
+    monkeypatch.setattr(os, "listdir", listdir)
+    assert list_data_files(data_directory) == {
+        "2022_italy_provinces.feather",
+        "2023_italy_provinces.delta.feather",
+        "2022_italy_adjacency_province.npz",
+    }
+    monkeypatch.undo()
+    # files added after the manifest are listed from the directory
+    write_table(
+        data_directory, 2022, "regions", read_table(_data_abs_dir, 2022, "regions")
+    )
+    assert "2022_italy_regions.feather" in list_data_files(data_directory)
+
+
+def test_validate_data_directory(data_directory):
+    assert validate_data_directory(data_directory) == []
+    build_manifest(data_directory)
+    assert validate_data_directory(data_directory, checksums=True) == []
+    with open(data_directory / "2022_italy_provinces.feather", "ab") as f:
+        f.write(b"\0")
+    os.remove(data_directory / "2022_italy_adjacency_province.npz")
+    problems = validate_data_directory(data_directory)
+    assert len(problems) == 2
+    assert "2022_italy_adjacency_province.npz is missing" in problems
+
+
+def test_add_data_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(geopop, "_user_data_dirs", [])
+    with pytest.raises(FileNotFoundError):
+        add_data_directory(tmp_path)
+    for table in ["provinces", "regions"]:
+        write_table(tmp_path, 2030, table, read_table(_data_abs_dir, 2022, table))
+    build_manifest(tmp_path)
+    add_data_directory(tmp_path, checksums=True)
+    assert geopop._user_data_dirs == [str(tmp_path)]
+    with pytest.warns(UserWarning, match="lack municipalities, pop"):
+        gp = Geopop(2030)
+    assert len(gp.italy_regions) == 20
+    assert Geopop(2022)._data_dir == _data_abs_dir
+
+    os.remove(tmp_path / "2030_italy_regions.feather")
+    with pytest.raises(FileNotFoundError):
+        add_data_directory(tmp_path)
+    assert os.path.exists(tmp_path / manifest_file_name)
@@ -1,11 +1,9 @@
-import geopandas as gpd
 import pandas as pd
 import numpy as np
 
 import pytest
 
 from italy_geopop._utils import generate_labels_for_age_cutoffs, prepare_limits
-from italy_geopop.geopop import Geopop
 from italy_geopop.pandas_extension import pandas_activate_context
 
 
@@ -27,6 +25,17 @@ _region_columns = [
     "region_code",
 ]
 
+_geo_stats_columns = [
+    "area_km2",
+    "min_lon",
+    "min_lat",
+    "max_lon",
+    "max_lat",
+    "centroid_lon",
+    "centroid_lat",
+    "density",
+]
+
 _total_population_columns = [
     "population",
     "population_M",
@@ -73,7 +82,9 @@ def dummy_series() -> pd.Series:
 @pytest.fixture(params=["names", "codes", "both"])
 def municipality(request) -> pd.Series:
     """
-    Returns a pd.Series with some valid municipality names if params='name' else municipality codes if params='codes' else myxed-type. This function ensures that returned municipalities are unique in Italy municipalities.
+    Returns a pd.Series with some valid municipality names if params='name' else municipality codes
+    if params='codes' else myxed-type. This function ensures that returned municipalities are unique
+    in Italy municipalities.
     """
     if request.param == "names":
         return pd.Series(
@@ -164,7 +175,8 @@ def not_unequivocal_municipality_name_complex() -> pd.Series:
 @pytest.fixture(params=["names", "codes", "abbreviation", "mixed"])
 def province(request) -> pd.Series:
     """
-    Returns a pd.Series with some valid provinces names if type='names', provinces codes if type='codes', province abbreviations if type='abbreviation' else mixed-type list.
+    Returns a pd.Series with some valid provinces names if type='names', provinces codes if
+    type='codes', province abbreviations if type='abbreviation' else mixed-type list.
     """
     if request.param == "names":
         return pd.Series(
@@ -485,6 +497,7 @@ def test_pandas_extension_from_province_returns_right_columns(
         ["municipalities"]
         + _province_columns
         + _region_columns
+        + _geo_stats_columns
         + pop_cols
         + (["geometry"] if include_geometry else [])
     ):
@@ -569,6 +582,7 @@ def test_pandas_extension_from_region_returns_right_columns(
     for c in (
         ["provinces"]
         + _region_columns
+        + _geo_stats_columns
         + pop_cols
         + (["geometry"] if include_geometry else [])
     ):
@@ -685,4 +699,204 @@ def test_pandas_extension_return_nan_for_non_unequivocal_region_name(
     assert output.isna().all().all()
 
 
+# Test level detection
+
+
+@pytest.fixture
+def mixed_levels() -> pd.Series:
+    """
+    Returns a pd.Series that mixes regions, provinces and municipalities as names and codes.
+    """
+    return pd.Series(["Lombardia", "MI", "Milano", "015146", "F205", "015", 3, "xyz"])
+
+
+def test_pandas_extension_resolve_detects_levels(mixed_levels):
+    with pandas_activate_context(data_year=2022):
+        output = mixed_levels.italy_geopop.resolve()
+    assert output.level.to_list()[:-1] == [
+        "region",
+        "province",
+        "municipality",
+        "municipality",
+        "municipality",
+        "province",
+        "region",
+    ]
+    assert pd.isna(output.level.iloc[-1])
+    assert output.region_code.to_list()[:-1] == [3] * 7
+    assert output.province_code.to_list()[1:6] == [15] * 5
+    assert output.municipality_code.to_list()[2:5] == [15146] * 3
+
+
+@pytest.mark.parametrize("population_limits", ["auto", "total", [50.0, 75]])
+def test_pandas_extension_resolve_returns_population_of_detected_level(
+    mixed_levels, population_limits
+):
+    with pandas_activate_context(data_year=2022):
+        output = mixed_levels.italy_geopop.resolve(population_limits=population_limits)
+        expected = pd.concat(
+            [
+                mixed_levels.iloc[[0]].italy_geopop.from_region(
+                    population_limits=population_limits
+                ),
+                mixed_levels.iloc[[1]].italy_geopop.from_province(
+                    population_limits=population_limits
+                ),
+                mixed_levels.iloc[[2]].italy_geopop.from_municipality(
+                    population_limits=population_limits
+                ),
+            ]
+        )
+    assert [c for c in output.columns if c not in expected.columns] == ["level"]
+    pop_cols = output.columns[4:]
+    assert (output.loc[[0, 1, 2], pop_cols] == expected[pop_cols]).all().all()
+
+
+# Test crosswalk
+
+
+@pytest.fixture
+def variations() -> pd.DataFrame:
+    """
+    Returns a pd.DataFrame of administrative variations, Malgesso is split into two municipalities.
+    """
+    return pd.DataFrame(
+        {
+            "municipality_code": [5079, 5110, 12095, 12095],
+            "successor_code": [5005, 5005, 12011, 12012],
+        }
+    )
+
+
+def test_pandas_extension_remap_municipality_maps_previous_years(variations):
+    s = pd.Series([5079, "Tonengo", "Agliè", "xyz"], index=[0, 0, 1, 2])
+    with pandas_activate_context(data_year=2023):
+        output = s.italy_geopop.remap_municipality(variations=variations)
+    assert (output.index == s.index).all()
+    assert output.to_list()[:-1] == [5005, 5005, 1001]
+    assert np.isnan(output.iloc[-1])
+
+
+def test_pandas_extension_remap_municipality_returns_weighted_splits(variations):
+    with pandas_activate_context(data_year=2023):
+        output = pd.Series(["Malgesso", 1001]).italy_geopop.remap_municipality(
+            variations=variations, splits=True
+        )
+    assert output.index.to_list() == [0, 0, 1]
+    assert output.municipality_code.to_list()[:2] in ([12011, 12012], [12012, 12011])
+    assert output.weight.iloc[:2].sum() == pytest.approx(1)
+    assert output.weight.iloc[2] == 1
+
+
+# Test dataframe accessor
+
+
+@pytest.fixture
+def municipality_province_region_df() -> pd.DataFrame:
+    """
+    Returns a pd.DataFrame with municipality, province and region columns, including same-named
+    municipalities and an inconsistent row.
+    """
+    return pd.DataFrame(
+        {
+            "municipality": ["Samone", "Samone", "Castro", "Milano"],
+            "province": ["TO", "TN", "Lecce", "RM"],
+            "region": ["Piemonte", 4, "Puglia", "Lazio"],
+        },
+        index=[5, 3, 1, 7],
+    )
+
+
+@pytest.mark.parametrize("include_geometry", [True, False])
+def test_pandas_extension_dataframe_resolve_uses_province_to_break_ties(
+    municipality_province_region_df, include_geometry
+):
+    with pandas_activate_context(include_geometry=include_geometry, data_year=2022):
+        output = municipality_province_region_df.italy_geopop.resolve(
+            {
+                "municipality": "municipality",
+                "province": "province",
+                "region": "region",
+            }
+        )
+    assert (output.index == municipality_province_region_df.index).all()
+    assert output.municipality_code.to_list() == [1235, 22165, 75096, 15146]
+    assert output.municipality_in_province.to_list() == [True, True, True, False]
+    assert output.municipality_in_region.to_list() == [True, True, True, False]
+    assert output.province_in_region.to_list() == [True, True, True, True]
+
+
+def test_pandas_extension_dataframe_resolve_returns_integer_codes():
+    df = pd.DataFrame({"municipality": ["Samone", "Nowhere"], "province": ["TO", "MI"]})
+    with pandas_activate_context(data_year=2022):
+        output = df.italy_geopop.resolve(
+            {"municipality": "municipality", "province": "province"}
+        )
+    for col in ["municipality_code", "province_code", "region_code"]:
+        assert output[col].dtype == "Int64"
+    assert output.municipality_code.iloc[0] == 1235
+    assert output.municipality_code.isna().iloc[1]
+
+
+def test_pandas_extension_dataframe_resolve_keeps_upper_codes_if_not_found():
+    df = pd.DataFrame(
+        {
+            "municipality": ["Nowhere", "Nowhere", "Nowhere", "Samone"],
+            "province": ["MI", "XX", "XX", "TO"],
+            "region": [None, "Lazio", None, "Piemonte"],
+        }
+    )
+    with pandas_activate_context(data_year=2022):
+        output = df.italy_geopop.resolve(
+            {"municipality": "municipality", "province": "province", "region": "region"}
+        )
+        only_province = df.italy_geopop.resolve(
+            {"municipality": "municipality", "province": "province"}
+        )
+    assert output.municipality_code.isna().iloc[:3].all()
+    assert output.province_code.to_list() == [15, pd.NA, pd.NA, 1]
+    assert output.region_code.to_list() == [3, 12, pd.NA, 1]
+    assert output.municipality.isna().iloc[:3].all()
+    assert output.municipality_in_province.isna().iloc[:3].all()
+    assert only_province.province_code.to_list() == [15, pd.NA, pd.NA, 1]
+    assert only_province.region_code.to_list() == [3, pd.NA, pd.NA, 1]
+
+
+def test_pandas_extension_dataframe_resolve_returns_na_flags_if_not_found():
+    df = pd.DataFrame({"municipality": ["Milano", "Milano"], "province": ["MI", "XX"]})
+    with pandas_activate_context(data_year=2022):
+        output = df.italy_geopop.resolve(
+            {"municipality": "municipality", "province": "province"},
+            return_cols=["municipality_code", "municipality_in_province"],
+        )
+    assert output.municipality_code.to_list() == [15146, 15146]
+    assert output.municipality_in_province.iloc[0]
+    assert output.municipality_in_province.isna().iloc[1]
+
+
+@pytest.mark.parametrize(
+    "columns",
+    [
+        {"municipality": "city"},
+        {"municipality": "province", "province": "province"},
+    ],
+)
+def test_pandas_extension_dataframe_resolve_raises_for_invalid_levels(
+    municipality_province_region_df, columns
+):
+    with pandas_activate_context(data_year=2022):
+        with pytest.raises(ValueError):
+            municipality_province_region_df.italy_geopop.resolve(columns)
+
+
+def test_pandas_extension_with_regions_finds_only_their_municipalities():
+    s = pd.Series(["Milano", "Venezia", "Torino"])
+    with pandas_activate_context(data_year=2022, regions=["Lombardia", "Veneto"]):
+        output = s.italy_geopop.from_municipality(
+            return_cols=["municipality_code", "region"]
+        )
+    assert output.municipality_code.iloc[:2].to_list() == [15146, 27042]
+    assert output.region.iloc[:2].to_list() == ["Lombardia", "Veneto"]
+    assert output.iloc[2].isna().all()
+
 # Decide if is worth to add a test that checks if returned data is correct
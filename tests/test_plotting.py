@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("matplotlib")
+
+from italy_geopop.geopop import Geopop  # noqa: E402
+from italy_geopop.plotting import ChoroplethRenderer, render_choropleths  # noqa: E402
+
+
+@pytest.fixture
+def indicators_df() -> pd.DataFrame:
+    return Geopop(data_year=2022).get_demographic_indicators("region")[
+        ["median_age", "sex_ratio", "old_age_index"]
+    ]
+
+
+def test_renderer_reuses_paths_and_swaps_colors(indicators_df):
+    renderer = ChoroplethRenderer(level="region", data_year=2022)
+    other = ChoroplethRenderer(level="region", data_year=2022)
+    assert other.collection.get_paths()[0] is renderer.collection.get_paths()[0]
+    renderer.render(indicators_df.median_age)
+    first_colors = renderer.collection.get_array().copy()
+    renderer.render(indicators_df.sex_ratio.drop(1))
+    assert renderer.collection.get_array().mask.sum() == 1
+    assert (renderer.collection.get_array() != first_colors).any()
+
+
+def test_renderer_with_cached_paths_does_not_load_geometry(monkeypatch):
+    ChoroplethRenderer(level="region", data_year=2022)
+
+    def get_geometry(*args, **kwargs):
+        raise AssertionError("geometry should not be loaded")
+
+    monkeypatch.setattr(Geopop, "get_geometry", get_geometry)
+    renderer = ChoroplethRenderer(level="region", data_year=2022)
+    assert len(renderer.collection.get_paths()) == 20
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_render_choropleths_writes_every_map(tmp_path, indicators_df, n_jobs):
+    paths = render_choropleths(
+        indicators_df, tmp_path, level="region", n_jobs=n_jobs, data_year=2022
+    )
+    assert paths == [str(tmp_path / f"{col}.png") for col in indicators_df.columns]
+    for path in paths:
+        with open(path, "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+def test_renderer_raises_if_level_is_not_valid():
+    with pytest.raises(ValueError):
+        ChoroplethRenderer(level="country")
@@ -0,0 +1,171 @@
+import asyncio
+import json
+
+import pytest
+
+from italy_geopop import geopop
+from italy_geopop.serve import MicroBatcher, Resolver, Server
+
+
+@pytest.fixture(scope="module")
+def server():
+    resolver = Resolver(2022)
+    resolver.warm_up()
+    return Server(resolver)
+
+
+async def _request(port, method, target, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = b"" if body is None else json.dumps(body).encode()
+    writer.write(
+        f"{method} {target} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def test_serve_over_http(server):
+    async def main():
+        async with await server.start("127.0.0.1", 0) as asyncio_server:
+            port = asyncio_server.sockets[0].getsockname()[1]
+            return await asyncio.gather(
+                _request(port, "GET", "/resolve?value=MI&value=F205&value=nowhere"),
+                _request(
+                    port,
+                    "POST",
+                    "/population",
+                    {"values": ["MI"], "level": "province", "limits": [18, 65]},
+                ),
+                _request(port, "GET", "/health"),
+                _request(port, "GET", "/unknown"),
+            )
+
+    resolved, population, health, unknown = asyncio.run(main())
+    assert resolved == (
+        200,
+        {
+            "results": [
+                {
+                    "level": "province",
+                    "municipality_code": None,
+                    "province_code": 15,
+                    "region_code": 3,
+                },
+                {
+                    "level": "municipality",
+                    "municipality_code": 15146,
+                    "province_code": 15,
+                    "region_code": 3,
+                },
+                {
+                    "level": None,
+                    "municipality_code": None,
+                    "province_code": None,
+                    "region_code": None,
+                },
+            ]
+        },
+    )
+    status, payload = population
+    assert status == 200
+    assert {"<18", "18-65", ">=65"} <= set(payload["results"][0])
+    assert health == (200, {"status": "ok", "data_year": 2022})
+    assert unknown[0] == 404
+
+
+def test_serve_merges_concurrent_requests(server):
+    geometry = server.resolver.geopop.italy_municipalities_geometry.geometry
+    point = geometry.loc[15146].representative_point()
+
+    async def main():
+        values = ["MI", "TO", "Roma", "F205"] * 50
+        results = await asyncio.gather(
+            *(server.handle("GET", f"/resolve?value={value}") for value in values),
+            server.handle("GET", f"/reverse?lon={point.x}&lat={point.y}"),
+            server.handle("POST", "/reverse", json.dumps({"points": [[0, 0]]})),
+        )
+        return results, (await server.handle("GET", "/metrics"))[1]
+
+    results, metrics = asyncio.run(main())
+    assert [status for status, _ in results] == [200] * len(results)
+    assert results[0][1]["results"][0]["province_code"] == 15
+    assert results[-2][1]["results"][0]["municipality_code"] == 15146
+    assert results[-1][1] == {"results": [None]}
+    resolve = metrics["endpoints"]["resolve"]
+    assert resolve["requests"] >= 200
+    # 200 concurrent values, far fewer vectorized calls
+    assert resolve["batches"]["count"] < 10
+    assert resolve["latency_ms"]["p99"] >= resolve["latency_ms"]["p50"]
+
+
+def test_resolver_reuses_geopop(server, monkeypatch):
+    def build(*args, **kwargs):
+        raise AssertionError("Geopop built for a batch")
+
+    monkeypatch.setattr(geopop, "Geopop", build)
+    assert server.resolver.resolve(["MI"])[0]["province_code"] == 15
+
+
+@pytest.mark.parametrize(
+    "target",
+    ["/resolve?value=MI&level=country", "/population?value=MI&limits=young"],
+)
+def test_serve_rejects_invalid_requests(server, target):
+    status, payload = asyncio.run(server.handle("GET", target))
+    assert status == 400
+    assert "error" in payload
+
+
+@pytest.mark.parametrize(
+    "body",
+    [{"values": "MI"}, {"values": [["MI"]]}, {"values": [{"value": "MI"}]}],
+)
+def test_serve_rejects_values_that_are_not_a_list_of_scalars(server, body):
+    status, payload = asyncio.run(
+        server.handle("POST", "/resolve", json.dumps(body).encode())
+    )
+    assert status == 400
+    assert "error" in payload
+
+
+def test_serve_accepts_value_in_body(server):
+    async def main():
+        return await asyncio.gather(
+            server.handle("POST", "/resolve", json.dumps({"value": "MI"})),
+            server.handle("POST", "/resolve", json.dumps({"value": ["MI", "TO"]})),
+        )
+
+    (status, payload), (statuses, payloads) = asyncio.run(main())
+    assert status == 200
+    assert [row["province_code"] for row in payload["results"]] == [15]
+    assert statuses == 200
+    assert [row["province_code"] for row in payloads["results"]] == [15, 1]
+
+
+def test_serve_reverse_without_geometry(monkeypatch):
+    resolver = Resolver(2022)
+    monkeypatch.setattr(resolver, "can_reverse", False)
+    # starts anyway
+    resolver.warm_up()
+    status, payload = asyncio.run(
+        Server(resolver).handle("GET", "/reverse?lon=9.19&lat=45.46")
+    )
+    assert status == 503
+    assert "geometry of municipalities" in payload["error"]
+
+
+def test_micro_batcher_propagates_errors():
+    def fn(items):
+        raise RuntimeError("broken")
+
+    async def main():
+        batcher = MicroBatcher(fn)
+        return await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+
+    assert [str(e) for e in asyncio.run(main())] == ["broken", "broken"]
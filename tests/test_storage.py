@@ -0,0 +1,182 @@
+import os
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import Point, Polygon
+
+from italy_geopop._storage import (
+    _to_builtin,
+    build_reprojected_files,
+    decode_delta,
+    encode_delta,
+    full_file_name,
+    read_geometry,
+    read_table,
+    reprojected_file_name,
+    select_storage_formats,
+    write_table,
+)
+from italy_geopop.geopop import Geopop, _data_abs_dir
+
+
+def _read_geo_table(year: int, table: str) -> gpd.GeoDataFrame:
+    # packaged geometry is stored as topology, not as geometry tables
+    level = {"geo_provinces": "province", "geo_regions": "region"}[table]
+    return Geopop(year).get_geometry(level).reset_index()
+
+
+@pytest.fixture
+def base_df() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {
+            "code": [1, 2, 3],
+            "name": ["a", "b", "c"],
+            "geometry": [Point(0, 0), Point(1, 1), Point(2, 2)],
+        },
+        crs="EPSG:4326",
+    )
+
+
+@pytest.fixture
+def next_df() -> gpd.GeoDataFrame:
+    # 1 is removed, 2 is unchanged, 3 is renamed, 4 is added
+    return gpd.GeoDataFrame(
+        {
+            "code": [4, 3, 2],
+            "name": ["d", "C", "b"],
+            "geometry": [Point(3, 3), Point(2, 2), Point(1, 1)],
+        },
+        crs="EPSG:4326",
+    )
+
+
+def test_encode_delta_keeps_only_changed_values(base_df, next_df):
+    delta_df = encode_delta(base_df, next_df, ["code"])
+    assert delta_df.code.to_list() == [4, 3, 2]
+    assert delta_df._changed.to_list() == [True, True, False]
+    assert delta_df.name.isna().to_list() == [False, False, True]
+    assert delta_df.geometry.isna().to_list() == [False, False, True]
+
+
+def test_decode_delta_rebuilds_table(base_df, next_df):
+    decoded_df = decode_delta(
+        base_df, encode_delta(base_df, next_df, ["code"]), ["code"]
+    )
+    assert isinstance(decoded_df, gpd.GeoDataFrame)
+    assert (decoded_df.dtypes == next_df.dtypes).all()
+    assert decoded_df.drop(columns="geometry").equals(next_df.drop(columns="geometry"))
+    assert decoded_df.geometry.geom_equals(next_df.geometry).all()
+    # unchanged geometries are shared with the base table
+    assert decoded_df.geometry.iloc[2] is base_df.geometry.iloc[1]
+
+
+def test_delta_keeps_rewritten_geometries(base_df):
+    # same shape, vertices start from another corner
+    square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    rewritten = Polygon([(1, 1), (0, 1), (0, 0), (1, 0)])
+    base_df = base_df.assign(geometry=[square, Point(1, 1), Point(2, 2)])
+    next_df = base_df.assign(geometry=[rewritten, Point(1, 1), Point(2, 2)])
+    delta_df = encode_delta(base_df, next_df, ["code"])
+    assert delta_df._changed.to_list() == [True, False, False]
+    decoded_df = decode_delta(base_df, delta_df, ["code"])
+    assert decoded_df.geometry.geom_equals_exact(next_df.geometry, 0).all()
+
+
+@pytest.mark.parametrize("table", ["geo_provinces", "geo_regions"])
+def test_delta_roundtrip_is_exact(table):
+    base_df = _read_geo_table(2022, table)
+    df = _read_geo_table(2023, table)
+    keys = [f"{table[4:-1]}_code"]
+    decoded_df = decode_delta(base_df, encode_delta(base_df, df, keys), keys)
+    assert decoded_df.drop(columns="geometry").equals(df.drop(columns="geometry"))
+    assert decoded_df.geometry.geom_equals_exact(df.geometry, 0).all()
+    assert (decoded_df.geometry.to_wkb() == df.geometry.to_wkb()).all()
+
+
+@pytest.mark.parametrize(
+    "table,expected_length",
+    [("municipalities", 7899), ("provinces", 107), ("stats_regions", 20)],
+)
+def test_read_table_rebuilds_packaged_deltas(table, expected_length):
+    df = read_table(_data_abs_dir, 2023, table)
+    assert len(df) == expected_length
+    assert not df.drop(columns="geometry", errors="ignore").isna().any().any()
+
+
+def test_read_geometry_caches_reprojections(tmp_path):
+    _read_geo_table(2022, "geo_regions").to_feather(
+        tmp_path / full_file_name(2022, "geo_regions")
+    )
+    reprojected = read_geometry(tmp_path, 2022, "geo_regions", 3857)
+    assert reprojected.crs.to_epsg() == 3857
+    reprojected.loc[0, "region_code"] = -1
+    assert (
+        read_geometry(tmp_path, 2022, "geo_regions", "EPSG:3857").region_code[0] != -1
+    )
+
+
+def test_read_geometry_uses_prebuilt_files(tmp_path):
+    _read_geo_table(2022, "geo_regions").to_feather(
+        tmp_path / full_file_name(2022, "geo_regions")
+    )
+    written = build_reprojected_files(
+        tmp_path, 2022, crss=["EPSG:32632"], tables=["geo_regions"]
+    )
+    assert written == [reprojected_file_name(2022, "geo_regions", "EPSG:32632")]
+    prebuilt = read_geometry(tmp_path, 2022, "geo_regions", 32632)
+    expected = read_table(tmp_path, 2022, "geo_regions").to_crs(32632)
+    assert prebuilt.geometry.geom_equals_exact(expected.geometry, 1e-3).all()
+
+
+@pytest.mark.parametrize("storage_format", ["ipc", "lz4", "zstd", "parquet"])
+@pytest.mark.parametrize("table", ["provinces", "geo_regions"])
+def test_write_table_roundtrips_every_storage_format(tmp_path, table, storage_format):
+    if table.startswith("geo_"):
+        df = _read_geo_table(2022, table)
+    else:
+        df = read_table(_data_abs_dir, 2022, table)
+    write_table(tmp_path, 2022, table, df)
+    file_name = write_table(tmp_path, 2022, table, df, storage_format)
+    # the file of the previous format is replaced
+    assert os.listdir(tmp_path) == [file_name]
+    assert file_name == full_file_name(2022, table, storage_format)
+    read_df = read_table(tmp_path, 2022, table)
+    assert type(read_df) is type(df)
+    assert read_df.drop(columns="geometry", errors="ignore").equals(
+        df.drop(columns="geometry", errors="ignore")
+    )
+
+
+def test_write_table_raises_on_invalid_storage_format(tmp_path):
+    with pytest.raises(ValueError):
+        write_table(tmp_path, 2022, "provinces", pd.DataFrame(), "csv")
+
+
+def test_select_storage_formats(tmp_path, monkeypatch):
+    for year in [2022, 2023]:
+        write_table(
+            tmp_path, year, "regions", read_table(_data_abs_dir, year, "regions")
+        )
+    benchmark_df = select_storage_formats(tmp_path, repeat=1)
+    assert benchmark_df.columns.to_list() == ["size", "load_time", "selected"]
+    assert benchmark_df.loc["regions"].selected.sum() == 1
+
+    benchmark_df = select_storage_formats(tmp_path, objective="smallest", repeat=1)
+    selected = benchmark_df.loc["regions"].query("selected").index[0]
+    assert selected == benchmark_df.loc["regions"]["size"].idxmin()
+
+    monkeypatch.setenv("ITALY_GEOPOP_STORAGE_FORMAT", "parquet")
+    select_storage_formats(tmp_path, repeat=1)
+    assert sorted(os.listdir(tmp_path)) == [
+        "2022_italy_regions.parquet",
+        "2023_italy_regions.parquet",
+    ]
+    read_df = read_table(tmp_path, 2023, "regions")
+    expected = read_table(_data_abs_dir, 2023, "regions")
+    assert read_df.region_code.equals(expected.region_code)
+    assert repr(_to_builtin(read_df.provinces.values)) == repr(
+        _to_builtin(expected.provinces.values)
+    )
+    with pytest.raises(ValueError):
+        select_storage_formats(tmp_path, objective="fast")
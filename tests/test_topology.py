@@ -0,0 +1,125 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Polygon, box
+
+from italy_geopop._storage import full_file_name
+from italy_geopop._topology import (
+    Topology,
+    build_topology_file,
+    has_topology,
+    read_topology,
+    topology_file_name,
+)
+from italy_geopop.geopop import Geopop
+
+
+@pytest.fixture
+def grid() -> gpd.GeoSeries:
+    # 3x2 grid of unit squares, the middle one of the first row has a hole
+    # filled by an enclave, codes 1-6 and 7 for the enclave
+    squares = {
+        1 + x + 3 * y: box(x, y, x + 1, y + 1) for y in range(2) for x in range(3)
+    }
+    enclave = box(1.25, 0.25, 1.75, 0.75)
+    squares[2] = Polygon(squares[2].exterior, [enclave.exterior])
+    squares[7] = enclave
+    return gpd.GeoSeries(squares).rename_axis("municipality_code")
+
+
+@pytest.fixture
+def topology(grid) -> Topology:
+    return Topology.from_geometry(grid)
+
+
+def test_topology_stores_shared_borders_once(topology):
+    # 17 unit edges of the grid, 1 closed ring of the enclave
+    assert len(topology.arc_offsets) - 1 <= 18
+    arcs = np.where(topology.ring_arcs < 0, ~topology.ring_arcs, topology.ring_arcs)
+    assert np.bincount(arcs).max() == 2
+
+
+def test_topology_rebuilds_geometry(grid, topology):
+    geometry = topology.to_geometry()
+    assert geometry.index.equals(grid.index)
+    assert geometry.is_valid.all()
+    assert geometry.geom_equals(grid).all()
+
+
+def test_topology_merges_groups(grid, topology):
+    groups = pd.Series([1, 1, 1, 2, 2, 2, 1], index=grid.index, name="province_code")
+    merged = topology.merge(groups)
+    assert merged.index.to_list() == [1, 2]
+    assert merged.index.name == "province_code"
+    assert merged.is_valid.all()
+    assert merged.geom_equals(
+        gpd.GeoSeries([box(0, 0, 3, 1), box(0, 1, 3, 2)], index=[1, 2])
+    ).all()
+    # without the enclave its province has a hole
+    merged = topology.merge(groups.drop(7))
+    assert merged.loc[1].area == pytest.approx(2.75)
+    assert len(merged.loc[1].interiors) == 1
+
+
+def test_topology_simplify_keeps_neighbors_seamless():
+    # two areas sharing a wiggly border
+    wiggle = [(1 + 0.01 * (i % 2), i / 10) for i in range(11)]
+    left = Polygon([(0, 0), *wiggle, (0, 1)])
+    right = Polygon([(2, 0), (2, 1), *wiggle[::-1]])
+    topology = Topology.from_geometry(gpd.GeoSeries([left, right], index=[1, 2]))
+    simplified = topology.simplify(0.05)
+    assert len(simplified.arc_coords) < len(topology.arc_coords)
+    geometry = simplified.to_geometry()
+    assert geometry.is_valid.all()
+    assert geometry.area.sum() == pytest.approx(2)
+    assert geometry.iloc[0].intersection(geometry.iloc[1]).area == pytest.approx(0)
+
+
+def test_topology_file_roundtrip(tmp_path, grid, topology):
+    assert read_topology(tmp_path, 2022) is None
+    assert build_topology_file(tmp_path, 2022, grid) == [topology_file_name(2022)]
+    loaded = read_topology(tmp_path, 2022)
+    assert loaded.codes.name == "municipality_code"
+    assert loaded.codes.equals(topology.codes)
+    assert np.array_equal(loaded.arc_coords, topology.arc_coords)
+    assert loaded.to_geometry().geom_equals(grid).all()
+
+
+def test_topology_file_removes_derived_geometry_files(tmp_path, grid):
+    provinces = grid.rename_axis("province_code")
+    for table in ["geo_municipalities", "geo_provinces", "geo_regions"]:
+        gpd.GeoDataFrame(geometry=grid).to_feather(
+            tmp_path / full_file_name(2022, table)
+        )
+    assert build_topology_file(
+        tmp_path, 2022, provinces, remove_geometry_files=True
+    ) == [topology_file_name(2022, "province")]
+    assert sorted(os.listdir(tmp_path)) == [
+        full_file_name(2022, "geo_municipalities"),
+        topology_file_name(2022, "province"),
+    ]
+    assert not has_topology(tmp_path, 2022, "municipality")
+    assert has_topology(tmp_path, 2022, "province")
+    assert read_topology(tmp_path, 2022).codes.name == "province_code"
+    with pytest.raises(ValueError):
+        build_topology_file(tmp_path, 2022, grid.rename_axis("region_code"))
+
+
+@pytest.mark.parametrize("data_year", [2022, 2023])
+def test_geopop_derives_geometry_from_packaged_topology(data_year):
+    gp = Geopop(data_year)
+    # packaged data store the topology of provinces instead of geometry files
+    assert gp.get_topology().codes.name == "province_code"
+    for level, df in [("province", gp.italy_provinces), ("region", gp.italy_regions)]:
+        geometry = gp.get_geometry(level).geometry
+        assert geometry.index.sort_values().equals(df.index.sort_values())
+        assert geometry.is_valid.all()
+        # areas were precomputed from the original geometry files
+        assert np.allclose(
+            geometry.to_crs(32632).area / 1e6,
+            df.area_km2.reindex(geometry.index),
+            rtol=1e-4,
+        )